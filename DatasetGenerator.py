@@ -6,6 +6,13 @@ import torch
 import numpy as np
 import itk
 import time
+import concurrent.futures
+import multiprocessing
+
+import Manifest
+import Misc
+import PackedStore
+from ExecutionProfile import ExecutionProfile, get_physical_cores
 
 class Timer():
     def __init__(self):
@@ -19,15 +26,41 @@ def get_colour(x, N):
     return (x/N, 0.5, 0.5)
     #return colorsys.hsv_to_rgb(x*1.0/N, 0.5, 0.5)
 
+def init_conversion_worker(number_of_threads):
+    """
+    Initializes a conversion worker process, the cores are split across the workers to avoid oversubscription
+    :param number_of_threads: (int) Number of intra-op threads of the worker
+    """
+    torch.set_num_threads(number_of_threads)
+
+
 class WeaponDatasetGenerator():
     def __init__(self, root, target_path,start_index=0, end_index=-1, threshold_min=0, threshold_max=50000, 
-                dim_max=640, side_len=16):
+                dim_max=640, side_len=16, packed=False, shard_size_mb=4096, storage_dtype='float32',
+                device='cuda', streaming=False, memory_budget_mb=1024, side_lens=None, execution_profile=None):
         self.threshold_min = threshold_min
         self.threshold_max = threshold_max
+        # Optional resolution pyramid, every level is derived from the finest level of a single read of each scan
+        self.side_lens = sorted(side_lens) if side_lens is not None else None
+        if self.side_lens is not None:
+            side_len = self.side_lens[0]
+            assert all(level_side_len % side_len == 0 for level_side_len in self.side_lens), \
+                'Every side length of the pyramid has to be a multiple of the smallest side length'
         self.side_len = side_len
         self.dim_max = int(dim_max / side_len)
+        self.root = root
         self.target_path=target_path
-        self.device = 'cuda'
+        # Device and thread settings of conversions in this process, autocast is not used for downsampling
+        self.execution_profile = execution_profile if execution_profile is not None else ExecutionProfile(device)
+        self.device = self.execution_profile.device
+        # Read and downsample volumes slab by slab on the CPU with bounded memory
+        self.streaming = streaming
+        self.memory_budget_mb = memory_budget_mb
+        # Write all samples into packed shards instead of single files
+        self.packed = packed
+        self.shard_size_mb = shard_size_mb
+        # Storage format of pooled volumes ('float32', 'float16', 'uint16' or 'uint8' with scale and offset)
+        self.storage_dtype = storage_dtype
 
         self.data = []
         mixed_labels = []
@@ -43,30 +76,254 @@ class WeaponDatasetGenerator():
                         self.data.append(os.path.join(direc,file))
 
         self.labels = [None] * len(self.data)
-        # match data files with label files
-        for i, d in enumerate(self.data):
-            name, _ = os.path.splitext(d)
-            for l in mixed_labels:
-                if l.startswith(name):
+        # match data files with label files, every data file gets the first label file starting with its name
+        data_indexes = {os.path.splitext(d)[0]: i for i, d in enumerate(self.data)}
+        min_name_length = min([len(name) for name in data_indexes.keys()], default=0)
+        for l in mixed_labels:
+            for prefix_length in range(min_name_length, len(l) + 1):
+                i = data_indexes.get(l[:prefix_length], None)
+                if i is not None and self.labels[i] is None:
                     self.labels[i] = l
-                    break
         self.data = self.data[start_index:end_index]
         self.labels = self.labels[start_index:end_index]
         print("File paths", t1.stop())
 
 
-    def generate_data(self):
-        for index in range(len(self.data)):
-            print(index, "/",len(self.data))
-            data_file = self.data[index]
-            label_file = self.labels[index]
-
-            # Check if label in place
-            labels = itk.imread(label_file)
-            try:
-                offsets_n = np.flip(np.array(labels.GetMetaDataDictionary()["DomainFirst"].split(" "), dtype=np.int), 0)
-            except:
+    def generate_data(self, num_workers=0, memory_budget_mb=16384, memory_factor=6.0, incremental=True,
+                      verify_outputs=False):
+        """
+        Converts all new or changed scans and writes the downsampled volumes, labels and the manifests
+        :param num_workers: (int) Number of worker processes used for conversion, 0 converts in this process
+        :param memory_budget_mb: (int) Memory budget of all scans converted at the same time
+        :param memory_factor: (float) Estimated peak memory of a conversion relative to the size of the scan file
+        :param incremental: (bool) If true scans recorded in the generation manifest with the same source hashes,
+        parameters and present outputs are skipped, if false every scan is converted again
+        :param verify_outputs: (bool) If true the checksums of existing outputs are verified, otherwise only their
+        presence is checked
+        """
+        for level in self.get_levels():
+            if not os.path.exists(self.get_level_path(level)):
+                os.makedirs(self.get_level_path(level))
+        generation_manifest = Manifest.GenerationManifest(os.path.join(self.target_path, 'generation.json'))
+        parameters = self.get_parameters()
+        stores = {level: PackedStore.PackedVolumeStore(self.get_level_path(level))
+                  for level in self.get_levels()} if self.packed else None
+        # Find scans to convert, output indexes are stable over runs
+        sources = dict()
+        pending = []
+        t1 = Timer()
+        for position in range(len(self.data)):
+            source = os.path.relpath(self.data[position], self.root)
+            generation_manifest.get_index(source)
+            sources[position] = (source, {
+                'data': generation_manifest.get_source_state(source, 'data', self.data[position]),
+                'label': generation_manifest.get_source_state(source, 'label', self.labels[position])})
+            if incremental and generation_manifest.is_up_to_date(source, sources[position][1], parameters) and \
+                    self.outputs_valid(generation_manifest.scans[source], stores, verify_outputs):
+                # Record the new modification time of touched but unchanged sources
+                generation_manifest.update_sources(source, sources[position][1])
                 continue
+            pending.append(position)
+        generation_manifest.save()
+        print("Scans to convert", len(pending), "/", len(self.data), "checked in", t1.stop())
+
+        writers = {level: PackedStore.PackedShardWriter(self.get_level_path(level), shard_size_mb=self.shard_size_mb)
+                   for level in self.get_levels()} if self.packed and len(pending) > 0 else None
+
+        # Packed outputs are only recorded after their shards are complete, otherwise an interrupted run could leave
+        # records pointing to outputs of a shard without index
+        unrecorded = []
+
+        def write(position, result):
+            source = sources[position][0]
+            levels, source_states = result
+            index = generation_manifest.scans[source]['index']
+            outputs = dict()
+            statistics = None
+            if levels is not None:
+                for level, sample in levels.items():
+                    outputs[str(level)] = self.write_sample(
+                        index, sample, writers[level] if writers is not None else None, self.get_level_path(level))
+                # Statistics of the finest volume and the full resolution labels
+                volume_n = levels[self.side_len]['volume']
+                label_n = levels[self.get_label_level()]['label']
+                has_label = label_n.shape[0] > 0
+                statistics = {'volume_shape': [int(dim) for dim in volume_n.shape],
+                              'label_count': int(label_n.shape[0]),
+                              'label_min': label_n.min(axis=0).tolist() if has_label else [0, 0, 0],
+                              'label_max': label_n.max(axis=0).tolist() if has_label else [0, 0, 0]}
+            shard_indexes = {level: writer.shard_index for level, writer in writers.items()} \
+                if writers is not None else dict()
+            unrecorded.append(((source, source_states, parameters, outputs, statistics), shard_indexes))
+            while len(unrecorded) > 0 and all(writers[level].shard_index > shard_index
+                                              for level, shard_index in unrecorded[0][1].items()):
+                generation_manifest.record(*unrecorded.pop(0)[0])
+
+        if num_workers == 0:
+            with self.execution_profile.activated():
+                for number, position in enumerate(pending):
+                    print(number, "/", len(pending))
+                    write(position, self.convert_pending_scan(position, sources[position][1]))
+        else:
+            # Workers convert on the CPU, every result is written by this process
+            memory_budget = memory_budget_mb * 1024 ** 2
+            with concurrent.futures.ProcessPoolExecutor(max_workers=num_workers,
+                                                        mp_context=multiprocessing.get_context('spawn'),
+                                                        initializer=init_conversion_worker,
+                                                        initargs=(max(1, get_physical_cores() // num_workers),)
+                                                        ) as executor:
+                running = dict()
+                running_memory = 0
+                next_number = 0
+                while next_number < len(pending) or len(running) > 0:
+                    # Submit scans as long as the estimated memory of all running conversions fits into the budget
+                    while next_number < len(pending) and len(running) < num_workers:
+                        position = pending[next_number]
+                        memory = os.path.getsize(self.data[position]) * memory_factor
+                        if len(running) > 0 and running_memory + memory > memory_budget:
+                            break
+                        running[executor.submit(self.convert_pending_scan, position, sources[position][1],
+                                                'cpu')] = (position, memory)
+                        running_memory += memory
+                        next_number += 1
+                    done, _ = concurrent.futures.wait(running.keys(),
+                                                      return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        position, memory = running.pop(future)
+                        running_memory -= memory
+                        print(position, "/", len(self.data))
+                        write(position, future.result())
+        if writers is not None:
+            for writer in writers.values():
+                writer.close()
+            for record, _ in unrecorded:
+                generation_manifest.record(*record)
+        # Rebuild the dataset manifest from the statistics of all converted scans, recorded splits are kept
+        manifest_writer = Manifest.DatasetManifestWriter(os.path.join(self.target_path, 'manifest'))
+        indexes = dict()
+        for source, scan in generation_manifest.scans.items():
+            if scan.get('statistics') is not None:
+                statistics = scan['statistics']
+                manifest_writer.add_row(scan['index'], statistics['volume_shape'], statistics['label_count'],
+                                        np.array(statistics['label_min']), np.array(statistics['label_max']),
+                                        split=scan.get('split'))
+                indexes[scan['index']] = source
+        for index, split in manifest_writer.close().items():
+            generation_manifest.scans[indexes[index]]['split'] = split
+        generation_manifest.save()
+
+    def get_parameters(self):
+        """
+        Returns the parameters which determine the content of the outputs
+        :return: (dict) Conversion parameters
+        """
+        return {'side_len': self.side_len, 'side_lens': self.side_lens, 'label_level': self.get_label_level(),
+                'dim_max': self.dim_max,
+                'threshold_min': self.threshold_min, 'threshold_max': self.threshold_max,
+                'storage_dtype': self.storage_dtype, 'packed': self.packed}
+
+    def get_side_lens(self):
+        """
+        Returns the side lengths of all generated levels
+        :return: (list) Side lengths
+        """
+        return self.side_lens if self.side_lens is not None else [self.side_len]
+
+    def get_label_level(self):
+        """
+        Returns the level storing the full resolution labels, a pyramid stores them once in a separate level
+        :return: (Union[int, str]) Side length of the level or 'labels'
+        """
+        return 'labels' if self.side_lens is not None else self.side_len
+
+    def get_levels(self):
+        """
+        Returns all generated levels
+        :return: (list) Side lengths of the volume levels and the label level
+        """
+        return self.get_side_lens() + (['labels'] if self.side_lens is not None else [])
+
+    def get_level_path(self, level):
+        """
+        Returns the output folder of a level, without pyramid every output is written to the target path
+        :param level: (Union[int, str]) Side length of the level or 'labels'
+        :return: (str) Folder
+        """
+        if self.side_lens is None:
+            return self.target_path
+        if level == 'labels':
+            return Misc.get_pyramid_label_path(self.target_path)
+        return Misc.get_pyramid_level_path(self.target_path, int(level))
+
+    def get_output_path(self, index, key, level_path=None):
+        """
+        Returns the path of an unpacked output array
+        :param index: (int) Output index of the scan
+        :param key: (str) Key of the array ('volume', 'quantization', 'label' or 'label_occupancy')
+        :param level_path: (str) Output folder of the level, target path if None
+        :return: (str) Path
+        """
+        return (level_path or self.target_path) + str(index) + (".npy" if key == 'volume' else "_" + key + ".npy")
+
+    def outputs_valid(self, scan, stores=None, verify=False):
+        """
+        Checks if the recorded outputs of a scan are present and optionally if their checksums match
+        :param scan: (dict) Entry of the generation manifest
+        :param stores: (dict) Store of packed outputs of every level
+        :param verify: (bool) If true the checksums are verified
+        :return: (bool) True if all outputs are valid
+        """
+        for level, outputs in scan['outputs'].items():
+            level = int(level) if level.isdigit() else level
+            for key, checksum in outputs.items():
+                if stores is not None:
+                    store = stores[level]
+                    if not store.has(scan['index'], key):
+                        return False
+                    if verify and Manifest.get_array_hash(store.get(scan['index'], key)) != checksum:
+                        return False
+                else:
+                    path = self.get_output_path(scan['index'], key, self.get_level_path(level))
+                    if not os.path.exists(path):
+                        return False
+                    if verify and Manifest.get_array_hash(np.load(path)) != checksum:
+                        return False
+        return True
+
+    def convert_pending_scan(self, index, source_states, device=None):
+        """
+        Converts one scan and computes the content hashes of its changed source files, runs in a worker if parallel
+        :param index: (int) Index of the scan
+        :param source_states: (dict) State of the source files (see Manifest.GenerationManifest.get_source_state)
+        :param device: (str) Device used for downsampling, device of the generator if None
+        :return: (Tuple[dict, dict]) Converted levels (see convert_scan) and source states including hashes
+        """
+        source_states = Manifest.get_source_hashes(source_states, {'data': self.data[index],
+                                                                   'label': self.labels[index]})
+        return self.convert_scan(index, device), source_states
+
+    def convert_scan(self, index, device=None):
+        """
+        Converts one scan into the downsampled volume and the label coordinates of every level
+        :param index: (int) Index of the scan
+        :param device: (str) Device used for downsampling, device of the generator if None
+        :return: (dict) Level -> volume, scale and offset of quantization and/or label coordinates or None if no label
+        is present (see build_levels)
+        """
+        data_file = self.data[index]
+        label_file = self.labels[index]
+
+        # Check if label in place
+        if label_file is None:
+            return None
+        labels = itk.imread(label_file)
+        try:
+            offsets_n = np.flip(np.array(labels.GetMetaDataDictionary()["DomainFirst"].split(" "), dtype=np.int), 0)
+        except:
+            return None
+        if self.streaming:
+            volume_pooled_n, pooled_depth = self.downsample_streaming(data_file)
+        else:
             # load data using itk
             t2 = Timer()
             # First take care of volume
@@ -79,23 +336,170 @@ class WeaponDatasetGenerator():
             print("Read image", t2.stop())
 
             t3 = Timer()
-            volume_pooled_tg = nn.functional.avg_pool3d(torch.from_numpy(volume_n).to(self.device), self.side_len, self.side_len)
+            volume_pooled_tg = nn.functional.avg_pool3d(torch.from_numpy(volume_n).to(device or self.device), self.side_len, self.side_len)
             print("Downsampling", t3.stop())
             t4 = Timer()
             volume_pooled_tg = volume_pooled_tg[:,0:self.dim_max,:,:]
+            pooled_depth = volume_pooled_tg.shape[1]
             volume_pooled_tg = nn.functional.pad(volume_pooled_tg, 
                                                             (0,0,0,0,0,self.dim_max-volume_pooled_tg.shape[1]))
             print("Padding", t4.stop())
-            np.save(self.target_path +str(index) + ".npy", volume_pooled_tg.cpu().numpy().astype(np.float32))
+            volume_pooled_n = volume_pooled_tg.cpu().numpy()
+
+        # Take care of labels and store coords
+        labels_n = itk.GetArrayFromImage(labels)
+
+        labels_indices_n = np.argwhere(labels_n)
+        x_n = np.expand_dims(labels_indices_n[:, 0] + offsets_n[0], axis=1)
+        y_n = np.expand_dims(labels_indices_n[:, 1] + offsets_n[1], axis=1)
+        z_n = np.expand_dims(labels_indices_n[:, 2] + offsets_n[2], axis=1)
+        label_coords_n = np.concatenate((x_n,y_n,z_n), axis=1).astype(np.uint16)
+        return self.build_levels(volume_pooled_n, pooled_depth, label_coords_n)
+
+    def build_levels(self, volume_pooled_n, pooled_depth, label_coords_n):
+        """
+        Derives every level of the pyramid from the finest pooled volume. Average pooling the finest level by the ratio
+        of the side lengths equals pooling the scan directly. The full resolution labels are stored once in the label
+        level, coarse labels are derived while loading (see Datasets.WeaponDataset).
+        :param volume_pooled_n: (np.ndarray) Normalized volume pooled with the smallest side length
+        :param pooled_depth: (int) Number of pooled slices before zero padding
+        :param label_coords_n: (np.ndarray) Full resolution label coordinates
+        :return: (dict) Side length -> volume, scale and offset of quantization (and label coordinates without
+        pyramid), 'labels' -> label coordinates if a pyramid is generated
+        """
+        levels = dict()
+        for side_len in self.get_side_lens():
+            factor = side_len // self.side_len
+            if factor == 1:
+                level_volume_n = volume_pooled_n
+            else:
+                level_volume_n = nn.functional.avg_pool3d(torch.from_numpy(np.ascontiguousarray(volume_pooled_n)),
+                                                          factor, factor).numpy()
+                # Slices including padding are dropped when pooling the scan directly
+                level_volume_n[:, pooled_depth // factor:] = 0.0
+            level_volume_n, scale_offset_n = Misc.quantize_volume(level_volume_n, self.storage_dtype)
+            levels[side_len] = {'volume': level_volume_n, 'quantization': scale_offset_n}
+        levels[self.get_label_level()] = dict(levels.get(self.get_label_level(), dict()), label=label_coords_n)
+        return levels
+
+    def downsample_streaming(self, data_file):
+        """
+        Reads a scan slab by slab and average pools every slab on the CPU. Peak memory is bounded by the memory budget
+        if the image format supports streamed reading (e.g. uncompressed .mha), otherwise the image is read once.
+        Only the first dim_max pooled slices are read, the rest is zero padded like in the non streaming path.
+        :param data_file: (str) Path of the scan
+        :return: (Tuple[np.ndarray, int]) Normalized pooled volume of shape (1, dim_max, y, x) and number of pooled
+        slices before zero padding
+        """
+        t2 = Timer()
+        reader = itk.ImageFileReader.New(FileName=data_file)
+        reader.UpdateOutputInformation()
+        size_x, size_y, size_z = [int(dim) for dim in reader.GetOutput().GetLargestPossibleRegion().GetSize()]
+        pooled_depth = min(size_z // self.side_len, self.dim_max)
+        volume_pooled_n = np.zeros((1, self.dim_max, size_y // self.side_len, size_x // self.side_len),
+                                   dtype=np.float32)
+        # Slab thickness in pooled slices, assume up to 8 byte pixels plus the float32 copy
+        bytes_per_pooled_slice = size_x * size_y * self.side_len * (8 + 4)
+        slab_depth = max(1, int(self.memory_budget_mb * 1024 ** 2 // bytes_per_pooled_slice))
+        for start in range(0, pooled_depth, slab_depth):
+            stop = min(start + slab_depth, pooled_depth)
+            region = itk.ImageRegion[3]()
+            region.SetIndex([0, 0, start * self.side_len])
+            region.SetSize([size_x, size_y, (stop - start) * self.side_len])
+            reader.GetOutput().SetRequestedRegion(region)
+            reader.Update()
+            # Buffered region equals the requested region if streaming is supported by the image io
+            buffered_start = int(reader.GetOutput().GetBufferedRegion().GetIndex()[2])
+            slab_n = itk.array_view_from_image(reader.GetOutput())[
+                     start * self.side_len - buffered_start:stop * self.side_len - buffered_start]
+            slab_tc = torch.from_numpy(slab_n.astype(np.float32))[None]
+            volume_pooled_n[:, start:stop] = nn.functional.avg_pool3d(slab_tc, self.side_len, self.side_len).numpy()
+            del slab_n, slab_tc
+        # Normalization commutes with average pooling
+        volume_pooled_n[:, :pooled_depth] = (volume_pooled_n[:, :pooled_depth] - self.threshold_min) / float(
+            self.threshold_max - self.threshold_min)
+        print("Read and downsample image (streaming)", t2.stop())
+        return volume_pooled_n, pooled_depth
+
+    def write_sample(self, index, sample, writer=None, level_path=None):
+        """
+        Writes the volume and/or labels of one level of a converted scan
+        :param index: (int) Output index of the scan
+        :param sample: (dict) Converted level of the scan (see build_levels)
+        :param writer: (PackedStore.PackedShardWriter) Shard writer if packed outputs are generated
+        :param level_path: (str) Output folder of the level, target path if None
+        :return: (dict) Checksum of every written array
+        """
+        arrays = dict()
+        if 'volume' in sample:
+            arrays['volume'] = sample['volume']
+            if sample['quantization'] is not None:
+                arrays['quantization'] = sample['quantization']
+        if 'label' in sample:
+            arrays['label'] = sample['label']
+            # Precompute label index for O(1) membership queries while sampling
+            arrays['label_occupancy'] = Misc.LabelOccupancy.from_coordinates(sample['label']).to_array()
+        if writer is not None:
+            writer.add(index, arrays)
+        else:
+            for key, array in arrays.items():
+                np.save(self.get_output_path(index, key, level_path), array)
+        return {key: Manifest.get_array_hash(array) for key, array in arrays.items()}
+
+
+def generate_label_occupancy(target_path):
+    """
+    Builds the label occupancy index for already generated label files
+    :param target_path: (str) Folder including the {index}_label.npy files
+    """
+    ending = '_label.npy'
+    for file_name in os.listdir(target_path):
+        if file_name.endswith(ending):
+            label_n = np.load(os.path.join(target_path, file_name))
+            np.save(os.path.join(target_path, file_name[:-len(ending)] + "_label_occupancy.npy"),
+                    Misc.LabelOccupancy.from_coordinates(label_n).to_array())
 
-            # Take care of labels and store coords
-            labels_n = itk.GetArrayFromImage(labels)
 
-            labels_indices_n = np.argwhere(labels_n)
-            x_n = np.expand_dims(labels_indices_n[:, 0] + offsets_n[0], axis=1)
-            y_n = np.expand_dims(labels_indices_n[:, 1] + offsets_n[1], axis=1)
-            z_n = np.expand_dims(labels_indices_n[:, 2] + offsets_n[2], axis=1)
-            np.save(self.target_path +str(index) + "_label.npy", np.concatenate((x_n,y_n,z_n), axis=1).astype(np.uint16))
+def report_quantization_error(source_path, target_path=None, storage_dtypes=('float16', 'uint16', 'uint8'),
+                              max_files=None):
+    """
+    Reports the reconstruction error of quantized volumes against the float32 originals
+    :param source_path: (str) Folder including the float32 {index}.npy volumes
+    :param target_path: (str) Folder including already quantized volumes, if None every format is simulated
+    :param storage_dtypes: (Tuple[str]) Formats to simulate (only used if target_path is None)
+    :param max_files: (int) Maximal number of volumes to compare
+    :return: (dict) Mean absolute error, max absolute error, RMSE and compression ratio for every format
+    """
+    file_names = [file_name for file_name in sorted(os.listdir(source_path))
+                  if file_name.endswith(".npy") and file_name[:-len(".npy")].isdigit()][:max_files]
+    if target_path is not None:
+        storage_dtypes = ('stored',)
+    errors = {storage_dtype: {'mae': [], 'max': [], 'rmse': [], 'bytes': [], 'bytes_original': []}
+              for storage_dtype in storage_dtypes}
+    for file_name in file_names:
+        volume_n = np.load(os.path.join(source_path, file_name)).astype(np.float32)
+        for storage_dtype in storage_dtypes:
+            if target_path is not None:
+                quantized_n = np.load(os.path.join(target_path, file_name))
+                quantization_file = os.path.join(target_path, file_name[:-len(".npy")] + "_quantization.npy")
+                scale_offset_n = np.load(quantization_file) if os.path.exists(quantization_file) else None
+            else:
+                quantized_n, scale_offset_n = Misc.quantize_volume(volume_n, storage_dtype)
+            difference_n = np.abs(Misc.dequantize_volume(quantized_n, scale_offset_n) - volume_n)
+            errors[storage_dtype]['mae'].append(float(np.mean(difference_n)))
+            errors[storage_dtype]['max'].append(float(np.max(difference_n)))
+            errors[storage_dtype]['rmse'].append(float(np.sqrt(np.mean(difference_n ** 2))))
+            errors[storage_dtype]['bytes'].append(quantized_n.nbytes)
+            errors[storage_dtype]['bytes_original'].append(volume_n.nbytes)
+    report = dict()
+    for storage_dtype, values in errors.items():
+        if len(values['mae']) == 0:
+            continue
+        report[storage_dtype] = {'mae': float(np.mean(values['mae'])), 'max': float(np.max(values['max'])),
+                                 'rmse': float(np.mean(values['rmse'])),
+                                 'compression': float(np.sum(values['bytes_original']) / np.sum(values['bytes']))}
+        print(storage_dtype, report[storage_dtype])
+    return report
 
 
 if __name__ == '__main__':
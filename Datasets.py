@@ -1,17 +1,30 @@
-from typing import Tuple
+from typing import Dict, Iterator, List, Tuple, Union
 
 import torch
 from torch.utils import data
 import numpy as np
-from pykdtree.kdtree import KDTree
+import os
+from collections import OrderedDict
 
+import HardMining
+import Manifest
 import Misc
+import PackedStore
+import VolumeCache
 
 
 class WeaponDataset(data.Dataset):
-    def __init__(self, target_path_volume: str, target_path_label: str, length: int, dim_max: int = 640,
+    def __init__(self, target_path_volume: str = None, target_path_label: str = None, length: int = None,
+                 dim_max: int = 640,
                  npoints: int = 2 ** 10, side_len: int = 32,
-                 sampling: str = 'one', offset: int = 0, test: bool = False, share_box: float = 0.6) -> None:
+                 sampling: str = 'one', offset: int = 0, test: bool = False, share_box: float = 0.6,
+                 packed_path_volume: str = None, packed_path_label: str = None,
+                 cache: VolumeCache.SharedVolumeCache = None, compact: bool = False,
+                 content_threshold: float = 0.05, content_uniform_share: float = 0.2,
+                 proposal_cache_size: int = 256, hard_mining_buffer: HardMining.HardCoordinateBuffer = None,
+                 hard_share: float = 0.25, manifest_path: str = None, split: str = None, pyramid_path: str = None,
+                 label_side_len: int = 1, empty_space_threshold: float = None,
+                 empty_space_dilation: int = 1) -> None:
         """
         Constructor method
         :param target_path_volume: (str)
@@ -24,18 +37,81 @@ class WeaponDataset(data.Dataset):
         :param offset: (int)
         :param share_box: (float)
         :param test: (bool)
+        :param packed_path_volume: (str) Folder of packed shards to load volumes from instead of single files
+        :param packed_path_label: (str) Folder of packed shards to load labels from instead of single files
+        :param cache: (VolumeCache.SharedVolumeCache) Shared memory cache of decoded volumes and labels
+        :param compact: (bool) If true float16 volumes, int16 coordinates and uint8 labels are returned
+        :param content_threshold: (float) Intensity of the low resolution volume above which a cell is proposed
+        :param content_uniform_share: (float) Share of uniformly proposed coordinates in content sampling
+        :param proposal_cache_size: (int) Number of proposal tables cached in every worker for content sampling
+        :param hard_mining_buffer: (HardMining.HardCoordinateBuffer) Buffer of hard coordinates (one slot per index)
+        :param hard_share: (float) Share of coordinates replaced by hard coordinates of the buffer
+        :param manifest_path: (str) Folder of the dataset manifest, replaces the file permutation if given
+        :param split: (str) Split of the manifest to use ('train', 'validation', 'test')
+        :param pyramid_path: (str) Root folder of a generated resolution pyramid, if given volumes are loaded from the
+        level side_len and labels from the full resolution labels (loose or packed) instead of the target paths
+        :param label_side_len: (int) Side length labels are downsampled to while loading, 1 for full resolution
+        :param empty_space_threshold: (float) If given test coordinates in cells of the low resolution volume which
+        can not be occupied (see Misc.get_occupancy_mask) are not decoded and predicted as empty while testing
+        :param empty_space_dilation: (int) Dilation of the occupancy mask in cells
         """
         self.npoints = npoints
-        self.side_len = side_len
         self.dim_max = int(dim_max / side_len)
+        if pyramid_path is not None:
+            assert side_len % label_side_len == 0, 'Side length has to be a multiple of the label side length'
+            target_path_volume = Misc.get_pyramid_level_path(pyramid_path, side_len)
+            target_path_label = Misc.get_pyramid_label_path(pyramid_path)
+            if len(PackedStore.get_complete_shards(target_path_volume)) > 0:
+                packed_path_volume = target_path_volume
+            if len(PackedStore.get_complete_shards(target_path_label)) > 0:
+                packed_path_label = target_path_label
+            # Coordinates are given in the resolution of the label level
+            side_len = side_len // label_side_len
+        else:
+            label_side_len = 1
+        self.side_len = side_len
+        self.label_side_len = label_side_len
         self.sampling = sampling
         self.target_path_volume = target_path_volume
         self.target_path_label = target_path_label
-        self.length = length
         self.offset = offset
         self.test = test
-        self.index_wrapper = Misc.FilePermutation()
         self.share_box = share_box
+        self.packed_path_volume = packed_path_volume
+        self.packed_path_label = packed_path_label
+        # Init packed stores (one store is used if volumes and labels are packed together)
+        self.packed_store_volume = PackedStore.PackedVolumeStore(packed_path_volume) \
+            if packed_path_volume is not None else None
+        if packed_path_label is not None and packed_path_label == packed_path_volume:
+            self.packed_store_label = self.packed_store_volume
+        else:
+            self.packed_store_label = PackedStore.PackedVolumeStore(packed_path_label) \
+                if packed_path_label is not None else None
+        # Init sample names from manifest or from file permutation
+        if manifest_path is not None:
+            self.manifest = Manifest.DatasetManifest(manifest_path)
+            self.index_wrapper = [str(name) for name in self.manifest.get_names(split)]
+            self.length = length if length is not None else len(self.index_wrapper) - offset
+        elif length is None and packed_path_volume is not None:
+            # Use every sample of the packed store
+            self.manifest = None
+            self.index_wrapper = sorted(self.packed_store_volume.names(), key=int)
+            self.length = len(self.index_wrapper) - offset
+        else:
+            assert length is not None, 'Length has to be given if no manifest or packed store is utilized'
+            self.manifest = None
+            self.index_wrapper = Misc.FilePermutation()
+            self.length = length
+        self.cache = cache
+        self.compact = compact
+        self.content_threshold = content_threshold
+        self.content_uniform_share = content_uniform_share
+        self.proposal_cache_size = proposal_cache_size
+        self.proposal_cache = OrderedDict()
+        self.hard_mining_buffer = hard_mining_buffer
+        self.hard_share = hard_share
+        self.empty_space_threshold = empty_space_threshold
+        self.empty_space_dilation = empty_space_dilation
 
     def __getitem__(self, index: int) -> Tuple[torch.tensor]:
         """
@@ -44,11 +120,30 @@ class WeaponDataset(data.Dataset):
         :return: (Tuple[torch.tensor]) Batch of volume, coordinates and label
         """
         # Calc index
+        scan_index = index
         index = index + self.offset
         index = self.index_wrapper[index]
         # Load volume and label
-        volume_n = np.load(self.target_path_volume + str(index) + ".npy")
-        label_n = np.load(self.target_path_label + str(index) + "_label.npy")
+        volume_n = self.load_volume(index)
+        label_n = self.load_label(index)
+        return self.build_sample(index, scan_index, volume_n, label_n)
+
+    def build_sample(self, index: Union[int, str], scan_index: int, volume_n: np.ndarray, label_n: np.ndarray,
+                     label_occupancy: Misc.LabelOccupancy = None) -> Tuple[torch.tensor]:
+        """
+        Method samples the coordinates and labels of a loaded scan
+        :param index: (Union[int, str]) File index
+        :param scan_index: (int) Index of the scan inside of the dataset
+        :param volume_n: (np.ndarray) Low resolution volume
+        :param label_n: (np.ndarray) High resolution label coordinates
+        :param label_occupancy: (Misc.LabelOccupancy) Label occupancy, loaded if not given
+        :return: (Tuple[torch.tensor]) Batch of volume, coordinates and label
+        """
+        if label_occupancy is None and (
+                self.sampling in ['default', 'one', 'content'] or self.hard_mining_buffer is not None):
+            label_occupancy = self.load_label_occupancy(index, label_n)
+
+        weights = None
 
         sampling_shapes_tc = [0, volume_n.shape[1] * self.side_len, volume_n.shape[2] * self.side_len,
                               volume_n.shape[3] * self.side_len]
@@ -59,9 +154,7 @@ class WeaponDataset(data.Dataset):
             y_n = np.random.randint(sampling_shapes_tc[2], size=(int(self.npoints), 1))
             z_n = np.random.randint(sampling_shapes_tc[3], size=(int(self.npoints), 1))
             coords_zero = np.concatenate((x_n, y_n, z_n), axis=1)
-            kd_tree = KDTree(label_n, leafsize=16)
-            dist, _ = kd_tree.query(coords_zero, k=1)
-            labels_zero = np.expand_dims(dist == 0, axis=1).astype(float)
+            labels_zero = np.expand_dims(label_occupancy.contains(coords_zero), axis=1).astype(np.uint8)
 
             coords = coords_zero
             labels = labels_zero
@@ -78,7 +171,8 @@ class WeaponDataset(data.Dataset):
             coords_zero = np.concatenate((x_n, y_n, z_n), axis=1)
 
             coords = np.concatenate((coords_one, coords_zero), axis=0)
-            labels = np.concatenate((np.ones((coords_one.shape[0], 1)), np.zeros((coords_zero.shape[0], 1))), axis=0)
+            labels = np.concatenate((np.ones((coords_one.shape[0], 1), dtype=np.uint8),
+                                     np.zeros((coords_zero.shape[0], 1), dtype=np.uint8)), axis=0)
 
         elif self.sampling == 'one':
             # Coords with one as label
@@ -90,22 +184,202 @@ class WeaponDataset(data.Dataset):
             y_n = np.random.randint(sampling_shapes_tc[2], size=(int(self.npoints * (1 - self.share_box)), 1))
             z_n = np.random.randint(sampling_shapes_tc[3], size=(int(self.npoints * (1 - self.share_box)), 1))
             coords_zero = np.concatenate((x_n, y_n, z_n), axis=1)
-            kd_tree = KDTree(label_n, leafsize=16)
-            dist, _ = kd_tree.query(coords_zero, k=1)
-            labels_zero = np.expand_dims(dist == 0, axis=1).astype(float)
+            labels_zero = np.expand_dims(label_occupancy.contains(coords_zero), axis=1).astype(np.uint8)
+
+            coords = np.concatenate((coords_one, coords_zero), axis=0)
+            labels = np.concatenate((np.ones((coords_one.shape[0], 1), dtype=np.uint8), labels_zero), axis=0)
+
+        elif self.sampling == 'content':
+            # Coords with one as label
+            coords_one = label_n[np.random.choice(label_n.shape[0], int(self.npoints * self.share_box), replace=False),
+                         :]
+
+            # Coords proposed by the content of the low resolution volume
+            coords_zero, weights_zero = self.sample_content_aware(index, volume_n,
+                                                                  int(self.npoints * (1 - self.share_box)))
+            labels_zero = np.expand_dims(label_occupancy.contains(coords_zero), axis=1).astype(np.uint8)
 
             coords = np.concatenate((coords_one, coords_zero), axis=0)
-            labels = np.concatenate((np.ones((coords_one.shape[0], 1)), labels_zero), axis=0)
+            labels = np.concatenate((np.ones((coords_one.shape[0], 1), dtype=np.uint8), labels_zero), axis=0)
+            weights = np.concatenate((np.ones((coords_one.shape[0], 1), dtype=np.float32), weights_zero), axis=0)
 
         else:
             raise NotImplementedError
+        # Mix hard coordinates of previous training steps into the sample
+        if self.hard_mining_buffer is not None and not self.test:
+            coords, labels, weights = self.mix_hard_coordinates(scan_index, coords, labels, weights, label_occupancy)
         # print("Access time", t.stop())
-        if self.test:
-            return torch.from_numpy(volume_n).float(), torch.from_numpy(coords).float(), torch.from_numpy(
-                labels).float(), torch.from_numpy(label_n.astype(int)).float()
+        if self.compact:
+            # Compact transport format, conversion to the model dtype is performed once in the training loop
+            output = (torch.from_numpy(volume_n.astype(np.float16)), torch.from_numpy(coords.astype(np.int16)),
+                      torch.from_numpy(labels))
+            if self.test:
+                return output + (torch.from_numpy(label_n.astype(np.int16)),)
+        else:
+            output = (torch.from_numpy(volume_n).float(), torch.from_numpy(coords.astype(np.float32)),
+                      torch.from_numpy(labels.astype(np.float32)))
+            if self.test:
+                return output + (torch.from_numpy(label_n.astype(np.float32)),)
+        # Importance weights are returned additionally to correct the loss for the proposal distribution
+        if weights is not None:
+            output = output + (torch.from_numpy(weights),)
+        # Scan index is returned additionally to record the losses in the hard mining buffer
+        if self.hard_mining_buffer is not None:
+            output = output + (torch.tensor(scan_index, dtype=torch.long),)
+        return output
+
+    def mix_hard_coordinates(self, scan_index: int, coords: np.ndarray, labels: np.ndarray, weights: np.ndarray,
+                             label_occupancy: Misc.LabelOccupancy) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Method replaces the last (randomly sampled) coordinates by hard coordinates of previous training steps
+        :param scan_index: (int) Index of the scan in the hard mining buffer
+        :param coords: (np.ndarray) Sampled coordinates of shape (npoints, 3)
+        :param labels: (np.ndarray) Labels of shape (npoints, 1)
+        :param weights: (np.ndarray) Importance weights of shape (npoints, 1) or None
+        :param label_occupancy: (Misc.LabelOccupancy) Label occupancy to compute the labels of the hard coordinates
+        :return: (Tuple[np.ndarray, np.ndarray, np.ndarray]) Coordinates, labels and weights
+        """
+        if weights is None:
+            weights = np.ones((coords.shape[0], 1), dtype=np.float32)
+        coords_hard = self.hard_mining_buffer.sample(scan_index, int(coords.shape[0] * self.hard_share))
+        if coords_hard.shape[0] == 0:
+            return coords, labels, weights
+        coords = coords.copy()
+        coords[-coords_hard.shape[0]:] = coords_hard
+        labels[-coords_hard.shape[0]:] = np.expand_dims(label_occupancy.contains(coords_hard), axis=1)
+        # Hard coordinates are not corrected by importance weights
+        weights[-coords_hard.shape[0]:] = 1.0
+        return coords, labels, weights
+
+    def get_proposal_table(self, index: Union[int, str], volume_n: np.ndarray) -> Tuple[np.ndarray, ...]:
+        """
+        Method returns the proposal table of a sample used in content sampling. Only cells of the low resolution
+        volume above the content threshold are stored together with their (cumulative) proposal probability.
+        :param index: (Union[int, str]) File index
+        :param volume_n: (np.ndarray) Low resolution volume of shape (1, x, y, z)
+        :return: (Tuple[np.ndarray, ...]) Sorted linear indexes of proposed cells, probabilities and cumulative
+        probabilities
+        """
+        if index in self.proposal_cache:
+            self.proposal_cache.move_to_end(index)
+            return self.proposal_cache[index]
+        intensity_n = volume_n[0].reshape(-1)
+        cells_n = np.flatnonzero(intensity_n > self.content_threshold).astype(np.int64)
+        probability_n = intensity_n[cells_n].astype(np.float64)
+        if probability_n.shape[0] > 0:
+            probability_n = probability_n / np.sum(probability_n)
+        self.proposal_cache[index] = (cells_n, probability_n, np.cumsum(probability_n))
+        if len(self.proposal_cache) > self.proposal_cache_size:
+            self.proposal_cache.popitem(last=False)
+        return self.proposal_cache[index]
+
+    def sample_content_aware(self, index: Union[int, str], volume_n: np.ndarray,
+                             npoints: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Method samples high resolution coordinates using the low resolution volume as proposal distribution.
+        The proposal is a mixture of the normalized intensity of the cells and a uniform distribution, the returned
+        importance weights (uniform density / proposal density) correct for the proposal in expectation.
+        :param index: (Union[int, str]) File index
+        :param volume_n: (np.ndarray) Low resolution volume of shape (1, x, y, z)
+        :param npoints: (int) Number of coordinates to sample
+        :return: (Tuple[np.ndarray, np.ndarray]) Coordinates of shape (npoints, 3) and weights of shape (npoints, 1)
+        """
+        cells_n, cell_probability_n, cumulative_n = self.get_proposal_table(index, volume_n)
+        number_of_cells = volume_n[0].size
+        uniform_share = self.content_uniform_share if cells_n.shape[0] > 0 else 1.0
+        # Sample cells from the mixture
+        uniform_n = np.random.rand(npoints) < uniform_share
+        sampled_cells_n = np.empty(npoints, dtype=np.int64)
+        sampled_cells_n[uniform_n] = np.random.randint(number_of_cells, size=int(np.sum(uniform_n)))
+        if cells_n.shape[0] > 0:
+            positions_n = np.searchsorted(cumulative_n, np.random.rand(int(np.sum(~uniform_n))), side='right')
+            sampled_cells_n[~uniform_n] = cells_n[np.minimum(positions_n, cells_n.shape[0] - 1)]
+        # Calc proposal probability of every sampled cell
+        probability_n = np.full(npoints, uniform_share / number_of_cells)
+        if cells_n.shape[0] > 0:
+            positions_n = np.minimum(np.searchsorted(cells_n, sampled_cells_n), cells_n.shape[0] - 1)
+            proposed_n = cells_n[positions_n] == sampled_cells_n
+            probability_n[proposed_n] += (1.0 - uniform_share) * cell_probability_n[positions_n[proposed_n]]
+        weights_n = (1.0 / (number_of_cells * probability_n)).astype(np.float32)
+        # Sample uniform coordinates inside of the cells
+        cells_coordinates_n = np.stack(np.unravel_index(sampled_cells_n, volume_n.shape[1:]), axis=1)
+        coords_n = cells_coordinates_n * self.side_len + np.random.randint(self.side_len, size=(npoints, 3))
+        return coords_n, np.expand_dims(weights_n, axis=1)
+
+    def load_volume(self, index: Union[int, str]) -> np.ndarray:
+        """
+        Method loads the low resolution volume of a sample
+        :param index: (Union[int, str]) File index
+        :return: (np.ndarray) Volume of shape (1, x, y, z)
+        """
+        key = (self.packed_path_volume or self.target_path_volume) + str(index) + "_volume"
+        volume_n = self.cache.get(key) if self.cache is not None else None
+        if volume_n is not None:
+            return volume_n
+        if self.packed_store_volume is not None:
+            # Zero-copy slice of the memory mapped shard, copied once while dequantizing
+            volume_n = self.packed_store_volume.get(index, 'volume')
+            scale_offset_n = self.packed_store_volume.get(index, 'quantization') \
+                if self.packed_store_volume.has(index, 'quantization') else None
+        else:
+            volume_n = np.load(self.target_path_volume + str(index) + ".npy")
+            quantization_file = self.target_path_volume + str(index) + "_quantization.npy"
+            scale_offset_n = np.load(quantization_file) if volume_n.dtype.kind == 'u' else None
+        # Dequantize volumes stored as float16 or integers
+        if volume_n.dtype != np.float32:
+            volume_n = Misc.dequantize_volume(volume_n, scale_offset_n)
+        elif not volume_n.flags.writeable:
+            # Slices of the read-only memory map are copied, torch tensors have to own writable memory
+            volume_n = np.array(volume_n, copy=True)
+        if self.cache is not None:
+            self.cache.put(key, volume_n)
+        return volume_n
+
+    def load_label(self, index: Union[int, str]) -> np.ndarray:
+        """
+        Method loads the high resolution label coordinates of a sample
+        :param index: (Union[int, str]) File index
+        :return: (np.ndarray) Label coordinates of shape (n, 3)
+        """
+        key = (self.packed_path_label or self.target_path_label) + str(index) + "_label_" + str(self.label_side_len)
+        label_n = self.cache.get(key) if self.cache is not None else None
+        if label_n is not None:
+            return label_n
+        if self.packed_store_label is not None:
+            label_n = self.packed_store_label.get(index, 'label')
+        else:
+            label_n = np.load(self.target_path_label + str(index) + "_label.npy")
+        # Coarse labels are derived from the full resolution labels
+        label_n = Misc.downsample_label_coordinates(label_n, self.label_side_len)
+        if self.cache is not None:
+            self.cache.put(key, label_n)
+        return label_n
+
+    def load_label_occupancy(self, index: Union[int, str], label_n: np.ndarray) -> Misc.LabelOccupancy:
+        """
+        Method loads the precomputed label occupancy of a sample, if not present it is built from the labels
+        :param index: (Union[int, str]) File index
+        :param label_n: (np.ndarray) Label coordinates of the sample
+        :return: (Misc.LabelOccupancy) Label occupancy
+        """
+        key = (self.packed_path_label or self.target_path_label) + str(index) + "_label_occupancy_" + str(
+            self.label_side_len)
+        label_occupancy_n = self.cache.get(key) if self.cache is not None else None
+        if label_occupancy_n is not None:
+            return Misc.LabelOccupancy.from_array(label_occupancy_n)
+        # Precomputed label occupancies are given in full resolution
+        if self.label_side_len > 1:
+            label_occupancy_n = Misc.LabelOccupancy.from_coordinates(label_n).to_array()
+        elif self.packed_store_label is not None and self.packed_store_label.has(index, 'label_occupancy'):
+            label_occupancy_n = self.packed_store_label.get(index, 'label_occupancy')
+        elif self.packed_store_label is None and os.path.exists(
+                self.target_path_label + str(index) + "_label_occupancy.npy"):
+            label_occupancy_n = np.load(self.target_path_label + str(index) + "_label_occupancy.npy")
         else:
-            return torch.from_numpy(volume_n).float(), torch.from_numpy(coords).float(), torch.from_numpy(
-                labels).float()
+            label_occupancy_n = Misc.LabelOccupancy.from_coordinates(label_n).to_array()
+        if self.cache is not None:
+            self.cache.put(key, label_occupancy_n)
+        return Misc.LabelOccupancy.from_array(label_occupancy_n)
 
     def __len__(self) -> int:
         """
@@ -146,3 +420,145 @@ class WeaponDataset(data.Dataset):
             for i in range(label.shape[0]):
                 f.write("v " + " " + str(label[i][0]) + " " + str(label[i][1]) + " " + str(label[i][2]) +
                         " " + str(0) + " " + str(0) + " " + str(1) + "\n")
+
+
+class WeaponStreamingDataset(WeaponDataset, data.IterableDataset):
+    """
+    Iterable variant of the weapon dataset streaming samples sequentially from packed shards. Shards are split
+    deterministically across data loader workers and distributed ranks, samples are shuffled by a bounded buffer.
+    Shards completed while iterating are picked up, so training can start before the whole dataset is present.
+    """
+
+    def __init__(self, packed_path: str, shuffle_buffer_size: int = 64, seed: int = 1904, rank: int = None,
+                 world_size: int = None, read_buffer_mb: int = 64, **kwargs) -> None:
+        """
+        Constructor method
+        :param packed_path: (str) Folder of packed shards including volumes and labels
+        :param shuffle_buffer_size: (int) Number of scans held in the shuffle buffer
+        :param seed: (int) Seed of the shard order and the shuffle buffer
+        :param rank: (int) Distributed rank (default: rank of initialized process group or 0)
+        :param world_size: (int) Number of distributed ranks (default: world size of process group or 1)
+        :param read_buffer_mb: (int) Size of the sequential read buffer of the shard files
+        :param kwargs: Further parameters of the weapon dataset (e.g. npoints, side_len, sampling, manifest_path)
+        """
+        assert kwargs.get('hard_mining_buffer', None) is None, 'Hard mining is not supported while streaming'
+        # Volumes and labels are read together from the same shards
+        assert kwargs.get('pyramid_path', None) is None and kwargs.get('label_side_len', 1) == 1, \
+            'Resolution pyramids are not supported while streaming, labels have to be packed with the volumes'
+        # Call super constructor
+        super(WeaponStreamingDataset, self).__init__(target_path_volume=packed_path, target_path_label=packed_path,
+                                                     packed_path_volume=packed_path, packed_path_label=packed_path,
+                                                     **kwargs)
+        self.packed_path = packed_path
+        self.shuffle_buffer_size = shuffle_buffer_size
+        self.seed = seed
+        self.epoch = 0
+        self.read_buffer_size = read_buffer_mb * 1024 ** 2
+        if rank is None or world_size is None:
+            distributed = torch.distributed.is_available() and torch.distributed.is_initialized()
+            rank = torch.distributed.get_rank() if distributed else 0
+            world_size = torch.distributed.get_world_size() if distributed else 1
+        self.rank = rank
+        self.world_size = world_size
+        # Only samples of the manifest split are used if a manifest is given
+        self.names = set(self.index_wrapper) if self.manifest is not None else None
+
+    def set_epoch(self, epoch: int) -> None:
+        """
+        Method sets the epoch used to permute the shard order
+        :param epoch: (int) Epoch
+        """
+        self.epoch = epoch
+
+    def get_assigned_shards(self, shard_indexes: List[int]) -> List[int]:
+        """
+        Method returns the shards assigned to the current worker and rank. The consumer of a shard only depends on
+        the seed, the epoch and the shard index, so workers seeing different sets of complete shards while the
+        generator is still writing never read a shard twice or skip it.
+        :param shard_indexes: (List[int]) Complete shards
+        :return: (List[int]) Assigned shards in random order
+        """
+        worker_info = data.get_worker_info()
+        worker_id, number_of_workers = (worker_info.id, worker_info.num_workers) if worker_info is not None else (0, 1)
+        consumer_id = self.rank * number_of_workers + worker_id
+        number_of_consumers = self.world_size * number_of_workers
+        assigned_shards = [shard_index for shard_index in shard_indexes
+                           if hash((self.seed, self.epoch, int(shard_index))) % number_of_consumers == consumer_id]
+        np.random.RandomState(self.seed + self.epoch + consumer_id).shuffle(assigned_shards)
+        return assigned_shards
+
+    def read_shard(self, shard_index: int) -> Iterator[Tuple[str, Dict[str, np.ndarray]]]:
+        """
+        Method reads all samples of a shard sequentially
+        :param shard_index: (int) Shard index
+        :return: (Iterator[Tuple[str, Dict[str, np.ndarray]]]) Sample name and arrays
+        """
+        data_path, index_path = PackedStore.get_shard_paths(self.packed_path, shard_index)
+        segments = np.load(index_path)
+        segments = segments[np.argsort(segments['offset'], kind='stable')]
+        with open(data_path, 'rb', buffering=self.read_buffer_size) as shard_file:
+            name, arrays = None, dict()
+            for segment in segments:
+                if segment['name'].decode() != name:
+                    if name is not None:
+                        yield name, arrays
+                    name, arrays = segment['name'].decode(), dict()
+                shard_file.seek(int(segment['offset']))
+                shape = tuple(int(dim) for dim in segment['shape'][:segment['ndim']])
+                arrays[segment['key'].decode()] = np.frombuffer(
+                    shard_file.read(int(segment['nbytes'])), dtype=np.dtype(segment['dtype'].decode())).reshape(shape)
+            if name is not None:
+                yield name, arrays
+
+    def read_samples(self) -> Iterator[Tuple[str, Dict[str, np.ndarray]]]:
+        """
+        Method reads all samples of the assigned shards, shards completed meanwhile are read afterwards
+        :return: (Iterator[Tuple[str, Dict[str, np.ndarray]]]) Sample name and arrays
+        """
+        visited_shards = set()
+        while True:
+            complete_shards = [shard_index for shard_index in PackedStore.get_complete_shards(self.packed_path)
+                               if shard_index not in visited_shards]
+            if len(complete_shards) == 0:
+                return
+            visited_shards.update(complete_shards)
+            for shard_index in self.get_assigned_shards(complete_shards):
+                for name, arrays in self.read_shard(shard_index):
+                    if self.names is None or name in self.names:
+                        yield name, arrays
+
+    def __iter__(self) -> Iterator[Tuple[torch.tensor]]:
+        """
+        Method iterates over the assigned samples using a shuffle buffer
+        :return: (Iterator[Tuple[torch.tensor]]) Samples
+        """
+        worker_info = data.get_worker_info()
+        random_state = np.random.RandomState(
+            self.seed + self.epoch * 1000 + self.rank * 100 + (worker_info.id if worker_info is not None else 0))
+        shuffle_buffer = []
+        for sample in self.read_samples():
+            if len(shuffle_buffer) < self.shuffle_buffer_size:
+                shuffle_buffer.append(sample)
+                continue
+            position = random_state.randint(len(shuffle_buffer))
+            shuffle_buffer[position], sample = sample, shuffle_buffer[position]
+            yield self.build_streamed_sample(*sample)
+        random_state.shuffle(shuffle_buffer)
+        for sample in shuffle_buffer:
+            yield self.build_streamed_sample(*sample)
+
+    def build_streamed_sample(self, name: str, arrays: Dict[str, np.ndarray]) -> Tuple[torch.tensor]:
+        """
+        Method builds a sample from the arrays read from a shard
+        :param name: (str) Sample name
+        :param arrays: (Dict[str, np.ndarray]) Arrays of the sample
+        :return: (Tuple[torch.tensor]) Batch of volume, coordinates and label
+        """
+        volume_n = arrays['volume']
+        if volume_n.dtype != np.float32:
+            volume_n = Misc.dequantize_volume(volume_n, arrays.get('quantization', None))
+        else:
+            volume_n = volume_n.copy()
+        label_occupancy = Misc.LabelOccupancy.from_array(arrays['label_occupancy']) \
+            if 'label_occupancy' in arrays else Misc.LabelOccupancy.from_coordinates(arrays['label'])
+        return self.build_sample(name, 0, volume_n, arrays['label'], label_occupancy)
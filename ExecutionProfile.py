@@ -0,0 +1,182 @@
+from typing import Dict, List, Union
+
+import contextlib
+import copy
+import os
+import time
+
+import torch
+import torch.nn as nn
+
+PROFILES = ['cuda', 'cpu', 'cpu_bf16']
+
+
+class ExecutionProfile(object):
+    """
+    Device abstraction used by training, validation and testing. Covers the device, mixed precision autocast, the
+    memory format of volumes and the thread settings of the CPU backend.
+    """
+
+    def __init__(self, device: str = 'cuda', autocast_dtype: torch.dtype = None, channels_last: bool = False,
+                 intra_op_threads: int = None, inter_op_threads: int = None) -> None:
+        """
+        Constructor method
+        :param device: (str) Device to use ('cuda', 'cpu')
+        :param autocast_dtype: (torch.dtype) Dtype of autocast (e.g. torch.bfloat16), None disables autocast
+        :param channels_last: (bool) If true volumes and 3D convolutions use the channels_last_3d memory format, which
+        is the layout preferred by oneDNN
+        :param intra_op_threads: (int) Number of intra-op threads, torch default if None
+        :param inter_op_threads: (int) Number of inter-op threads, torch default if None
+        """
+        self.device = device
+        self.autocast_dtype = autocast_dtype
+        self.channels_last = channels_last
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+
+    def __repr__(self) -> str:
+        return 'ExecutionProfile(device={}, autocast_dtype={}, channels_last={}, intra_op_threads={}, ' \
+               'inter_op_threads={})'.format(self.device, self.autocast_dtype, self.channels_last,
+                                             self.intra_op_threads, self.inter_op_threads)
+
+    def apply(self) -> None:
+        """
+        Method applies the thread settings process-wide, has to be called before the first parallel operation
+        """
+        if self.intra_op_threads is not None:
+            torch.set_num_threads(self.intra_op_threads)
+        if self.inter_op_threads is not None:
+            try:
+                torch.set_num_interop_threads(self.inter_op_threads)
+            except RuntimeError:
+                # Inter-op threads can only be set once before parallel work started
+                pass
+
+    @contextlib.contextmanager
+    def activated(self):
+        """
+        Method returns a context applying the thread settings, the previous intra-op threads are restored on exit
+        (inter-op threads can not be changed again once parallel work started)
+        :return: Context of the profile
+        """
+        intra_op_threads = torch.get_num_threads()
+        self.apply()
+        try:
+            yield self
+        finally:
+            torch.set_num_threads(intra_op_threads)
+
+    def prepare_model(self, model: nn.Module) -> nn.Module:
+        """
+        Method moves a model to the device and memory format of the profile
+        :param model: (nn.Module) Model
+        :return: (nn.Module) Model
+        """
+        model = model.to(self.device)
+        if self.channels_last:
+            model = model.to(memory_format=torch.channels_last_3d)
+        return model
+
+    def prepare_volume(self, volume: torch.Tensor) -> torch.Tensor:
+        """
+        Method moves a batch of volumes to the device, dtype and memory format of the profile
+        :param volume: (torch.Tensor) Volumes of shape (batch size, 1, x, y, z)
+        :return: (torch.Tensor) Volumes
+        """
+        volume = volume.to(self.device, non_blocking=True).float()
+        if self.channels_last:
+            volume = volume.contiguous(memory_format=torch.channels_last_3d)
+        return volume
+
+    def autocast(self):
+        """
+        Method returns the autocast context of the profile
+        :return: Autocast context or null context if autocast is disabled
+        """
+        if self.autocast_dtype is None:
+            return contextlib.nullcontext()
+        return torch.autocast(device_type='cuda' if self.device.startswith('cuda') else 'cpu',
+                              dtype=self.autocast_dtype)
+
+
+def get_physical_cores() -> int:
+    """
+    Function returns the number of physical cores, hyper-threads share the vector units used by oneDNN
+    :return: (int) Number of physical cores, number of logical CPUs if the topology is not available
+    """
+    try:
+        cores = set()
+        physical_id = None
+        with open('/proc/cpuinfo') as cpuinfo:
+            for line in cpuinfo:
+                key, _, value = line.partition(':')
+                if key.strip() == 'physical id':
+                    physical_id = value.strip()
+                elif key.strip() == 'core id':
+                    cores.add((physical_id, value.strip()))
+        if len(cores) > 0:
+            return len(cores)
+    except OSError:
+        pass
+    return os.cpu_count()
+
+
+def get_execution_profile(profile: str) -> ExecutionProfile:
+    """
+    Method returns an execution profile
+    :param profile: (str) Profile ('cuda', 'cpu' plain fp32, 'cpu_bf16' bf16 autocast with one intra-op thread per
+    physical core, channels last volumes were slower under bf16 in measurements (see README))
+    :return: (ExecutionProfile) Profile
+    """
+    assert profile in PROFILES, 'Execution profile {} is not available!'.format(profile)
+    if profile == 'cuda':
+        return ExecutionProfile(device='cuda')
+    elif profile == 'cpu':
+        return ExecutionProfile(device='cpu')
+    elif profile == 'cpu_bf16':
+        return ExecutionProfile(device='cpu', autocast_dtype=torch.bfloat16, channels_last=False,
+                                intra_op_threads=get_physical_cores(), inter_op_threads=1)
+    else:
+        raise RuntimeError('Execution profile {} is not available!'.format(profile))
+
+
+def benchmark_execution_profiles(model: nn.Module, volume: torch.Tensor, coordinates: torch.Tensor,
+                                 profiles: List[str] = ('cpu', 'cpu_bf16'), training: bool = True,
+                                 runs: int = 5) -> Dict[str, Dict[str, Union[float, str]]]:
+    """
+    Function measures the throughput of a model under several execution profiles
+    :param model: (nn.Module) Model
+    :param volume: (torch.Tensor) Batch of volumes
+    :param coordinates: (torch.Tensor) Coordinates of the batch
+    :param profiles: (List[str]) Profiles to compare
+    :param training: (bool) If true forward and backward passes are measured, otherwise only forward passes
+    :param runs: (int) Number of measured runs
+    :return: (Dict[str, Dict[str, Union[float, str]]]) Coordinates per second and speedup against the first profile
+    """
+    report = dict()
+    for name in profiles:
+        profile = get_execution_profile(name)
+        profile_model = profile.prepare_model(copy.deepcopy(model)).train(training)
+        profile_volume = profile.prepare_volume(volume)
+        profile_coordinates = coordinates.to(profile.device).float()
+
+        def step():
+            with torch.set_grad_enabled(training), profile.autocast():
+                prediction = profile_model(profile_volume, profile_coordinates)
+            if training:
+                prediction.float().mean().backward()
+
+        # Thread settings of the profile are only active during its measurement
+        with profile.activated():
+            # Warm up
+            step()
+            start_time = time.time()
+            for _ in range(runs):
+                step()
+            report[name] = {'profile': repr(profile),
+                            'coordinates_per_second': runs * coordinates.shape[0] / (time.time() - start_time)}
+    for name in profiles:
+        report[name]['speedup'] = report[name]['coordinates_per_second'] / \
+                                  report[profiles[0]]['coordinates_per_second']
+        print(name, report[name])
+    return report
@@ -0,0 +1,231 @@
+from typing import Dict, Tuple, Union
+
+from abc import ABC, abstractmethod
+import copy
+import time
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+import Models
+
+try:
+    import onnxruntime
+except ImportError:
+    onnxruntime = None
+
+
+class EncoderGraph(nn.Module):
+    """
+    Module wrapping the encoder of an occupancy network for export
+    """
+
+    def __init__(self, occupancy_network: nn.Module) -> None:
+        """
+        Constructor method
+        :param occupancy_network: (nn.Module) Occupancy network providing encode and decode
+        """
+        super(EncoderGraph, self).__init__()
+        self.occupancy_network = occupancy_network
+
+    def forward(self, volume: torch.Tensor) -> torch.Tensor:
+        return self.occupancy_network.encode(volume)
+
+
+class DecoderGraph(nn.Module):
+    """
+    Module wrapping the decoder of an occupancy network for export
+    """
+
+    def __init__(self, occupancy_network: nn.Module) -> None:
+        """
+        Constructor method
+        :param occupancy_network: (nn.Module) Occupancy network providing encode and decode
+        """
+        super(DecoderGraph, self).__init__()
+        self.occupancy_network = occupancy_network
+
+    def forward(self, latent: torch.Tensor, coordinates: torch.Tensor) -> torch.Tensor:
+        return self.occupancy_network.decode(latent, coordinates)
+
+
+@torch.no_grad()
+def export_occupancy_network(occupancy_network: nn.Module, volume: torch.Tensor, coordinates: torch.Tensor,
+                             path_prefix: str, formats: Tuple[str, ...] = ('torchscript', 'onnx'),
+                             opset_version: int = 13) -> Dict[str, str]:
+    """
+    Function exports the encoder and the decoder of an occupancy network as separate graphs, the coordinate axis of
+    the decoder and the batch axis of the encoder are dynamic
+    :param occupancy_network: (nn.Module) Occupancy network providing encode and decode (e.g. optimized by
+    Inference.optimize_for_inference)
+    :param volume: (torch.Tensor) Example volume of shape (1, 1, x, y, z), the spatial shape is fixed
+    :param coordinates: (torch.Tensor) Example coordinates of shape (n, 3)
+    :param path_prefix: (str) Prefix of the exported files
+    :param formats: (Tuple[str, ...]) Formats to export ('torchscript', 'onnx')
+    :param opset_version: (int) ONNX opset version
+    :return: (Dict[str, str]) Paths of the exported graphs (e.g. 'torchscript_encoder')
+    """
+    if isinstance(occupancy_network, nn.DataParallel):
+        occupancy_network = occupancy_network.module
+    assert hasattr(occupancy_network, 'encode'), 'Only occupancy networks providing encode and decode can be exported'
+    occupancy_network.eval()
+    encoder, decoder = EncoderGraph(occupancy_network).eval(), DecoderGraph(occupancy_network).eval()
+    latent = encoder(volume)
+    paths = dict()
+    if 'torchscript' in formats:
+        paths['torchscript_encoder'] = path_prefix + '_encoder.pt'
+        paths['torchscript_decoder'] = path_prefix + '_decoder.pt'
+        torch.jit.trace(encoder, (volume,)).save(paths['torchscript_encoder'])
+        torch.jit.trace(decoder, (latent, coordinates)).save(paths['torchscript_decoder'])
+    if 'onnx' in formats:
+        paths['onnx_encoder'] = path_prefix + '_encoder.onnx'
+        paths['onnx_decoder'] = path_prefix + '_decoder.onnx'
+        torch.onnx.export(encoder, (volume,), paths['onnx_encoder'], input_names=['volume'],
+                          output_names=['latent'], dynamic_axes={'volume': {0: 'batch'}, 'latent': {0: 'batch'}},
+                          opset_version=opset_version)
+        torch.onnx.export(decoder, (latent, coordinates), paths['onnx_decoder'],
+                          input_names=['latent', 'coordinates'], output_names=['occupancy'],
+                          dynamic_axes={'coordinates': {0: 'coordinates'}, 'occupancy': {0: 'coordinates'}},
+                          opset_version=opset_version)
+    return paths
+
+
+class ExportedOccupancyNetwork(ABC):
+    """
+    Base class of occupancy networks running exported graphs. Provides the encode/decode interface of the networks
+    in Models.py, so it can be used by the inference engines of Inference.py.
+    """
+
+    def to(self, device: str) -> 'ExportedOccupancyNetwork':
+        return self
+
+    def eval(self) -> 'ExportedOccupancyNetwork':
+        return self
+
+    @abstractmethod
+    def encode(self, volume: torch.Tensor) -> torch.Tensor:
+        pass
+
+    @abstractmethod
+    def decode_coordinates(self, latent: torch.Tensor, coordinates: torch.Tensor) -> torch.Tensor:
+        pass
+
+    def decode(self, latent: torch.Tensor, coordinates: torch.Tensor, chunk_size: int = None) -> torch.Tensor:
+        """
+        Method predicts the occupancy of coordinates in chunks
+        :param latent: (torch.tensor) Latent vectors of shape (batch size, features)
+        :param coordinates: (torch.tensor) Coordinates of shape (batch size * coordinates, 3)
+        :param chunk_size: (int) Maximal number of coordinates decoded at once, None decodes all coordinates at once
+        :return: (torch.tensor) Occupancy probabilities of shape (batch size * coordinates, 1)
+        """
+        return Models.decode_in_chunks(self.decode_coordinates, latent, coordinates, chunk_size)
+
+    def __call__(self, volume: torch.Tensor, coordinates: torch.Tensor) -> torch.Tensor:
+        return self.decode(self.encode(volume), coordinates)
+
+
+class TorchScriptOccupancyNetwork(ExportedOccupancyNetwork):
+    """
+    Occupancy network running exported TorchScript graphs
+    """
+
+    def __init__(self, encoder_path: str, decoder_path: str) -> None:
+        """
+        Constructor method
+        :param encoder_path: (str) Path of the TorchScript encoder
+        :param decoder_path: (str) Path of the TorchScript decoder
+        """
+        self.encoder = torch.jit.load(encoder_path, map_location='cpu').eval()
+        self.decoder = torch.jit.load(decoder_path, map_location='cpu').eval()
+
+    @torch.no_grad()
+    def encode(self, volume: torch.Tensor) -> torch.Tensor:
+        return self.encoder(volume.float().cpu())
+
+    @torch.no_grad()
+    def decode_coordinates(self, latent: torch.Tensor, coordinates: torch.Tensor) -> torch.Tensor:
+        return self.decoder(latent, coordinates.float().cpu())
+
+
+class OnnxRuntimeOccupancyNetwork(ExportedOccupancyNetwork):
+    """
+    Occupancy network running exported ONNX graphs on the CPU execution provider of ONNX Runtime
+    """
+
+    def __init__(self, encoder_path: str, decoder_path: str, number_of_threads: int = None) -> None:
+        """
+        Constructor method
+        :param encoder_path: (str) Path of the ONNX encoder
+        :param decoder_path: (str) Path of the ONNX decoder
+        :param number_of_threads: (int) Number of intra-op threads, ONNX Runtime default if None
+        """
+        assert onnxruntime is not None, 'onnxruntime is not installed'
+        session_options = onnxruntime.SessionOptions()
+        session_options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if number_of_threads is not None:
+            session_options.intra_op_num_threads = number_of_threads
+        self.encoder = onnxruntime.InferenceSession(encoder_path, sess_options=session_options,
+                                                    providers=['CPUExecutionProvider'])
+        self.decoder = onnxruntime.InferenceSession(decoder_path, sess_options=session_options,
+                                                    providers=['CPUExecutionProvider'])
+
+    def encode(self, volume: torch.Tensor) -> torch.Tensor:
+        latent = self.encoder.run(['latent'], {'volume': volume.float().cpu().numpy()})[0]
+        return torch.from_numpy(latent)
+
+    def decode_coordinates(self, latent: torch.Tensor, coordinates: torch.Tensor) -> torch.Tensor:
+        occupancy = self.decoder.run(['occupancy'], {'latent': latent.cpu().numpy(),
+                                                     'coordinates': coordinates.float().cpu().numpy()})[0]
+        return torch.from_numpy(occupancy)
+
+
+@torch.no_grad()
+def check_parity(occupancy_network: nn.Module, backend: ExportedOccupancyNetwork, volume: torch.Tensor,
+                 coordinates: torch.Tensor, atol: float = 1e-4, threshold: float = 0.5) -> Dict[str, float]:
+    """
+    Function compares the output of an exported backend with the eager network
+    :param occupancy_network: (nn.Module) Eager occupancy network
+    :param backend: (ExportedOccupancyNetwork) Backend running the exported graphs
+    :param volume: (torch.Tensor) Volume of shape (1, 1, x, y, z)
+    :param coordinates: (torch.Tensor) Coordinates of shape (n, 3), may differ in number from the export example
+    :param atol: (float) Maximal absolute difference of the probabilities
+    :param threshold: (float) Threshold of the occupancy probability
+    :return: (Dict[str, float]) Maximal absolute difference and share of differing occupancy decisions
+    """
+    # Reference runs on a copy, the device of the given network is not changed
+    occupancy_network = copy.deepcopy(occupancy_network).cpu().eval()
+    expected = occupancy_network(volume.float().cpu(), coordinates.float().cpu())
+    actual = backend(volume, coordinates)
+    report = {'max_difference': float((expected - actual).abs().max()),
+              'decision_difference': float(((expected > threshold) != (actual > threshold)).float().mean())}
+    print('Parity', report)
+    assert report['max_difference'] <= atol, 'Exported graph differs by {} (> {})'.format(
+        report['max_difference'], atol)
+    return report
+
+
+@torch.no_grad()
+def compare_throughput(backends: Dict[str, Union[nn.Module, ExportedOccupancyNetwork]], volume: torch.Tensor,
+                       coordinates: torch.Tensor, chunk_size: int = 2 ** 16, runs: int = 3) -> Dict[str, float]:
+    """
+    Function measures the decoder throughput of several backends on the CPU
+    :param backends: (Dict[str, Union[nn.Module, ExportedOccupancyNetwork]]) Backends by name (e.g. 'eager', 'onnx')
+    :param volume: (torch.Tensor) Volume of shape (1, 1, x, y, z)
+    :param coordinates: (torch.Tensor) Coordinates of shape (n, 3)
+    :param chunk_size: (int) Number of coordinates decoded at once
+    :param runs: (int) Number of runs
+    :return: (Dict[str, float]) Coordinates per second of every backend
+    """
+    report = dict()
+    for name, backend in backends.items():
+        if isinstance(backend, nn.Module):
+            backend = copy.deepcopy(backend).cpu().eval()
+        latent = backend.encode(volume.float().cpu())
+        backend.decode(latent, coordinates[:chunk_size], chunk_size=chunk_size)
+        start_time = time.time()
+        for _ in range(runs):
+            backend.decode(latent, coordinates, chunk_size=chunk_size)
+        report[name] = float(runs * coordinates.shape[0] / (time.time() - start_time))
+    print('Throughput (coordinates/s)', {name: '{:.0f}'.format(value) for name, value in report.items()})
+    return report
@@ -0,0 +1,72 @@
+from typing import Union
+
+import numpy as np
+import torch
+
+
+class HardCoordinateBuffer(object):
+    """
+    Bounded buffer of hard training coordinates for every scan. The buffer is stored in shared memory tensors, so the
+    main process can update it after every step while the data loader workers read from it. Reads and writes are not
+    synchronized, this is harmless since the label of every coordinate is recomputed by the dataset.
+    """
+
+    def __init__(self, number_of_scans: int, capacity: int = 1024, decay: float = 0.9) -> None:
+        """
+        Constructor method
+        :param number_of_scans: (int) Number of scans in the training dataset
+        :param capacity: (int) Maximal number of hard coordinates stored per scan
+        :param decay: (float) Factor to decay the stored losses at every update of a scan (older entries age out)
+        """
+        self.capacity = capacity
+        self.decay = decay
+        self.coordinates = torch.zeros((number_of_scans, capacity, 3), dtype=torch.int16).share_memory_()
+        # Negative loss marks an empty entry
+        self.losses = torch.full((number_of_scans, capacity), -1.0, dtype=torch.float32).share_memory_()
+
+    @staticmethod
+    def _get_keys(coordinates: np.ndarray) -> np.ndarray:
+        coordinates = coordinates.astype(np.int64)
+        return (coordinates[:, 0] << 32) + (coordinates[:, 1] << 16) + coordinates[:, 2]
+
+    def update(self, scan_indexes: torch.Tensor, coordinates: torch.Tensor, losses: torch.Tensor) -> None:
+        """
+        Method records the per coordinate losses of one training step
+        :param scan_indexes: (torch.Tensor) Scan index of every volume in the batch of shape (batch size)
+        :param coordinates: (torch.Tensor) Coordinates of the batch of shape (batch size * points, 3)
+        :param losses: (torch.Tensor) Loss of every coordinate of shape (batch size * points) or (..., 1)
+        """
+        scan_indexes = scan_indexes.view(-1).cpu().numpy()
+        coordinates = coordinates.detach().cpu().view(scan_indexes.shape[0], -1, 3).numpy()
+        losses = losses.detach().cpu().float().view(scan_indexes.shape[0], -1).numpy()
+        for batch_index, scan_index in enumerate(scan_indexes):
+            # Merge stored entries with decayed loss and new entries
+            stored_losses = self.losses[scan_index].numpy()
+            valid = stored_losses >= 0.0
+            merged_coordinates = np.concatenate((self.coordinates[scan_index].numpy()[valid],
+                                                 coordinates[batch_index].astype(np.int16)), axis=0)
+            merged_losses = np.concatenate((stored_losses[valid] * self.decay, losses[batch_index]), axis=0)
+            # Sort by loss and keep the largest loss of every coordinate
+            order = np.argsort(-merged_losses, kind='stable')
+            _, first_occurrence = np.unique(self._get_keys(merged_coordinates[order]), return_index=True)
+            order = order[np.sort(first_occurrence)][:self.capacity]
+            # Write back
+            self.losses[scan_index].fill_(-1.0)
+            self.coordinates[scan_index, :order.shape[0]] = torch.from_numpy(merged_coordinates[order])
+            self.losses[scan_index, :order.shape[0]] = torch.from_numpy(merged_losses[order].astype(np.float32))
+
+    def sample(self, scan_index: Union[int, np.int64], npoints: int) -> np.ndarray:
+        """
+        Method samples hard coordinates of a scan, coordinates are drawn with a probability proportional to the loss
+        :param scan_index: (int) Scan index
+        :param npoints: (int) Maximal number of coordinates to sample
+        :return: (np.ndarray) Coordinates of shape (n <= npoints, 3)
+        """
+        losses = self.losses[scan_index].numpy().copy()
+        coordinates = self.coordinates[scan_index].numpy().copy()
+        valid = np.flatnonzero(losses > 0.0)
+        if valid.shape[0] == 0 or npoints == 0:
+            return np.zeros((0, 3), dtype=np.int64)
+        chosen = np.random.choice(valid, min(npoints, valid.shape[0]), replace=False,
+                                  p=losses[valid] / np.sum(losses[valid]))
+        return coordinates[chosen].astype(np.int64)
@@ -0,0 +1,475 @@
+from typing import Dict, Tuple, Union
+
+import concurrent.futures
+import copy
+import os
+import time
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+import Misc
+import ModelParts
+
+
+def get_decoder_bytes_per_coordinate(occupancy_network: nn.Module) -> int:
+    """
+    Function estimates the peak memory of decoding one coordinate from the widths of the decoder layers
+    :param occupancy_network: (nn.Module) Occupancy network
+    :return: (int) Estimated bytes per coordinate
+    """
+    widths = [module.out_features for module in occupancy_network.decoding.modules() if isinstance(module, nn.Linear)] \
+        if isinstance(getattr(occupancy_network, 'decoding', None), nn.Module) else []
+    if len(widths) == 0:
+        # Exported networks and convolutional decoders, assume the default decoder widths
+        return 4 * (483 + 6 * 128)
+    input_width = [module.in_features for module in occupancy_network.decoding.modules()
+                   if isinstance(module, nn.Linear)][0]
+    # Input, linear output, normalized output, activation and residual of the widest layer are alive at once
+    return 4 * (input_width + 6 * max(widths))
+
+
+def unpack_mask(packed_mask: np.ndarray, shape: Tuple[int, int, int]) -> np.ndarray:
+    """
+    Function unpacks a bit-packed occupancy mask
+    :param packed_mask: (np.ndarray) Bit-packed mask (C order)
+    :param shape: (Tuple[int, int, int]) Shape of the high resolution grid
+    :return: (np.ndarray) Boolean mask of the given shape
+    """
+    return np.unpackbits(packed_mask, count=int(np.prod(shape))).reshape(shape).astype(bool)
+
+
+def fold_batch_norm(layer: Union[nn.Linear, nn.Conv3d], batch_norm: Union[nn.BatchNorm1d, nn.BatchNorm3d]) -> None:
+    """
+    Function folds an eval mode batch normalization into the preceding linear or convolution layer
+    :param layer: (Union[nn.Linear, nn.Conv3d]) Layer followed by the batch normalization, modified in place
+    :param batch_norm: (Union[nn.BatchNorm1d, nn.BatchNorm3d]) Batch normalization with running statistics
+    """
+    scale = torch.rsqrt(batch_norm.running_var + batch_norm.eps)
+    shift = -batch_norm.running_mean * scale
+    if batch_norm.affine:
+        shift = shift * batch_norm.weight + batch_norm.bias
+        scale = scale * batch_norm.weight
+    bias = layer.bias if layer.bias is not None else torch.zeros_like(scale)
+    layer.weight = nn.Parameter(layer.weight * scale.view((-1,) + (1,) * (layer.weight.ndimension() - 1)))
+    layer.bias = nn.Parameter(bias * scale + shift)
+
+
+def get_foldable_batch_norm(normalization: nn.Module) -> Union[nn.BatchNorm1d, nn.BatchNorm3d, None]:
+    """
+    Function returns the batch normalization of a normalization built by Misc.get_normalization_1d/3d
+    :param normalization: (nn.Module) Normalization
+    :return: (Union[nn.BatchNorm1d, nn.BatchNorm3d, None]) Batch normalization with running statistics or None
+    """
+    if isinstance(normalization, nn.Sequential) and len(normalization) == 1:
+        normalization = normalization[0]
+    if isinstance(normalization, (nn.BatchNorm1d, nn.BatchNorm3d)) and normalization.running_mean is not None:
+        return normalization
+    return None
+
+
+def simplify_modules(module: nn.Module) -> None:
+    """
+    Function replaces empty sequential wrappers and dropout by identities and unwraps single module wrappers
+    :param module: (nn.Module) Module, modified in place
+    """
+    for name, child in module.named_children():
+        if isinstance(child, nn.Sequential) and len(child) == 0:
+            setattr(module, name, nn.Identity())
+        elif isinstance(child, nn.Sequential) and len(child) == 1 and not isinstance(module, nn.Sequential):
+            setattr(module, name, child[0])
+            simplify_modules(module)
+            return
+        elif isinstance(child, (nn.Dropout, nn.Dropout3d)):
+            setattr(module, name, nn.Identity())
+        else:
+            simplify_modules(child)
+
+
+@torch.no_grad()
+def optimize_for_inference(occupancy_network: nn.Module, volume: torch.Tensor = None,
+                           coordinates: torch.Tensor = None, atol: float = 1e-4, runs: int = 5) -> nn.Module:
+    """
+    Function builds an eval-only copy of an occupancy network. Batch normalizations (also the affine-free
+    normalization inside of conditional batch normalizations) are folded into the preceding linear or convolution
+    layers, no-op wrappers are replaced by identities and dropout is removed. If an example input is given the output
+    is verified against the original network and the latency of both is reported.
+    :param occupancy_network: (nn.Module) Occupancy network of Models.py
+    :param volume: (torch.Tensor) Example volume used for verification
+    :param coordinates: (torch.Tensor) Example coordinates used for verification
+    :param atol: (float) Maximal absolute difference of the outputs
+    :param runs: (int) Number of runs to measure the latency
+    :return: (nn.Module) Optimized network
+    """
+    if isinstance(occupancy_network, nn.DataParallel):
+        occupancy_network = occupancy_network.module
+    optimized_network = copy.deepcopy(occupancy_network).eval()
+    for module in optimized_network.modules():
+        if isinstance(module, ModelParts.VolumeEncoderBlock):
+            pairs = [(module.convolution_1, 'normalization_1'), (module.convolution_2, 'normalization_2')]
+        elif isinstance(module, ModelParts.CoordinatesFullyConnectedBlock):
+            pairs = [(module.linear_1, 'normalization_1'), (module.linear_2, 'normalization_2')]
+        else:
+            pairs = []
+        for layer, name in pairs:
+            normalization = getattr(module, name)
+            if isinstance(normalization, ModelParts.ConditionalBatchNorm1d):
+                # Normalization of the conditional batch normalization is performed before gamma and beta
+                batch_norm = get_foldable_batch_norm(normalization.normalization)
+                if batch_norm is not None:
+                    fold_batch_norm(layer, batch_norm)
+                    normalization.normalization = nn.Identity()
+            else:
+                batch_norm = get_foldable_batch_norm(normalization)
+                if batch_norm is not None:
+                    fold_batch_norm(layer, batch_norm)
+                    setattr(module, name, nn.Identity())
+        if hasattr(module, 'dropout_rate'):
+            module.dropout_rate = 0.0
+    simplify_modules(optimized_network)
+    optimized_network.requires_grad_(False)
+    if volume is not None and coordinates is not None:
+        # Reference runs in eval mode, the mode of the caller's network is restored afterwards
+        training_modes = [(module, module.training) for module in occupancy_network.modules()]
+        occupancy_network.eval()
+        latencies = []
+        outputs = []
+        try:
+            for network in (occupancy_network, optimized_network):
+                outputs.append(network(volume, coordinates))
+                start_time = time.time()
+                for _ in range(runs):
+                    network(volume, coordinates)
+                latencies.append((time.time() - start_time) / runs)
+        finally:
+            for module, training in training_modes:
+                module.training = training
+        difference = float((outputs[0] - outputs[1]).abs().max())
+        print('Optimized network: max difference {:.2e}, latency {:.4f}s -> {:.4f}s'.format(
+            difference, latencies[0], latencies[1]))
+        assert difference <= atol, 'Optimized network differs by {} (> {})'.format(difference, atol)
+    return optimized_network
+
+
+class DenseOccupancyInference(object):
+    """
+    Inference engine predicting the occupancy of every voxel of the high resolution grid of a scan. The scan is
+    encoded once, afterwards the grid is split into tiles of consecutive voxels which are decoded in parallel threads
+    under a fixed memory budget. The output mask is bit-packed.
+    """
+
+    def __init__(self, occupancy_network: Union[nn.Module, nn.DataParallel], side_len: int = 8,
+                 threshold: float = 0.5, memory_budget_mb: int = 2048, number_of_workers: int = None,
+                 device: str = 'cpu', empty_space_threshold: float = None, empty_space_dilation: int = 1) -> None:
+        """
+        Constructor method
+        :param occupancy_network: (nn.Module) Occupancy network providing encode and decode, a copy is moved to the
+        device, the given network is not changed
+        :param side_len: (int) Side length of one low resolution voxel in high resolution voxels
+        :param threshold: (float) Threshold of the occupancy probability
+        :param memory_budget_mb: (int) Memory budget of all tiles decoded at the same time
+        :param number_of_workers: (int) Number of threads decoding tiles, all cores if None (CPU) or one (GPU)
+        :param device: (str) Device to use
+        :param empty_space_threshold: (float) If given voxels in cells of the low resolution volume which can not be
+        occupied (see Misc.get_occupancy_mask) are predicted as empty without decoding
+        :param empty_space_dilation: (int) Dilation of the occupancy mask in cells
+        """
+        if isinstance(occupancy_network, nn.DataParallel):
+            occupancy_network = occupancy_network.module
+        # Exported networks run on the CPU and are used as they are
+        if isinstance(occupancy_network, nn.Module):
+            occupancy_network = copy.deepcopy(occupancy_network)
+        self.occupancy_network = occupancy_network.to(device).eval()
+        self.side_len = side_len
+        self.threshold = threshold
+        self.device = device
+        self.empty_space_threshold = empty_space_threshold
+        self.empty_space_dilation = empty_space_dilation
+        if number_of_workers is None:
+            number_of_workers = os.cpu_count() if device == 'cpu' else 1
+        self.number_of_workers = number_of_workers
+        # Tile size is a multiple of eight to write whole bytes of the packed mask
+        bytes_per_coordinate = get_decoder_bytes_per_coordinate(self.occupancy_network)
+        self.tile_size = max(8, (memory_budget_mb * 1024 ** 2 // (bytes_per_coordinate * number_of_workers)) // 8 * 8)
+
+    def get_grid_shape(self, volume: torch.Tensor) -> Tuple[int, int, int]:
+        """
+        Method returns the shape of the high resolution grid of a volume
+        :param volume: (torch.Tensor) Low resolution volume of shape (1, 1, x, y, z)
+        :return: (Tuple[int, int, int]) Grid shape
+        """
+        return tuple(int(dim) * self.side_len for dim in volume.shape[2:])
+
+    def get_occupancy_mask(self, volume: torch.Tensor) -> Union[torch.Tensor, None]:
+        """
+        Method returns the low resolution mask of cells which could be occupied
+        :param volume: (torch.Tensor) Low resolution volume of shape (1, 1, x, y, z)
+        :return: (torch.Tensor) Boolean mask of shape (x, y, z) or None if empty space is not skipped
+        """
+        if self.empty_space_threshold is None:
+            return None
+        return Misc.get_occupancy_mask(volume.to(self.device), self.empty_space_threshold, self.empty_space_dilation)
+
+    def decode_masked(self, latent: torch.Tensor, coordinates: torch.Tensor,
+                      occupancy_mask: Union[torch.Tensor, None]) -> Tuple[torch.Tensor, int]:
+        """
+        Method decodes coordinates, coordinates in empty space are predicted as empty without decoding
+        :param latent: (torch.Tensor) Latent vector of the scan
+        :param coordinates: (torch.Tensor) Coordinates of shape (n, 3)
+        :param occupancy_mask: (torch.Tensor) Low resolution occupancy mask or None
+        :return: (Tuple[torch.Tensor, int]) Occupancy probabilities of shape (n) and number of skipped coordinates
+        """
+        if occupancy_mask is None:
+            return self.occupancy_network.decode(latent, coordinates, chunk_size=self.tile_size).view(-1), 0
+        keep = Misc.get_occupancy_mask_lookup(occupancy_mask, coordinates, self.side_len)
+        prediction = torch.zeros(coordinates.shape[0], device=coordinates.device)
+        if bool(keep.any()):
+            prediction[keep] = self.occupancy_network.decode(latent, coordinates[keep],
+                                                             chunk_size=self.tile_size).view(-1)
+        return prediction, int(coordinates.shape[0] - keep.sum().item())
+
+    def get_coordinates(self, start: int, stop: int, grid_shape: Tuple[int, int, int]) -> torch.Tensor:
+        """
+        Method returns the coordinates of a range of voxels of the grid in C order
+        :param start: (int) First voxel
+        :param stop: (int) Voxel after the last voxel
+        :param grid_shape: (Tuple[int, int, int]) Grid shape
+        :return: (torch.Tensor) Coordinates of shape (stop - start, 3)
+        """
+        indexes = torch.arange(start, stop, device=self.device, dtype=torch.long)
+        return torch.stack((indexes // (grid_shape[1] * grid_shape[2]), (indexes // grid_shape[2]) % grid_shape[1],
+                            indexes % grid_shape[2]), dim=1).float()
+
+    @torch.no_grad()
+    def decode_tile(self, latent: torch.Tensor, start: int, stop: int, grid_shape: Tuple[int, int, int],
+                    packed_mask: np.ndarray, occupancy_mask: torch.Tensor = None) -> Tuple[int, int]:
+        """
+        Method decodes one tile and writes its bits into the packed mask
+        :param latent: (torch.Tensor) Latent vector of the scan
+        :param start: (int) First voxel of the tile (multiple of eight)
+        :param stop: (int) Voxel after the last voxel of the tile
+        :param grid_shape: (Tuple[int, int, int]) Grid shape
+        :param packed_mask: (np.ndarray) Packed output mask
+        :param occupancy_mask: (torch.Tensor) Low resolution occupancy mask or None
+        :return: (Tuple[int, int]) Number of occupied and number of skipped voxels in the tile
+        """
+        prediction, skipped = self.decode_masked(latent, self.get_coordinates(start, stop, grid_shape),
+                                                 occupancy_mask)
+        occupied = (prediction > self.threshold).cpu().numpy()
+        packed_mask[start // 8:start // 8 + (stop - start + 7) // 8] = np.packbits(occupied)
+        return int(occupied.sum()), skipped
+
+    @torch.no_grad()
+    def predict(self, volume: torch.Tensor, output_path: str = None) -> Dict[str, Union[np.ndarray, tuple, float]]:
+        """
+        Method predicts the occupancy of the full high resolution grid of one scan
+        :param volume: (torch.Tensor) Low resolution volume of shape (1, 1, x, y, z) or (1, x, y, z)
+        :param output_path: (str) Path of a .npy file the packed mask is memory mapped to, kept in memory if None
+        :return: (Dict[str, Union[np.ndarray, tuple, float]]) Packed mask, grid shape, number of occupied voxels,
+        number of skipped voxels, runtime and voxels per second
+        """
+        if volume.ndimension() == 4:
+            volume = volume.unsqueeze(dim=0)
+        grid_shape = self.get_grid_shape(volume)
+        number_of_voxels = int(np.prod(grid_shape))
+        if output_path is not None:
+            packed_mask = np.lib.format.open_memmap(output_path, mode='w+', dtype=np.uint8,
+                                                    shape=((number_of_voxels + 7) // 8,))
+        else:
+            packed_mask = np.zeros((number_of_voxels + 7) // 8, dtype=np.uint8)
+        start_time = time.time()
+        # Encode scan once
+        latent = self.occupancy_network.encode(volume.to(self.device).float())
+        occupancy_mask = self.get_occupancy_mask(volume)
+        tiles = [(start, min(start + self.tile_size, number_of_voxels))
+                 for start in range(0, number_of_voxels, self.tile_size)]
+        if self.number_of_workers > 1:
+            # Every thread uses a share of the intra-op threads of torch
+            number_of_threads = torch.get_num_threads()
+            torch.set_num_threads(max(1, number_of_threads // self.number_of_workers))
+            try:
+                with concurrent.futures.ThreadPoolExecutor(max_workers=self.number_of_workers) as executor:
+                    results = list(executor.map(
+                        lambda tile: self.decode_tile(latent, tile[0], tile[1], grid_shape, packed_mask,
+                                                      occupancy_mask), tiles))
+            finally:
+                torch.set_num_threads(number_of_threads)
+        else:
+            results = [self.decode_tile(latent, start, stop, grid_shape, packed_mask, occupancy_mask)
+                       for start, stop in tiles]
+        occupied = sum(result[0] for result in results)
+        skipped = sum(result[1] for result in results)
+        runtime = time.time() - start_time
+        if isinstance(packed_mask, np.memmap):
+            packed_mask.flush()
+        print('Dense inference of {} voxels in {:.2f}s ({:.0f} voxels/s), {} occupied, {} skipped'.format(
+            number_of_voxels, runtime, number_of_voxels / runtime, occupied, skipped))
+        return {'mask': packed_mask, 'shape': grid_shape, 'occupied': occupied, 'skipped': skipped,
+                'runtime': runtime, 'voxels_per_second': number_of_voxels / runtime}
+
+
+class OctreeOccupancyInference(DenseOccupancyInference):
+    """
+    Coarse-to-fine inference engine (multiresolution isosurface extraction). A coarse lattice of the high resolution
+    grid is decoded first, afterwards only cells whose corner predictions straddle the threshold or are uncertain are
+    subdivided until voxel resolution is reached. Cells with agreeing corners are filled with the prediction of the
+    corners.
+    """
+
+    def __init__(self, occupancy_network: Union[nn.Module, nn.DataParallel], side_len: int = 8,
+                 threshold: float = 0.5, initial_step: int = 16, uncertainty: float = 0.1,
+                 memory_budget_mb: int = 2048, device: str = 'cpu', empty_space_threshold: float = None,
+                 empty_space_dilation: int = 1) -> None:
+        """
+        Constructor method
+        :param occupancy_network: (nn.Module) Occupancy network providing encode and decode
+        :param side_len: (int) Side length of one low resolution voxel in high resolution voxels
+        :param threshold: (float) Threshold of the occupancy probability
+        :param initial_step: (int) Distance of the coarse lattice points in voxels (power of two)
+        :param uncertainty: (float) Cells with a corner prediction closer than this to the threshold are subdivided
+        :param memory_budget_mb: (int) Memory budget of the decoded coordinates
+        :param device: (str) Device to use
+        :param empty_space_threshold: (float) If given voxels in cells of the low resolution volume which can not be
+        occupied are predicted as empty without decoding
+        :param empty_space_dilation: (int) Dilation of the occupancy mask in cells
+        """
+        super(OctreeOccupancyInference, self).__init__(occupancy_network=occupancy_network, side_len=side_len,
+                                                       threshold=threshold, memory_budget_mb=memory_budget_mb,
+                                                       number_of_workers=1, device=device,
+                                                       empty_space_threshold=empty_space_threshold,
+                                                       empty_space_dilation=empty_space_dilation)
+        assert initial_step > 0 and (initial_step & (initial_step - 1)) == 0, 'Initial step has to be a power of two'
+        self.initial_step = initial_step
+        self.uncertainty = uncertainty
+        # Offsets of the eight corners of a cell
+        self.corner_offsets = np.stack(np.meshgrid([0, 1], [0, 1], [0, 1], indexing='ij'), axis=-1).reshape(-1, 3)
+
+    @torch.no_grad()
+    def predict(self, volume: torch.Tensor, output_path: str = None) -> Dict[str, Union[np.ndarray, tuple, float]]:
+        """
+        Method predicts the occupancy of the full high resolution grid of one scan
+        :param volume: (torch.Tensor) Low resolution volume of shape (1, 1, x, y, z) or (1, x, y, z)
+        :param output_path: (str) Path of a .npy file the packed mask is saved to
+        :return: (Dict[str, Union[np.ndarray, tuple, float]]) Packed mask, grid shape, number of occupied voxels,
+        number of decoder evaluations, runtime and voxels per second
+        """
+        if volume.ndimension() == 4:
+            volume = volume.unsqueeze(dim=0)
+        grid_shape = self.get_grid_shape(volume)
+        grid_max = np.array(grid_shape, dtype=np.int64) - 1
+        start_time = time.time()
+        latent = self.occupancy_network.encode(volume.to(self.device).float())
+        occupancy_mask = self.get_occupancy_mask(volume)
+        skipped = 0
+        mask = np.zeros(grid_shape, dtype=bool)
+        # Flat indexes and predictions of all decoded voxels (sorted)
+        evaluated_keys = np.zeros(0, dtype=np.int64)
+        evaluated_values = np.zeros(0, dtype=np.float32)
+        step = self.initial_step
+        cells = np.stack(np.meshgrid(*[np.arange(0, dim, step) for dim in grid_shape], indexing='ij'),
+                         axis=-1).reshape(-1, 3)
+        while cells.shape[0] > 0:
+            # Decode corners which are not decoded yet
+            corners = np.minimum(cells[:, None, :] + self.corner_offsets[None] * step, grid_max)
+            corner_keys = np.ravel_multi_index(tuple(corners.reshape(-1, 3).T), grid_shape)
+            new_keys = np.setdiff1d(corner_keys, evaluated_keys, assume_unique=False)
+            if new_keys.shape[0] > 0:
+                new_values, new_skipped = self.decode_keys(latent, new_keys, grid_shape, occupancy_mask)
+                skipped += new_skipped
+                evaluated_keys = np.concatenate((evaluated_keys, new_keys))
+                evaluated_values = np.concatenate((evaluated_values, new_values))
+                order = np.argsort(evaluated_keys, kind='stable')
+                evaluated_keys, evaluated_values = evaluated_keys[order], evaluated_values[order]
+            corner_values = evaluated_values[np.searchsorted(evaluated_keys, corner_keys)].reshape(-1, 8)
+            occupied = corner_values > self.threshold
+            if step == 1:
+                # Voxel resolution reached, every cell is its first corner
+                mask[tuple(cells.T)] = occupied[:, 0]
+                break
+            active = (occupied.any(axis=1) & ~occupied.all(axis=1)) | \
+                     (np.abs(corner_values - self.threshold) < self.uncertainty).any(axis=1)
+            # Fill cells with agreeing occupied corners
+            for cell in cells[~active & occupied.all(axis=1)]:
+                mask[cell[0]:cell[0] + step, cell[1]:cell[1] + step, cell[2]:cell[2] + step] = True
+            # Subdivide active cells
+            step //= 2
+            cells = (cells[active][:, None, :] + self.corner_offsets[None] * step).reshape(-1, 3)
+            cells = cells[(cells <= grid_max).all(axis=1)]
+        runtime = time.time() - start_time
+        packed_mask = np.packbits(mask.reshape(-1))
+        if output_path is not None:
+            np.save(output_path, packed_mask)
+        number_of_voxels = int(np.prod(grid_shape))
+        evaluations = int(evaluated_keys.shape[0]) - skipped
+        print('Octree inference of {} voxels in {:.2f}s ({:.0f} voxels/s), {} decoder evaluations ({:.4f} of dense), '
+              '{} skipped'.format(number_of_voxels, runtime, number_of_voxels / runtime, evaluations,
+                                  evaluations / number_of_voxels, skipped))
+        return {'mask': packed_mask, 'shape': grid_shape, 'occupied': int(mask.sum()), 'skipped': skipped,
+                'runtime': runtime, 'voxels_per_second': number_of_voxels / runtime, 'evaluations': evaluations}
+
+    def decode_keys(self, latent: torch.Tensor, keys: np.ndarray, grid_shape: Tuple[int, int, int],
+                    occupancy_mask: torch.Tensor = None) -> Tuple[np.ndarray, int]:
+        """
+        Method decodes voxels given by flat indexes in chunks of the tile size
+        :param latent: (torch.Tensor) Latent vector of the scan
+        :param keys: (np.ndarray) Flat indexes of the voxels
+        :param grid_shape: (Tuple[int, int, int]) Grid shape
+        :param occupancy_mask: (torch.Tensor) Low resolution occupancy mask or None
+        :return: (Tuple[np.ndarray, int]) Occupancy probabilities and number of skipped voxels
+        """
+        coordinates = torch.from_numpy(np.stack(np.unravel_index(keys, grid_shape), axis=1)).float().to(self.device)
+        prediction, skipped = self.decode_masked(latent, coordinates, occupancy_mask)
+        return prediction.cpu().numpy(), skipped
+
+    def compare(self, volume: torch.Tensor, tolerance: float = 1e-4) -> Dict[str, float]:
+        """
+        Method compares the octree prediction with the dense prediction of a scan
+        :param volume: (torch.Tensor) Low resolution volume
+        :param tolerance: (float) Maximal share of voxels allowed to differ
+        :return: (Dict[str, float]) Share of differing voxels, iou of the masks, share of decoder evaluations and
+        speedup
+        """
+        octree = self.predict(volume)
+        dense = DenseOccupancyInference(self.occupancy_network, side_len=self.side_len, threshold=self.threshold,
+                                        device=self.device, empty_space_threshold=self.empty_space_threshold,
+                                        empty_space_dilation=self.empty_space_dilation).predict(volume)
+        difference = int(np.unpackbits(np.bitwise_xor(octree['mask'], dense['mask'])).sum())
+        intersection = int(np.unpackbits(np.bitwise_and(octree['mask'], dense['mask'])).sum())
+        union = int(np.unpackbits(np.bitwise_or(octree['mask'], dense['mask'])).sum())
+        number_of_voxels = int(np.prod(octree['shape']))
+        report = {'difference': difference / number_of_voxels,
+                  'iou': intersection / union if union > 0 else 1.0,
+                  'evaluations': octree['evaluations'] / number_of_voxels,
+                  'speedup': dense['runtime'] / octree['runtime'],
+                  'within_tolerance': difference / number_of_voxels <= tolerance}
+        print('Octree vs. dense', report)
+        return report
+
+
+def evaluate_empty_space_skipping(dataset, threshold: float = 0.02, dilation: int = 1,
+                                  max_scans: int = None) -> Dict[str, float]:
+    """
+    Function reports the share of high resolution voxels skipped by the empty space mask and the recall of the mask,
+    the share of labeled voxels inside the mask is an upper bound of the recall of any prediction using the mask
+    :param dataset: (Datasets.WeaponDataset) Dataset providing low resolution volumes and label coordinates
+    :param threshold: (float) Intensity above which a cell could be occupied
+    :param dilation: (int) Dilation of the mask in cells
+    :param max_scans: (int) Maximal number of scans to evaluate
+    :return: (Dict[str, float]) Share of skipped voxels and recall of the mask
+    """
+    skipped = []
+    recall = []
+    for index in range(len(dataset) if max_scans is None else min(max_scans, len(dataset))):
+        name = dataset.index_wrapper[index + dataset.offset]
+        volume_n = dataset.load_volume(name)
+        label_n = dataset.load_label(name)
+        occupancy_mask = Misc.get_occupancy_mask(torch.from_numpy(volume_n), threshold, dilation)
+        skipped.append(1.0 - occupancy_mask.float().mean().item())
+        if label_n.shape[0] > 0:
+            recall.append(Misc.get_occupancy_mask_lookup(
+                occupancy_mask, torch.from_numpy(label_n.astype(np.int64)), dataset.side_len).float().mean().item())
+    report = {'skipped': float(np.mean(skipped)), 'recall': float(np.mean(recall)) if len(recall) > 0 else 1.0,
+              'recall_min': float(np.min(recall)) if len(recall) > 0 else 1.0}
+    print('Empty space skipping', report)
+    return report
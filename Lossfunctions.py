@@ -18,20 +18,23 @@ class DiceLoss(nn.Module):
         super(DiceLoss, self).__init__()
         self.smooth = smooth
 
-    def forward(self, prediction: torch.Tensor, label: torch.Tensor) -> torch.Tensor:
+    def forward(self, prediction: torch.Tensor, label: torch.Tensor, weight: torch.Tensor = None) -> torch.Tensor:
         '''
         Forward method calculates the dice loss
         :param prediction: (torch.tensor) Prediction tensor including probabilities
         :param label: (torch.tensor) Label tensor (one-hot encoded)
+        :param weight: (torch.tensor) Optional importance weight of every element
         :return: (torch.tensor) Dice loss
         '''
         # Flatten prediction and label
         prediction = prediction.view(-1)
         label = label.view(-1)
+        # Importance weights are applied once to every term
+        weight = torch.ones_like(prediction) if weight is None else weight.view(-1)
         # Calc intersection
-        intersect = torch.sum((prediction * label)) + self.smooth
+        intersect = torch.sum((weight * prediction * label)) + self.smooth
         # Calc union
-        union = torch.sum(prediction) + torch.sum(label) + self.smooth
+        union = torch.sum(weight * prediction) + torch.sum(weight * label) + self.smooth
         # Calc dice loss
         dice_loss = 1.0 - ((2.0 * intersect) / (union))
         return dice_loss
@@ -58,17 +61,21 @@ class FocalLoss(nn.Module):
         self.gamma = gamma
         self.reduce = reduce
 
-    def forward(self, prediction: torch.Tensor, label: torch.Tensor) -> torch.Tensor:
+    def forward(self, prediction: torch.Tensor, label: torch.Tensor, weight: torch.Tensor = None) -> torch.Tensor:
         '''
         Forward method calculates the dice loss
         :param prediction: (torch.tensor) Prediction tensor including probabilities
         :param label: (torch.tensor) Label tensor (one-hot encoded)
+        :param weight: (torch.tensor) Optional importance weight of every element
         :return: (torch.tensor) Dice loss
         '''
         # Calc binary cross entropy loss
         cross_entropy_loss = F.binary_cross_entropy(prediction, label, reduction='none')
         # Calc focal loss
         focal_loss = self.alpha * (1.0 - prediction) ** self.gamma * cross_entropy_loss
+        # Apply importance weights
+        if weight is not None:
+            focal_loss = focal_loss * weight
         # Reduce loss
         if self.reduce == 'mean':
             focal_loss = torch.mean(focal_loss)
@@ -77,6 +84,33 @@ class FocalLoss(nn.Module):
         return focal_loss
 
 
+class BinaryCrossEntropyLoss(nn.Module):
+    '''
+    Binary cross entropy loss supporting importance weights for every element
+    '''
+
+    def __init__(self, reduce: str = 'mean') -> None:
+        '''
+        Constructor method
+        :param reduce: (str) Reduction operation (mean, sum or none)
+        '''
+        # Call super constructor
+        super(BinaryCrossEntropyLoss, self).__init__()
+        # Check reduce parameter
+        assert reduce in ['mean', 'sum', 'none'], 'Illegal value of reduce parameter. Use mean, sum or none.'
+        self.reduce = reduce
+
+    def forward(self, prediction: torch.Tensor, label: torch.Tensor, weight: torch.Tensor = None) -> torch.Tensor:
+        '''
+        Forward method calculates the binary cross entropy loss
+        :param prediction: (torch.tensor) Prediction tensor including probabilities
+        :param label: (torch.tensor) Label tensor
+        :param weight: (torch.tensor) Optional importance weight of every element
+        :return: (torch.tensor) Binary cross entropy loss
+        '''
+        return F.binary_cross_entropy(prediction, label, weight=weight, reduction=self.reduce)
+
+
 if __name__ == '__main__':
     dice_loss = DiceLoss()
     # input = torch.cat([torch.ones(1, 1, 256, 256), torch.zeros(1, 1, 256, 256)], dim=1) # torch.softmax(torch.randn([1, 2, 256, 256]), dim=1)
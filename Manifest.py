@@ -0,0 +1,297 @@
+from typing import Dict, Tuple, Union
+
+import hashlib
+import json
+import numpy as np
+import os
+import time
+
+# Columns of the manifest, every column is stored as one memory mappable .npy file
+COLUMNS = ['name', 'volume_shape', 'label_count', 'label_min', 'label_max', 'has_label', 'split']
+SPLITS = {'train': 0, 'validation': 1, 'test': 2}
+
+
+class DatasetManifest(object):
+    """
+    Columnar manifest including per sample statistics and the train/validation/test split of a generated dataset
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        Constructor method
+        :param path: (str) Folder including the manifest columns
+        """
+        self.path = path
+        self.columns = {column: np.load(os.path.join(path, column + '.npy'), mmap_mode='r') for column in COLUMNS}
+        self.rows = {int(name): row for row, name in enumerate(self.columns['name'])}
+
+    def __len__(self) -> int:
+        return self.columns['name'].shape[0]
+
+    def __contains__(self, name: Union[int, str]) -> bool:
+        return int(name) in self.rows
+
+    def get_names(self, split: str = None, only_labeled: bool = True) -> np.ndarray:
+        """
+        Method returns the names of all samples of a split
+        :param split: (str) Split ('train', 'validation', 'test') or None for all samples
+        :param only_labeled: (bool) If true samples without label are skipped
+        :return: (np.ndarray) Sample names
+        """
+        mask = np.ones(len(self), dtype=bool)
+        if split is not None:
+            mask &= self.columns['split'] == SPLITS[split]
+        if only_labeled:
+            mask &= self.columns['has_label']
+        return np.array(self.columns['name'][mask])
+
+    def get(self, name: Union[int, str], column: str) -> np.ndarray:
+        """
+        Method returns the value of a column for a sample
+        :param name: (Union[int, str]) Name of the sample
+        :param column: (str) Column name
+        :return: (np.ndarray) Value
+        """
+        return np.array(self.columns[column][self.rows[int(name)]])
+
+    def get_volume_shape(self, name: Union[int, str]) -> Tuple[int, ...]:
+        """
+        Method returns the shape of the low resolution volume of a sample
+        :param name: (Union[int, str]) Name of the sample
+        :return: (Tuple[int, ...]) Volume shape
+        """
+        return tuple(int(dim) for dim in self.get(name, 'volume_shape'))
+
+    def get_bounding_box(self, name: Union[int, str]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Method returns the bounding box of the high resolution label of a sample
+        :param name: (Union[int, str]) Name of the sample
+        :return: (Tuple[np.ndarray, np.ndarray]) Minimal and maximal label coordinate
+        """
+        return self.get(name, 'label_min'), self.get(name, 'label_max')
+
+
+class DatasetManifestWriter(object):
+    """
+    Class collects the statistics of every generated sample and writes the manifest
+    """
+
+    def __init__(self, path: str, validation_share: float = 0.02, test_share: float = 0.1, seed: int = 1904) -> None:
+        """
+        Constructor method
+        :param path: (str) Folder to store the manifest columns
+        :param validation_share: (float) Share of samples in the validation split
+        :param test_share: (float) Share of samples in the test split
+        :param seed: (int) Seed of the split permutation
+        """
+        self.path = path
+        self.validation_share = validation_share
+        self.test_share = test_share
+        self.seed = seed
+        self.rows = dict()
+
+    def add(self, name: Union[int, str], volume_shape: Tuple[int, ...], label: np.ndarray) -> None:
+        """
+        Method records the statistics of one sample
+        :param name: (Union[int, str]) Name of the sample
+        :param volume_shape: (Tuple[int, ...]) Shape of the low resolution volume (1, x, y, z)
+        :param label: (np.ndarray) High resolution label coordinates of shape (n, 3)
+        """
+        has_label = label.shape[0] > 0
+        self.add_row(name, volume_shape, label.shape[0],
+                     label.min(axis=0) if has_label else np.zeros(3),
+                     label.max(axis=0) if has_label else np.zeros(3))
+
+    def add_row(self, name: Union[int, str], volume_shape: Tuple[int, ...], label_count: int,
+                label_min: np.ndarray, label_max: np.ndarray, split: str = None) -> None:
+        """
+        Method records precomputed statistics of one sample
+        :param name: (Union[int, str]) Name of the sample
+        :param volume_shape: (Tuple[int, ...]) Shape of the low resolution volume (1, x, y, z)
+        :param label_count: (int) Number of label coordinates
+        :param label_min: (np.ndarray) Minimal label coordinate
+        :param label_max: (np.ndarray) Maximal label coordinate
+        :param split: (str) Fixed split of the sample, if None the split is assigned while closing
+        """
+        self.rows[int(name)] = {'name': int(name), 'volume_shape': tuple(volume_shape),
+                                'label_count': int(label_count), 'label_min': label_min, 'label_max': label_max,
+                                'has_label': label_count > 0, 'split': split}
+
+    def close(self) -> Dict[int, str]:
+        """
+        Method assigns the split deterministically and writes the columns. Samples with a fixed split keep it, so
+        adding samples to a dataset does not move existing samples between splits.
+        :return: (Dict[int, str]) Split of every sample
+        """
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        names = sorted(self.rows.keys())
+        split = np.array([SPLITS[self.rows[name]['split']] if self.rows[name].get('split') is not None else
+                          SPLITS['train'] for name in names], dtype=np.uint8)
+        # Deterministic split assignment of all samples without fixed split
+        unassigned = np.array([row for row, name in enumerate(names) if self.rows[name].get('split') is None],
+                              dtype=np.int64)
+        permutation = unassigned[np.random.RandomState(self.seed).permutation(unassigned.shape[0])]
+        number_of_validation = int(round(unassigned.shape[0] * self.validation_share))
+        number_of_test = int(round(unassigned.shape[0] * self.test_share))
+        split[permutation[:number_of_validation]] = SPLITS['validation']
+        split[permutation[number_of_validation:number_of_validation + number_of_test]] = SPLITS['test']
+        columns = {'name': np.array(names, dtype=np.int64),
+                   'volume_shape': np.array([self.rows[name]['volume_shape'] for name in names],
+                                            dtype=np.int32).reshape(-1, 4),
+                   'label_count': np.array([self.rows[name]['label_count'] for name in names], dtype=np.int64),
+                   'label_min': np.array([self.rows[name]['label_min'] for name in names],
+                                         dtype=np.int32).reshape(-1, 3),
+                   'label_max': np.array([self.rows[name]['label_max'] for name in names],
+                                         dtype=np.int32).reshape(-1, 3),
+                   'has_label': np.array([self.rows[name]['has_label'] for name in names], dtype=bool),
+                   'split': split}
+        for column, values in columns.items():
+            np.save(os.path.join(self.path, column + '.npy'), values)
+        split_names = {value: key for key, value in SPLITS.items()}
+        return {name: split_names[int(value)] for name, value in zip(names, split)}
+
+
+def get_file_hash(path: str, chunk_size_mb: int = 16) -> str:
+    """
+    Function computes the content hash of a file by reading it in chunks
+    :param path: (str) Path of the file
+    :param chunk_size_mb: (int) Size of the chunks read at once
+    :return: (str) Hex digest
+    """
+    file_hash = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size_mb * 1024 ** 2), b''):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+def get_source_hashes(sources: dict, paths: dict) -> dict:
+    """
+    Function computes the missing content hashes of source states
+    :param sources: (dict) State of every source file (see GenerationManifest.get_source_state)
+    :param paths: (dict) Path of every source file
+    :return: (dict) States including content hashes
+    """
+    return {key: state if state is None or state['hash'] is not None else
+            dict(state, hash=get_file_hash(paths[key])) for key, state in sources.items()}
+
+
+def get_array_hash(array: np.ndarray) -> str:
+    """
+    Function computes the content hash of an array including dtype and shape
+    :param array: (np.ndarray) Array
+    :return: (str) Hex digest
+    """
+    array_hash = hashlib.blake2b(digest_size=20)
+    array_hash.update(str((array.dtype.str, array.shape)).encode())
+    array_hash.update(np.ascontiguousarray(array).tobytes())
+    return array_hash.hexdigest()
+
+
+class GenerationManifest(object):
+    """
+    Record of a dataset generation run. For every source scan the manifest stores the stable output index, the
+    state and content hash of the source files, the conversion parameters, the checksums of the outputs and the
+    statistics needed to rebuild the dataset manifest. It is written atomically every few converted scans, so an
+    interrupted run can be resumed and re-runs only convert new or changed scans.
+    """
+
+    def __init__(self, path: str, save_interval: int = 16, save_seconds: float = 60.0) -> None:
+        """
+        Constructor method
+        :param path: (str) Path of the json file, loaded if present
+        :param save_interval: (int) Number of recorded scans after which the manifest is saved
+        :param save_seconds: (float) Time after which the manifest is saved at the next recorded scan
+        """
+        self.path = path
+        self.save_interval = save_interval
+        self.save_seconds = save_seconds
+        self.unsaved = 0
+        self.last_save = time.time()
+        self.scans = dict()
+        if os.path.exists(path):
+            with open(path, 'r') as file:
+                self.scans = json.load(file)['scans']
+
+    def get_index(self, source: str) -> int:
+        """
+        Method returns the stable output index of a source scan, new scans get the next free index
+        :param source: (str) Key of the source scan (path relative to the dataset root)
+        :return: (int) Output index
+        """
+        if source not in self.scans:
+            self.scans[source] = {'index': max([scan['index'] for scan in self.scans.values()], default=-1) + 1}
+        return self.scans[source]['index']
+
+    def get_source_state(self, source: str, key: str, path: Union[str, None]) -> Union[dict, None]:
+        """
+        Method returns the state of a source file. If the size and modification time equal the recorded state the
+        recorded content hash is returned. If only the modification time differs (e.g. touch or copy) the content hash
+        is computed, so unchanged content is not converted again. Otherwise the content changed and the hash is None,
+        it is computed by the conversion (see get_source_hashes).
+        :param source: (str) Key of the source scan
+        :param key: (str) Kind of the source file ('data' or 'label')
+        :param path: (str) Path of the source file or None
+        :return: (dict) Size, modification time and content hash or None
+        """
+        if path is None:
+            return None
+        stat = os.stat(path)
+        recorded = self.scans.get(source, dict()).get('sources', dict()).get(key)
+        if recorded is not None and recorded['size'] == stat.st_size and recorded['mtime_ns'] == stat.st_mtime_ns:
+            return recorded
+        if recorded is not None and recorded['size'] == stat.st_size:
+            return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'hash': get_file_hash(path)}
+        return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'hash': None}
+
+    def is_up_to_date(self, source: str, sources: dict, parameters: dict) -> bool:
+        """
+        Method checks if a scan was converted from the same source content with the same parameters
+        :param source: (str) Key of the source scan
+        :param sources: (dict) Current state of the source files (see get_source_state)
+        :param parameters: (dict) Current conversion parameters
+        :return: (bool) True if the recorded outputs are valid
+        """
+        scan = self.scans.get(source, dict())
+        if 'outputs' not in scan or scan.get('parameters') != parameters:
+            return False
+        recorded = scan['sources']
+        return all((recorded.get(key) is None) == (state is None) and
+                   (state is None or (state['hash'] is not None and recorded[key]['hash'] == state['hash']))
+                   for key, state in sources.items())
+
+    def update_sources(self, source: str, sources: dict) -> None:
+        """
+        Method updates the recorded state of the source files of an up to date scan (e.g. a new modification time)
+        :param source: (str) Key of the source scan
+        :param sources: (dict) State of the source files
+        """
+        self.scans[source]['sources'] = sources
+
+    def record(self, source: str, sources: dict, parameters: dict, outputs: dict, statistics: Union[dict, None],
+               ) -> None:
+        """
+        Method records a converted scan, the manifest is saved every save_interval scans or save_seconds
+        :param source: (str) Key of the source scan
+        :param sources: (dict) State of the source files
+        :param parameters: (dict) Conversion parameters
+        :param outputs: (dict) Checksum of every output array, empty if the scan was skipped
+        :param statistics: (dict) Statistics for the dataset manifest or None if the scan was skipped
+        """
+        self.scans[source].update({'sources': sources, 'parameters': parameters, 'outputs': outputs,
+                                   'statistics': statistics})
+        self.unsaved += 1
+        if self.unsaved >= self.save_interval or time.time() - self.last_save >= self.save_seconds:
+            self.save()
+
+    def save(self) -> None:
+        """
+        Method writes the manifest atomically
+        """
+        temporary_path = self.path + '.tmp'
+        with open(temporary_path, 'w') as file:
+            json.dump({'scans': self.scans}, file, indent=1)
+        os.replace(temporary_path, self.path)
+        self.unsaved = 0
+        self.last_save = time.time()
@@ -2,6 +2,7 @@ from typing import List, Union, Tuple
 
 import torch
 import torch.nn as nn
+import torch.utils.data
 import numpy as np
 import os
 from pykdtree.kdtree import KDTree
@@ -261,6 +262,22 @@ def get_downsampling_3d(downsampling: str, factor: int = 2, channels: int = 0) -
         raise RuntimeError('Downsampling {} is not available'.format(downsampling))
 
 
+def get_encoder(encoder_backend: str, blocks: List[nn.Module], sparse_threshold: float = 0.02) -> nn.Module:
+    """
+    Method to return different types of volume encoders
+    :param encoder_backend: (str) Type of encoder ('dense', 'sparse')
+    :param blocks: (List[nn.Module]) Encoder blocks (VolumeEncoderBlock for dense, SparseVolumeEncoderBlock for sparse)
+    :param sparse_threshold: (float) Intensity threshold of active voxels (only for sparse)
+    :return: (nn.Module) Encoder mapping volumes to encoded volumes
+    """
+    if encoder_backend == 'dense':
+        return nn.Sequential(*blocks)
+    elif encoder_backend == 'sparse':
+        return ModelParts.SparseVolumeEncoder(blocks, threshold=sparse_threshold)
+    else:
+        raise ValueError('Encoder backend {} is not available!'.format(encoder_backend))
+
+
 def parse_to_list(
         possible_list: Union[int, float, bool, str, Tuple[int], List[Union[int, float, bool, str, Tuple[int]]]],
         length: int, name: str = '') -> List[Union[int, float, bool, str]]:
@@ -287,6 +304,14 @@ def many_to_one_collate_fn_sample(batch):
     volumes = torch.stack([elm[0] for elm in batch], dim=0)
     coords = torch.stack([elm[1] for elm in batch], dim=0).view(-1, 3)
     labels = torch.stack([elm[2] for elm in batch], dim=0).view(-1, 1)
+    # Importance weights of content sampling and scan indexes of hard mining
+    if len(batch[0]) > 4:
+        weights = torch.stack([elm[3] for elm in batch], dim=0).view(-1, 1)
+        scan_indexes = torch.stack([elm[4] for elm in batch], dim=0)
+        return volumes, coords, labels, weights, scan_indexes
+    if len(batch[0]) > 3:
+        weights = torch.stack([elm[3] for elm in batch], dim=0).view(-1, 1)
+        return volumes, coords, labels, weights
 
     return volumes, coords, labels
 
@@ -300,6 +325,56 @@ def many_to_one_collate_fn_sample_down(batch):
     return volumes, coords, labels, low_volumes
 
 
+def get_collate_output(elem: torch.Tensor, shape: Tuple[int, ...]) -> torch.Tensor:
+    """
+    Function allocates the output tensor of a collate function. Inside of a data loader worker the tensor is
+    allocated directly in shared memory, like the default collate function does, so the batch is not copied again
+    while it is sent to the main process. Every batch gets a new allocation, buffers are not reused since the worker
+    can not tell when the main process releases a batch.
+    :param elem: (torch.Tensor) Element of the batch defining dtype
+    :param shape: (Tuple[int, ...]) Shape of the output tensor
+    :return: (torch.Tensor) Uninitialized output tensor
+    """
+    if torch.utils.data.get_worker_info() is None:
+        return torch.empty(shape, dtype=elem.dtype)
+    numel = int(np.prod(shape))
+    try:
+        storage = elem._typed_storage()._new_shared(numel, device=elem.device)
+    except (AttributeError, TypeError):
+        try:
+            storage = elem.storage()._new_shared(numel)
+        except (AttributeError, TypeError):
+            # Public API of torch versions without the private storage methods, the tensor is moved once
+            return torch.empty(shape, dtype=elem.dtype).share_memory_()
+    return elem.new(storage).resize_(shape)
+
+
+def many_to_one_collate_fn_sample_compact(batch):
+    volumes = torch.stack([elm[0] for elm in batch], dim=0,
+                          out=get_collate_output(batch[0][0], (len(batch),) + tuple(batch[0][0].shape)))
+    coords = torch.cat([elm[1] for elm in batch], dim=0,
+                       out=get_collate_output(batch[0][1], (sum(elm[1].shape[0] for elm in batch), 3)))
+    labels = torch.cat([elm[2] for elm in batch], dim=0,
+                       out=get_collate_output(batch[0][2], (sum(elm[2].shape[0] for elm in batch), 1)))
+    # Importance weights of content sampling and scan indexes of hard mining
+    if len(batch[0]) > 3:
+        weights = torch.cat([elm[3] for elm in batch], dim=0,
+                            out=get_collate_output(batch[0][3], (sum(elm[3].shape[0] for elm in batch), 1)))
+        if len(batch[0]) > 4:
+            return volumes, coords, labels, weights, torch.stack([elm[4] for elm in batch], dim=0)
+        return volumes, coords, labels, weights
+
+    return volumes, coords, labels
+
+
+def many_to_one_collate_fn_sample_down_compact(batch):
+    volumes, coords, labels = many_to_one_collate_fn_sample_compact([elm[:3] for elm in batch])
+    low_volumes = torch.stack([elm[3] for elm in batch], dim=0,
+                              out=get_collate_output(batch[0][3], (len(batch),) + tuple(batch[0][3].shape)))
+
+    return volumes, coords, labels, low_volumes
+
+
 def draw_test(locs, actual, volume, side_len: int, batch_index: int, draw_out_path: str = 'obj') -> None:
     draw_out_path = os.path.join(os.getcwd(), draw_out_path)
     if not os.path.exists(draw_out_path):
@@ -397,6 +472,167 @@ def get_number_of_network_parameters(network: nn.Module) -> int:
     return sum(p.numel() for p in network.parameters() if p.requires_grad)
 
 
+def quantize_volume(volume: np.ndarray, storage_dtype: str = 'float32') -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Function quantizes a volume for storage. Integer formats use a per volume scale and offset.
+    :param volume: (np.ndarray) Volume to be quantized
+    :param storage_dtype: (str) Storage format ('float32', 'float16', 'uint16', 'uint8')
+    :return: (Tuple[np.ndarray, np.ndarray]) Quantized volume and (scale, offset) (None for float formats)
+    """
+    assert storage_dtype in ['float32', 'float16', 'uint16', 'uint8'], \
+        'Storage format {} is not available!'.format(storage_dtype)
+    if storage_dtype in ['float32', 'float16']:
+        return volume.astype(storage_dtype), None
+    offset = float(np.min(volume)) if volume.size > 0 else 0.0
+    maximum = float(np.max(volume)) if volume.size > 0 else 0.0
+    scale = (maximum - offset) / float(np.iinfo(storage_dtype).max)
+    if scale == 0.0:
+        scale = 1.0
+    quantized = np.round((volume - offset) / scale).astype(storage_dtype)
+    return quantized, np.array([scale, offset], dtype=np.float64)
+
+
+def dequantize_volume(volume: np.ndarray, scale_offset: np.ndarray = None) -> np.ndarray:
+    """
+    Function converts a stored volume back to float32
+    :param volume: (np.ndarray) Stored volume
+    :param scale_offset: (np.ndarray) Scale and offset of integer formats (None for float formats)
+    :return: (np.ndarray) Volume as float32
+    """
+    if scale_offset is None:
+        return volume.astype(np.float32)
+    return (volume.astype(np.float32) * np.float32(scale_offset[0]) + np.float32(scale_offset[1]))
+
+
+def get_occupancy_mask(volume: torch.Tensor, threshold: float = 0.02, dilation: int = 1) -> torch.Tensor:
+    """
+    Function derives a conservative mask of low resolution cells which could be occupied. Cells above the threshold
+    are dilated by max pooling, every high resolution voxel of a cell outside the mask is considered empty.
+    :param volume: (torch.Tensor) Low resolution volume of shape (x, y, z), (1, x, y, z) or (1, 1, x, y, z)
+    :param threshold: (float) Intensity above which a cell could be occupied
+    :param dilation: (int) Number of cells the mask is dilated by
+    :return: (torch.Tensor) Boolean mask of shape (x, y, z)
+    """
+    volume = volume.reshape((1, 1) + tuple(volume.shape[-3:])).float()
+    mask = (volume > threshold).float()
+    if dilation > 0:
+        mask = nn.functional.max_pool3d(mask, kernel_size=2 * dilation + 1, stride=1, padding=dilation)
+    return mask[0, 0] > 0.0
+
+
+def get_occupancy_mask_lookup(mask: torch.Tensor, coordinates: torch.Tensor, side_len: int) -> torch.Tensor:
+    """
+    Function looks up the low resolution occupancy mask for high resolution coordinates
+    :param mask: (torch.Tensor) Boolean mask of shape (x, y, z) (see get_occupancy_mask)
+    :param coordinates: (torch.Tensor) High resolution coordinates of shape (n, 3)
+    :param side_len: (int) Side length of one low resolution cell in high resolution voxels
+    :return: (torch.Tensor) True for every coordinate which could be occupied of shape (n)
+    """
+    cells = (coordinates.long() // side_len).to(mask.device)
+    cells = torch.min(torch.max(cells, torch.zeros_like(cells)),
+                      torch.tensor(mask.shape, device=mask.device, dtype=torch.long) - 1)
+    return mask[cells[:, 0], cells[:, 1], cells[:, 2]]
+
+
+def get_pyramid_level_path(pyramid_path: str, side_len: int) -> str:
+    """
+    Function returns the folder of one level of a generated resolution pyramid
+    :param pyramid_path: (str) Root folder of the pyramid
+    :param side_len: (int) Side length of the level
+    :return: (str) Folder of the level
+    """
+    return os.path.join(pyramid_path, 'len_{}'.format(side_len), '')
+
+
+def get_pyramid_label_path(pyramid_path: str) -> str:
+    """
+    Function returns the folder of the full resolution labels of a generated resolution pyramid
+    :param pyramid_path: (str) Root folder of the pyramid
+    :return: (str) Folder of the labels
+    """
+    return os.path.join(pyramid_path, 'labels', '')
+
+
+def downsample_label_coordinates(coordinates: np.ndarray, factor: int) -> np.ndarray:
+    """
+    Function downsamples label coordinates, a coarse voxel is labeled if any of its fine voxels is labeled
+    :param coordinates: (np.ndarray) Label coordinates of shape (n, 3)
+    :param factor: (int) Downsampling factor
+    :return: (np.ndarray) Unique coarse label coordinates of shape (m <= n, 3)
+    """
+    if factor == 1:
+        return coordinates
+    return np.unique(coordinates // factor, axis=0).astype(coordinates.dtype)
+
+
+class LabelOccupancy(object):
+    """
+    Bit-packed occupancy volume covering the bounding box of the label coordinates.
+    Membership of integer coordinates is answered in O(1) per query by a vectorized gather.
+    """
+
+    def __init__(self, origin: np.ndarray, shape: np.ndarray, bits: np.ndarray) -> None:
+        """
+        Constructor method
+        :param origin: (np.ndarray) Minimal label coordinate of shape (3)
+        :param shape: (np.ndarray) Shape of the label bounding box (3)
+        :param bits: (np.ndarray) Bit-packed occupancy of the bounding box (uint8)
+        """
+        self.origin = origin.astype(np.int64)
+        self.shape = shape.astype(np.int64)
+        self.bits = bits
+
+    @classmethod
+    def from_coordinates(cls, label: np.ndarray) -> 'LabelOccupancy':
+        """
+        Method builds the occupancy volume from label coordinates
+        :param label: (np.ndarray) Label coordinates of shape (n, 3)
+        :return: (LabelOccupancy) Occupancy object
+        """
+        if label.shape[0] == 0:
+            return cls(np.zeros(3), np.zeros(3), np.zeros(0, dtype=np.uint8))
+        label = label.astype(np.int64)
+        origin = label.min(axis=0)
+        shape = label.max(axis=0) - origin + 1
+        occupancy = np.zeros(int(np.prod(shape)), dtype=bool)
+        occupancy[np.ravel_multi_index((label - origin).T, tuple(int(dim) for dim in shape))] = True
+        return cls(origin, shape, np.packbits(occupancy))
+
+    @classmethod
+    def from_array(cls, array: np.ndarray) -> 'LabelOccupancy':
+        """
+        Method restores the occupancy volume from its serialized form
+        :param array: (np.ndarray) Serialized occupancy (uint8)
+        :return: (LabelOccupancy) Occupancy object
+        """
+        header = np.frombuffer(array[:48].tobytes(), dtype=np.int64)
+        return cls(header[:3], header[3:], array[48:])
+
+    def to_array(self) -> np.ndarray:
+        """
+        Method serializes the occupancy volume into one uint8 array (bounding box header + bits)
+        :return: (np.ndarray) Serialized occupancy
+        """
+        header = np.concatenate((self.origin, self.shape)).astype(np.int64).view(np.uint8)
+        return np.concatenate((header, self.bits))
+
+    def contains(self, coordinates: np.ndarray) -> np.ndarray:
+        """
+        Method checks which coordinates are labeled
+        :param coordinates: (np.ndarray) Integer coordinates of shape (n, 3)
+        :return: (np.ndarray) Boolean array of shape (n)
+        """
+        relative = coordinates.astype(np.int64) - self.origin
+        inside = np.all((relative >= 0) & (relative < self.shape), axis=1)
+        linear = relative[:, 0] * (self.shape[1] * self.shape[2]) + relative[:, 1] * self.shape[2] + relative[:, 2]
+        linear[~inside] = 0
+        if self.bits.shape[0] == 0:
+            return inside
+        # Gather bits (packbits uses big endian bit order)
+        occupied = ((self.bits[linear >> 3] >> (7 - (linear & 7))) & 1).astype(bool)
+        return occupied & inside
+
+
 class FilePermutation(object):
     """
     Class to shuffle data files
@@ -1,3 +1,7 @@
+from typing import List, Optional, Tuple
+
+import weakref
+
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
@@ -5,6 +9,39 @@ import torch.nn.functional as F
 import Misc
 
 
+def factored_linear(linear: nn.Linear, latent: torch.Tensor, coordinates: torch.Tensor) -> torch.Tensor:
+    """
+    Function applies a linear layer to the concatenation of repeated latent vectors and coordinates without
+    materializing the concatenation. The latent part is computed once per volume and added by broadcasting.
+    :param linear: (nn.Linear) Linear layer with in_features = latent features + coordinate features
+    :param latent: (torch.Tensor) Latent vectors of shape (batch size, latent features)
+    :param coordinates: (torch.Tensor) Coordinates of shape (batch size * coordinates, coordinate features)
+    :return: (torch.Tensor) Output tensor of shape (batch size * coordinates, out_features)
+    """
+    output_latent = F.linear(latent, linear.weight[:, :latent.shape[1]], linear.bias)
+    output_coordinates = F.linear(coordinates, linear.weight[:, latent.shape[1]:])
+    return (output_coordinates.view(latent.shape[0], -1, output_coordinates.shape[1])
+            + output_latent.unsqueeze(dim=1)).view(-1, output_coordinates.shape[1])
+
+
+def factored_convolution(convolution: nn.Conv3d, volume: torch.Tensor, coordinates: torch.Tensor) -> torch.Tensor:
+    """
+    Function applies a 3D convolution to the channel concatenation of repeated volumes and coordinate maps without
+    materializing the concatenation. The volume part is computed once per volume and added by broadcasting, zero
+    padding is applied per channel so both parts sum up to the convolution of the concatenation.
+    :param convolution: (nn.Conv3d) Convolution with in_channels = volume channels + coordinate channels
+    :param volume: (torch.Tensor) Volumes of shape (batch size, volume channels, x, y, z)
+    :param coordinates: (torch.Tensor) Coordinate maps of shape (batch size * coordinates, coordinate channels, x, y, z)
+    :return: (torch.Tensor) Output tensor of shape (batch size * coordinates, out_channels, x_out, y_out, z_out)
+    """
+    output_volume = F.conv3d(volume, convolution.weight[:, :volume.shape[1]], convolution.bias, convolution.stride,
+                             convolution.padding, convolution.dilation)
+    output_coordinates = F.conv3d(coordinates, convolution.weight[:, volume.shape[1]:], None, convolution.stride,
+                                  convolution.padding, convolution.dilation)
+    return (output_coordinates.view(volume.shape[0], -1, *output_coordinates.shape[1:])
+            + output_volume.unsqueeze(dim=1)).view(-1, *output_coordinates.shape[1:])
+
+
 class VolumeEncoderBlock(nn.Module):
     """
     Basic Volume Residual Encoder Block
@@ -60,8 +97,32 @@ class VolumeEncoderBlock(nn.Module):
         :param input: (torch.tensor) Input volume with shape (batch size, channels_in, x_in, y_in, z_in)
         :return: (torch.tensor) Output tensor with shape (batch size, channels_out, x_out, y_out, z_out)
         """
+        return self.forward_stages(self.convolution_1(input), self.residual_mapping(input))
+
+    def forward_factored(self, volume: torch.Tensor, coordinates: torch.Tensor) -> torch.Tensor:
+        """
+        Forward pass equivalent to forward(cat(repeat_interleave(volume), coordinates)), the first convolution and the
+        residual mapping are split into a volume part computed once per volume and a coordinate part
+        :param volume: (torch.tensor) Volumes with shape (batch size, volume channels, x_in, y_in, z_in)
+        :param coordinates: (torch.tensor) Coordinate maps with shape (batch size * coordinates, coordinate channels,
+        x_in, y_in, z_in)
+        :return: (torch.tensor) Output tensor with shape (batch size * coordinates, channels_out, x_out, y_out, z_out)
+        """
+        if isinstance(self.residual_mapping, nn.Conv3d):
+            residual = factored_convolution(self.residual_mapping, volume, coordinates)
+        else:
+            residual = torch.cat((torch.repeat_interleave(volume, int(coordinates.shape[0] / volume.shape[0]), dim=0),
+                                  coordinates), dim=1)
+        return self.forward_stages(factored_convolution(self.convolution_1, volume, coordinates), residual)
+
+    def forward_stages(self, output: torch.Tensor, residual: torch.Tensor) -> torch.Tensor:
+        """
+        Method performs the block after the first convolution
+        :param output: (torch.tensor) Output of the first convolution with shape (batch size, channels_out, x, y, z)
+        :param residual: (torch.tensor) Residual mapping of the input with shape (batch size, channels_out, x, y, z)
+        :return: (torch.tensor) Output tensor with shape (batch size, channels_out, x_out, y_out, z_out)
+        """
         # First stage
-        output = self.convolution_1(input)
         output = self.normalization_1(output)
         output = self.activation_1(output)
         if self.dropout_rate > 0.0:  # Perform dropout
@@ -72,7 +133,7 @@ class VolumeEncoderBlock(nn.Module):
         output = self.activation_2(output)
         if self.dropout_rate > 0.0:  # Perform dropout
             output = F.dropout(output, p=self.dropout_rate)
-        output = output + self.residual_mapping(input)
+        output = output + residual
         # Downsampling stage
         output = self.downsampling(output)
         return output
@@ -115,17 +176,51 @@ class CoordinatesFullyConnectedBlock(nn.Module):
         else:
             self.residual_mapping = nn.Linear(in_features=input_channels, out_features=output_channels, bias=bias)
 
-    def forward(self, input: torch.Tensor, latent_tensor: torch.Tensor = None) -> torch.Tensor:
+    def forward(self, input: torch.Tensor, latent_tensor: torch.Tensor = None,
+                conditions: Tuple[Optional[Tuple[torch.Tensor, torch.Tensor]], ...] = None) -> torch.Tensor:
         """
         Forward pass of the fully connected residual block
         :param input: (torch.tensor) Input coordinates with shape (batch size, channels_in)
+        :param latent_tensor: (torch.tensor) Latent vectors used for conditional batch normalization
+        :param conditions: (Tuple) Precomputed gamma and beta of both normalizations (see get_fused_conditions)
+        :return: (torch.tensor) Output tensor with shape (batch size, channels_out)
+        """
+        return self.forward_stages(self.linear_1(input), self.residual_mapping(input), latent_tensor, conditions)
+
+    def forward_factored(self, latent: torch.Tensor, coordinates: torch.Tensor, latent_tensor: torch.Tensor = None,
+                         conditions: Tuple[Optional[Tuple[torch.Tensor, torch.Tensor]], ...] = None) -> torch.Tensor:
+        """
+        Forward pass equivalent to forward(cat(repeat_interleave(latent), coordinates)), the first linear layer and the
+        residual mapping are split into a latent part computed once per volume and a coordinate part
+        :param latent: (torch.tensor) Latent vectors with shape (batch size, latent channels)
+        :param coordinates: (torch.tensor) Coordinates with shape (batch size * coordinates, coordinate channels)
+        :param latent_tensor: (torch.tensor) Latent vectors used for conditional batch normalization
+        :param conditions: (Tuple) Precomputed gamma and beta of both normalizations (see get_fused_conditions)
+        :return: (torch.tensor) Output tensor with shape (batch size * coordinates, channels_out)
+        """
+        if isinstance(self.residual_mapping, nn.Linear):
+            residual = factored_linear(self.residual_mapping, latent, coordinates)
+        else:
+            residual = torch.cat((torch.repeat_interleave(latent, int(coordinates.shape[0] / latent.shape[0]), dim=0),
+                                  coordinates), dim=1)
+        return self.forward_stages(factored_linear(self.linear_1, latent, coordinates), residual, latent_tensor,
+                                   conditions)
+
+    def forward_stages(self, output: torch.Tensor, residual: torch.Tensor, latent_tensor: torch.Tensor = None,
+                       conditions: Tuple[Optional[Tuple[torch.Tensor, torch.Tensor]], ...] = None) -> torch.Tensor:
+        """
+        Method performs the block after the first linear layer
+        :param output: (torch.tensor) Output of the first linear layer with shape (batch size, channels_out)
+        :param residual: (torch.tensor) Residual mapping of the input with shape (batch size, channels_out)
+        :param latent_tensor: (torch.tensor) Latent vectors used for conditional batch normalization
+        :param conditions: (Tuple) Precomputed gamma and beta of both normalizations, used instead of the latent
         :return: (torch.tensor) Output tensor with shape (batch size, channels_out)
         """
         # First stage
-        # Linear layer
-        output = self.linear_1(input)
         # Normalization
-        if isinstance(self.normalization_1, ConditionalBatchNorm1d):
+        if isinstance(self.normalization_1, ConditionalBatchNorm1d) and conditions is not None:
+            output = self.normalization_1.forward_affine(output, *conditions[0])
+        elif isinstance(self.normalization_1, ConditionalBatchNorm1d):
             output = self.normalization_1(output, latent_tensor)
         else:
             output = self.normalization_1(output)
@@ -138,7 +233,9 @@ class CoordinatesFullyConnectedBlock(nn.Module):
         # Linear layer
         output = self.linear_2(output)
         # Normalization
-        if isinstance(self.normalization_2, ConditionalBatchNorm1d):
+        if isinstance(self.normalization_2, ConditionalBatchNorm1d) and conditions is not None:
+            output = self.normalization_2.forward_affine(output, *conditions[1])
+        elif isinstance(self.normalization_2, ConditionalBatchNorm1d):
             output = self.normalization_2(output, latent_tensor)
         else:
             output = self.normalization_2(output)
@@ -148,10 +245,72 @@ class CoordinatesFullyConnectedBlock(nn.Module):
         if self.dropout_rate > 0.0:
             output = F.dropout(output, p=self.dropout_rate)
         # Residual mapping
-        output = output + self.residual_mapping(input)
+        output = output + residual
         return output
 
 
+# Concatenated projections of eval mode decoders, the entries are dropped together with the decoder
+FUSED_CONDITION_WEIGHTS = weakref.WeakKeyDictionary()
+
+
+def get_fused_condition_weights(blocks: nn.ModuleList, linears: List[nn.Linear]) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Function concatenates the weights and biases of the projections of conditional batch normalizations. In eval mode
+    the result is cached until a parameter is replaced or modified.
+    :param blocks: (nn.ModuleList) Fully connected blocks
+    :param linears: (List[nn.Linear]) Projections predicting gamma and beta
+    :return: (Tuple[torch.Tensor, torch.Tensor]) Concatenated weight and bias
+    """
+    key = tuple((parameter.data_ptr(), parameter._version) for linear in linears for parameter in linear.parameters())
+    if not blocks.training and blocks in FUSED_CONDITION_WEIGHTS and FUSED_CONDITION_WEIGHTS[blocks][0] == key:
+        return FUSED_CONDITION_WEIGHTS[blocks][1]
+    weight = torch.cat([linear.weight for linear in linears], dim=0)
+    bias = torch.cat([linear.bias if linear.bias is not None else
+                      torch.zeros(linear.out_features, device=weight.device, dtype=weight.dtype)
+                      for linear in linears], dim=0)
+    if not blocks.training:
+        FUSED_CONDITION_WEIGHTS[blocks] = (key, (weight.detach(), bias.detach()))
+    return weight, bias
+
+
+def slice_conditions(conditions: List[Tuple[Optional[Tuple[torch.Tensor, torch.Tensor]], ...]], start: int,
+                     stop: int) -> List[Tuple[Optional[Tuple[torch.Tensor, torch.Tensor]], ...]]:
+    """
+    Function selects the conditions of a range of volumes of a batch
+    :param conditions: (List[Tuple]) Conditions of all volumes (see get_fused_conditions)
+    :param start: (int) First volume
+    :param stop: (int) Volume after the last volume
+    :return: (List[Tuple]) Conditions of the selected volumes
+    """
+    return [tuple(None if condition is None else (condition[0][start:stop], condition[1][start:stop])
+                  for condition in block_conditions) for block_conditions in conditions]
+
+
+def get_fused_conditions(blocks: nn.ModuleList, latent_tensor: torch.Tensor) -> \
+        List[Tuple[Optional[Tuple[torch.Tensor, torch.Tensor]], ...]]:
+    """
+    Function predicts gamma and beta of all conditional batch normalizations of a stack of fully connected blocks with
+    a single matrix multiplication
+    :param blocks: (nn.ModuleList) Fully connected blocks
+    :param latent_tensor: (torch.Tensor) Latent vectors of shape (batch size, latent features)
+    :return: (List[Tuple]) For every block gamma and beta of both normalizations (None if not conditional)
+    """
+    linears = [linear for block in blocks for normalization in (block.normalization_1, block.normalization_2)
+               if isinstance(normalization, ConditionalBatchNorm1d)
+               for linear in (normalization.linear_gamma, normalization.linear_beta)]
+    if len(linears) == 0:
+        return [(None, None) for _ in blocks]
+    weight, bias = get_fused_condition_weights(blocks, linears)
+    outputs = iter(torch.split(F.linear(latent_tensor, weight, bias), [linear.out_features for linear in linears],
+                               dim=1))
+    conditions = []
+    for block in blocks:
+        conditions.append(tuple((next(outputs), next(outputs))
+                                if isinstance(normalization, ConditionalBatchNorm1d) else None
+                                for normalization in (block.normalization_1, block.normalization_2)))
+    return conditions
+
+
 class ConditionalBatchNorm1d(nn.Module):
     """
     Implementation of a conditional batch normalization module using linear operation to predict gamma and beta
@@ -194,14 +353,22 @@ class ConditionalBatchNorm1d(nn.Module):
         # Perform convolutions to estimate gamma and beta
         gamma = self.linear_gamma(latent_vector)
         beta = self.linear_beta(latent_vector)
+        return self.forward_affine(input, gamma, beta)
+
+    def forward_affine(self, input: torch.Tensor, gamma: torch.Tensor, beta: torch.Tensor) -> torch.Tensor:
+        """
+        Forward pass with precomputed gamma and beta
+        :param input: (torch.Tensor) Input tensor to be normalized of shape (batch size coordinates, features)
+        :param gamma: (torch.Tensor) Gamma of every volume of shape (batch_size, features)
+        :param beta: (torch.Tensor) Beta of every volume of shape (batch_size, features)
+        :return: (torch.Tensor) Normalized tensor
+        """
         # Perform normalization
         output_normalized = self.normalization(input)
-        # Repeat gamma and beta to apply factors to every coordinate
-        gamma = torch.repeat_interleave(gamma, int(output_normalized.shape[0] / gamma.shape[0]), dim=0)
-        beta = torch.repeat_interleave(beta, int(output_normalized.shape[0] / beta.shape[0]), dim=0)
-        # Add factors
-        output = gamma * output_normalized + beta
-        return output
+        # Broadcast gamma and beta of every volume to its coordinates
+        output = gamma.unsqueeze(dim=1) * output_normalized.view(gamma.shape[0], -1, output_normalized.shape[1]) \
+                 + beta.unsqueeze(dim=1)
+        return output.view(output_normalized.shape)
 
 
 class InstanceNorm1d(nn.Module):
@@ -214,4 +381,308 @@ class InstanceNorm1d(nn.Module):
         super(InstanceNorm1d, self).__init__()
 
     def forward(self, input: torch.Tensor) -> torch.Tensor:
-        return (input - input.mean(dim=1, keepdim=True)) / input.std(dim=1, keepdim=True)
\ No newline at end of file
+        return (input - input.mean(dim=1, keepdim=True)) / input.std(dim=1, keepdim=True)
+
+class SparseVolume(object):
+    """
+    Set of active voxels of a batch of volumes, stored as features and integer indices sorted in C order
+    """
+
+    def __init__(self, features: torch.Tensor, indices: torch.Tensor, shape: Tuple[int, int, int, int]) -> None:
+        """
+        Constructor method
+        :param features: (torch.Tensor) Features of the active voxels of shape (n, channels)
+        :param indices: (torch.Tensor) Indices (batch, x, y, z) of the active voxels of shape (n, 4), sorted
+        :param shape: (Tuple[int, int, int, int]) Dense shape (batch size, x, y, z)
+        """
+        self.features = features
+        self.indices = indices
+        self.shape = shape
+        # Neighbor tables are shared by all volumes with the same active voxels
+        self.neighbors = dict()
+
+    @staticmethod
+    def from_dense(volume: torch.Tensor, threshold: float) -> 'SparseVolume':
+        """
+        Method thresholds a dense volume into a set of active voxels
+        :param volume: (torch.Tensor) Volume of shape (batch size, channels, x, y, z)
+        :param threshold: (float) Voxels with an absolute value above the threshold in any channel are active
+        :return: (SparseVolume) Active voxels
+        """
+        mask = volume.abs().amax(dim=1) > threshold
+        return SparseVolume(volume.permute(0, 2, 3, 4, 1)[mask], mask.nonzero(), tuple(mask.shape))
+
+    def to_dense(self) -> torch.Tensor:
+        """
+        Method scatters the active voxels into a dense volume, inactive voxels are zero
+        :return: (torch.Tensor) Volume of shape (batch size, channels, x, y, z)
+        """
+        output = self.features.new_zeros(*self.shape, self.features.shape[1])
+        output[self.indices[:, 0], self.indices[:, 1], self.indices[:, 2], self.indices[:, 3]] = self.features
+        return output.permute(0, 4, 1, 2, 3).contiguous()
+
+    def replace(self, features: torch.Tensor) -> 'SparseVolume':
+        """
+        Method returns a sparse volume with the same active voxels and new features
+        :param features: (torch.Tensor) Features of shape (n, channels)
+        :return: (SparseVolume) Sparse volume
+        """
+        sparse_volume = SparseVolume(features, self.indices, self.shape)
+        sparse_volume.neighbors = self.neighbors
+        return sparse_volume
+
+    def get_keys(self, indices: torch.Tensor) -> torch.Tensor:
+        """
+        Method linearizes voxel indices in C order
+        :param indices: (torch.Tensor) Indices of shape (n, 4)
+        :return: (torch.Tensor) Keys of shape (n)
+        """
+        return ((indices[:, 0] * self.shape[1] + indices[:, 1]) * self.shape[2] + indices[:, 2]) * self.shape[3] \
+               + indices[:, 3]
+
+    def get_neighbors(self, kernel_size: int) -> torch.Tensor:
+        """
+        Method returns the index of the active neighbor of every active voxel for every kernel offset
+        :param kernel_size: (int) Kernel size
+        :return: (torch.Tensor) Neighbor indices of shape (kernel_size ** 3, n), n marks inactive neighbors
+        """
+        if kernel_size in self.neighbors:
+            return self.neighbors[kernel_size]
+        number_of_voxels = self.indices.shape[0]
+        radius = kernel_size // 2
+        offsets = torch.arange(-radius, radius + 1, device=self.indices.device)
+        offsets = torch.stack(torch.meshgrid(offsets, offsets, offsets, indexing='ij'), dim=-1).view(-1, 3)
+        if number_of_voxels == 0:
+            neighbors = self.indices.new_zeros(offsets.shape[0], 0)
+        else:
+            keys = self.get_keys(self.indices)
+            bounds = torch.tensor(self.shape[1:], device=self.indices.device)
+            neighbors = []
+            for offset in offsets:
+                coordinates = self.indices[:, 1:] + offset
+                neighbor_keys = self.get_keys(torch.cat((self.indices[:, :1], coordinates), dim=1))
+                position = torch.searchsorted(keys, neighbor_keys).clamp(max=number_of_voxels - 1)
+                valid = ((coordinates >= 0) & (coordinates < bounds)).all(dim=1) & (keys[position] == neighbor_keys)
+                neighbors.append(torch.where(valid, position, torch.full_like(position, number_of_voxels)))
+            neighbors = torch.stack(neighbors, dim=0)
+        self.neighbors[kernel_size] = neighbors
+        return neighbors
+
+    def downsample(self, downsampling: str, factor: int) -> 'SparseVolume':
+        """
+        Method pools the active voxels, equivalent to dense pooling of the volume with zero inactive voxels
+        :param downsampling: (str) Type of downsampling ('averagepool', 'maxpool', 'none')
+        :param factor: (int) Factor of downsampling
+        :return: (SparseVolume) Pooled sparse volume
+        """
+        if downsampling == 'none':
+            return self
+        shape = (self.shape[0], self.shape[1] // factor, self.shape[2] // factor, self.shape[3] // factor)
+        indices = torch.cat((self.indices[:, :1], torch.div(self.indices[:, 1:], factor, rounding_mode='floor')),
+                            dim=1)
+        # Voxels of incomplete windows are dropped like in dense pooling
+        valid = (indices[:, 1:] < torch.tensor(shape[1:], device=indices.device)).all(dim=1)
+        indices, features = indices[valid], self.features[valid]
+        pooled_volume = SparseVolume(None, None, shape)
+        keys, inverse = torch.unique(pooled_volume.get_keys(indices), sorted=True, return_inverse=True)
+        pooled_indices = indices.new_empty(keys.shape[0], 4)
+        pooled_indices[inverse] = indices
+        if downsampling == 'averagepool':
+            pooled_features = features.new_zeros(keys.shape[0], features.shape[1]).index_add(0, inverse, features) \
+                              / factor ** 3
+        else:
+            pooled_features = features.new_zeros(keys.shape[0], features.shape[1]).scatter_reduce(
+                0, inverse.unsqueeze(dim=1).expand_as(features), features, reduce='amax', include_self=False)
+            # Windows with inactive voxels also pool zeros
+            incomplete = torch.bincount(inverse, minlength=keys.shape[0]) < factor ** 3
+            pooled_features = torch.where(incomplete.unsqueeze(dim=1), pooled_features.clamp(min=0.0),
+                                          pooled_features)
+        pooled_volume.features, pooled_volume.indices = pooled_features, pooled_indices
+        return pooled_volume
+
+
+class SubmanifoldConvolution3d(nn.Module):
+    """
+    Submanifold 3D convolution, outputs are only computed at active voxels and only active neighbors contribute
+    """
+
+    def __init__(self, input_channels: int, output_channels: int, kernel_size: int = 3, bias: bool = True) -> None:
+        """
+        Constructor method
+        :param input_channels: (int) Number of input channels
+        :param output_channels: (int) Number of output channels
+        :param kernel_size: (int) Filter size of convolution
+        :param bias: (bool) True to use bias
+        """
+        # Call super constructor
+        super(SubmanifoldConvolution3d, self).__init__()
+        self.kernel_size = kernel_size
+        # Init weights like nn.Conv3d
+        bound = 1.0 / (input_channels * kernel_size ** 3) ** 0.5
+        self.weight = nn.Parameter(
+            torch.empty(kernel_size ** 3, input_channels, output_channels).uniform_(-bound, bound))
+        self.bias = nn.Parameter(torch.empty(output_channels).uniform_(-bound, bound)) if bias else None
+
+    def forward(self, input: SparseVolume) -> torch.Tensor:
+        """
+        Forward pass
+        :param input: (SparseVolume) Sparse volume with features of shape (n, channels_in)
+        :return: (torch.Tensor) Output features of shape (n, channels_out)
+        """
+        neighbors = input.get_neighbors(self.kernel_size)
+        # Inactive neighbors gather a zero row
+        features = torch.cat((input.features, input.features.new_zeros(1, input.features.shape[1])), dim=0)
+        output = input.features.new_zeros(input.features.shape[0], self.weight.shape[2])
+        for index in range(neighbors.shape[0]):
+            output = output + features[neighbors[index]] @ self.weight[index]
+        if self.bias is not None:
+            output = output + self.bias
+        return output
+
+
+class SparseNormalization(nn.Module):
+    """
+    Normalization of the features of active voxels ('batchnorm', 'instancenorm' per volume, 'none')
+    """
+
+    def __init__(self, normalization: str, channels: int, eps: float = 1e-05) -> None:
+        """
+        Constructor method
+        :param normalization: (str) Type of normalization ('batchnorm', 'instancenorm', 'none')
+        :param channels: (int) Number of channels
+        :param eps: (float) Constant for numerical stability
+        """
+        # Call super constructor
+        super(SparseNormalization, self).__init__()
+        assert normalization in ['batchnorm', 'instancenorm', 'none'], \
+            'Normalization {} is not available!'.format(normalization)
+        self.normalization = normalization
+        self.eps = eps
+        if normalization == 'batchnorm':
+            self.batch_norm = nn.BatchNorm1d(channels, eps=eps)
+        elif normalization == 'instancenorm':
+            self.weight = nn.Parameter(torch.ones(channels))
+            self.bias = nn.Parameter(torch.zeros(channels))
+
+    def forward(self, input: torch.Tensor, batch_index: torch.Tensor, batch_size: int) -> torch.Tensor:
+        """
+        Forward pass
+        :param input: (torch.Tensor) Features of shape (n, channels)
+        :param batch_index: (torch.Tensor) Batch index of every feature of shape (n)
+        :param batch_size: (int) Batch size
+        :return: (torch.Tensor) Normalized features of shape (n, channels)
+        """
+        if self.normalization == 'batchnorm':
+            return self.batch_norm(input)
+        elif self.normalization == 'instancenorm':
+            counts = torch.bincount(batch_index, minlength=batch_size).clamp(min=1).unsqueeze(dim=1).to(input.dtype)
+            mean = input.new_zeros(batch_size, input.shape[1]).index_add(0, batch_index, input) / counts
+            centered = input - mean[batch_index]
+            variance = input.new_zeros(batch_size, input.shape[1]).index_add(0, batch_index, centered ** 2) / counts
+            return centered / torch.sqrt(variance[batch_index] + self.eps) * self.weight + self.bias
+        return input
+
+
+class SparseVolumeEncoderBlock(nn.Module):
+    """
+    Sparse counterpart of the volume residual encoder block operating on active voxels only
+    (submanifold convolution + normalization + activation) -> (submanifold convolution + normalization + activation)
+    -> (sparse downsampling)
+    """
+
+    def __init__(self, input_channels: int, output_channels: int, kernel_size: int = 3, stride: int = 1,
+                 padding: int = 1, activation: str = 'prelu', downsampling: str = 'averagepool',
+                 downsampling_factor: int = 2, normalization: str = 'batchnorm', dropout_rate: float = 0.0,
+                 bias: bool = True) -> None:
+        """
+        Constructor method
+        :param input_channels: (int) Number of input channels
+        :param output_channels: (int) Number of output channels
+        :param kernel_size: (int) Filter size of convolution
+        :param stride: (int) Stride factor of convolution (only 1 is supported)
+        :param padding: (int) Padding used in every convolution (only kernel_size // 2 is supported)
+        :param activation: (str) Type of activation function
+        :param downsampling: (str) Type of downsampling operation ('averagepool', 'maxpool', 'none')
+        :param downsampling_factor: (int) Downsampling factor to use
+        :param normalization: (str) Type of normalization operation used
+        :param dropout_rate: (float) Dropout rate to perform after every stage
+        :param bias: (bool) True to use bias in convolution operations
+        """
+        # Call super constructor
+        super(SparseVolumeEncoderBlock, self).__init__()
+        assert stride == 1 and padding == kernel_size // 2, \
+            'Sparse encoder blocks only support submanifold convolutions (stride 1, same padding)'
+        assert downsampling in ['averagepool', 'maxpool', 'none'], \
+            'Downsampling {} is not available for sparse encoder blocks'.format(downsampling)
+        # Save dropout rate and downsampling
+        self.dropout_rate = dropout_rate
+        self.downsampling = downsampling
+        self.downsampling_factor = downsampling_factor
+        # Init activations
+        self.activation_1 = Misc.get_activation(activation=activation)
+        self.activation_2 = Misc.get_activation(activation=activation)
+        # Init normalizations
+        self.normalization_1 = SparseNormalization(normalization=normalization, channels=output_channels)
+        self.normalization_2 = SparseNormalization(normalization=normalization, channels=output_channels)
+        # Init convolutions
+        self.convolution_1 = SubmanifoldConvolution3d(input_channels=input_channels, output_channels=output_channels,
+                                                      kernel_size=kernel_size, bias=bias)
+        self.convolution_2 = SubmanifoldConvolution3d(input_channels=output_channels, output_channels=output_channels,
+                                                      kernel_size=kernel_size, bias=bias)
+        # Init residual mapping
+        if input_channels == output_channels:
+            self.residual_mapping = nn.Identity()
+        else:
+            self.residual_mapping = nn.Linear(in_features=input_channels, out_features=output_channels, bias=bias)
+
+    def forward(self, input: SparseVolume) -> SparseVolume:
+        """
+        Forward pass of the sparse volume encoder block
+        :param input: (SparseVolume) Sparse volume with features of shape (n, channels_in)
+        :return: (SparseVolume) Downsampled sparse volume with features of shape (n_out, channels_out)
+        """
+        batch_index = input.indices[:, 0]
+        # First stage
+        output = self.convolution_1(input)
+        output = self.normalization_1(output, batch_index, input.shape[0])
+        output = self.activation_1(output)
+        if self.dropout_rate > 0.0:  # Perform dropout
+            output = F.dropout(output, p=self.dropout_rate)
+        # Second stage
+        output = self.convolution_2(input.replace(output))
+        output = self.normalization_2(output, batch_index, input.shape[0])
+        output = self.activation_2(output)
+        if self.dropout_rate > 0.0:  # Perform dropout
+            output = F.dropout(output, p=self.dropout_rate)
+        output = output + self.residual_mapping(input.features)
+        # Downsampling stage
+        return input.replace(output).downsample(self.downsampling, self.downsampling_factor)
+
+
+class SparseVolumeEncoder(nn.Module):
+    """
+    Encoder thresholding the input volume into active voxels and running sparse encoder blocks. The output is a dense
+    volume with the layout of the dense encoder, so both encoders can be used with the same decoders.
+    """
+
+    def __init__(self, blocks: List[nn.Module], threshold: float = 0.02) -> None:
+        """
+        Constructor method
+        :param blocks: (List[nn.Module]) Sparse volume encoder blocks
+        :param threshold: (float) Voxels with an absolute intensity above the threshold are active
+        """
+        # Call super constructor
+        super(SparseVolumeEncoder, self).__init__()
+        self.blocks = nn.ModuleList(blocks)
+        self.threshold = threshold
+
+    def forward(self, volume: torch.Tensor) -> torch.Tensor:
+        """
+        Forward pass
+        :param volume: (torch.Tensor) Volume of shape (batch size, channels_in, x, y, z)
+        :return: (torch.Tensor) Encoded volume of shape (batch size, channels_out, x_out, y_out, z_out)
+        """
+        output = SparseVolume.from_dense(volume, self.threshold)
+        for block in self.blocks:
+            output = block(output)
+        return output.to_dense()
@@ -3,10 +3,12 @@ from typing import Callable, Dict, List, Tuple
 import numpy as np
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 from tqdm import tqdm
 from torch.utils.data.dataloader import DataLoader
 import datetime
 import Misc
+from ExecutionProfile import ExecutionProfile
 import os
 import json
 
@@ -21,7 +23,8 @@ class OccupancyNetworkWrapper(object):
                  test_data: torch.utils.data.dataloader,
                  validation_data: torch.utils.data.dataloader,
                  loss_function: Callable[[torch.tensor, torch.tensor], torch.tensor], device: str = 'cuda',
-                 save_data_path: str = 'Saved_data_', data_folder: str = None) -> None:
+                 save_data_path: str = 'Saved_data_', data_folder: str = None,
+                 execution_profile: ExecutionProfile = None) -> None:
         """
         Class constructor
         :param occupancy_network: (nn.Module) Occupancy network for binary segmentation
@@ -32,9 +35,15 @@ class OccupancyNetworkWrapper(object):
         :param loss_function: (Callable[[torch.tensor], torch.tensor]) Loss function to use
         :param device: (str) Device to use while training, validation and testing
         :param data_folder: (str) Folder name inside the main save path
+        :param execution_profile: (ExecutionProfile) Execution profile (autocast, memory format, threads), plain fp32
+        on the given device if None
         """
+        # Init execution profile
+        self.execution_profile = execution_profile if execution_profile is not None else ExecutionProfile(device)
+        self.execution_profile.apply()
+        device = self.execution_profile.device
         # Init class variables
-        self.occupancy_network = occupancy_network.to(device)
+        self.occupancy_network = self.execution_profile.prepare_model(occupancy_network)
         self.occupancy_network_optimizer = occupancy_network_optimizer
         self.training_data = training_data
         self.test_data = test_data
@@ -74,7 +83,7 @@ class OccupancyNetworkWrapper(object):
         """
         # Model into train mode
         self.occupancy_network.train()
-        self.occupancy_network.to(self.device)
+        self.occupancy_network = self.execution_profile.prepare_model(self.occupancy_network)
         # Init progress bar
         progress_bar = tqdm(total=epochs * len(self.training_data.dataset))
         # Init best loss variable
@@ -82,24 +91,40 @@ class OccupancyNetworkWrapper(object):
         # Init variables for progress bar
         validation_loss, validation_iou, validation_bb_iou = np.inf, 0, 0
         for epoch in range(epochs):
+            # Set epoch of streaming datasets to permute the shard order
+            if hasattr(self.training_data.dataset, 'set_epoch'):
+                self.training_data.dataset.set_epoch(epoch)
             # Validate model
-            for volumes, coordinates, labels in self.training_data:
+            for batch in self.training_data:
+                # Importance weights are only present if content sampling or hard mining is utilized
+                volumes, coordinates, labels = batch[:3]
+                weights = batch[3] if len(batch) > 3 else None
+                scan_indexes = batch[4] if len(batch) > 4 else None
                 # Update progress bar
                 progress_bar.update(volumes.shape[0])
                 # Reset gradients
                 self.occupancy_network.zero_grad()
-                # Data to device
-                volumes = volumes.to(self.device)
-                coordinates = coordinates.to(self.device)
-                labels = labels.to(self.device)
+                # Data to device and conversion to model dtype
+                volumes = self.execution_profile.prepare_volume(volumes)
+                coordinates = coordinates.to(self.device, non_blocking=True).float()
+                labels = labels.to(self.device, non_blocking=True).float()
                 # Perform model prediction
-                prediction = self.occupancy_network(volumes, coordinates)
+                with self.execution_profile.autocast():
+                    prediction = self.occupancy_network(volumes, coordinates)
+                prediction = prediction.float()
                 # Compute loss
-                loss = self.loss_function(prediction, labels)
+                if weights is not None:
+                    loss = self.loss_function(prediction, labels, weights.to(self.device, non_blocking=True).float())
+                else:
+                    loss = self.loss_function(prediction, labels)
                 # Compute gradients
                 loss.backward()
                 # Update parameters
                 self.occupancy_network_optimizer.step()
+                # Record per coordinate losses in hard mining buffer
+                if scan_indexes is not None:
+                    self.training_data.dataset.hard_mining_buffer.update(
+                        scan_indexes, batch[1], F.binary_cross_entropy(prediction.detach(), labels, reduction='none'))
                 # Update loss info in progress bar
                 progress_bar.set_description(
                     'Epoch {}/{}, Best val Loss={:.4f}, Cur val Loss={:.4f}, Cur val IoU={:.4f}, Cur val BB IoU={:.4f}, Loss={:.4f}'.format(
@@ -146,15 +171,17 @@ class OccupancyNetworkWrapper(object):
             # Get data
             for volume, coordinates, labels, actual in self.validation_data:
                 # Add batch size dim to data and to device
-                volume = volume.to(self.device)
-                coordinates = coordinates.to(self.device)
-                labels = labels.to(self.device)
-                actual = actual.to(self.device)
+                volume = self.execution_profile.prepare_volume(volume)
+                coordinates = coordinates.to(self.device, non_blocking=True).float()
+                labels = labels.to(self.device, non_blocking=True).float()
+                actual = actual.to(self.device, non_blocking=True).float()
                 # Get prediction of model
-                if isinstance(self.occupancy_network, nn.DataParallel):
-                    prediction = self.occupancy_network.module(volume, coordinates)
-                else:
-                    prediction = self.occupancy_network(volume, coordinates)
+                with self.execution_profile.autocast():
+                    if isinstance(self.occupancy_network, nn.DataParallel):
+                        prediction = self.occupancy_network.module(volume, coordinates)
+                    else:
+                        prediction = self.occupancy_network(volume, coordinates)
+                prediction = prediction.float()
                 # Calc loss
                 loss_values.append(self.loss_function(prediction, labels).item())
                 # Calc iou
@@ -181,6 +208,9 @@ class OccupancyNetworkWrapper(object):
         progress_bar = tqdm(total=len(self.test_data))
         # Get downsampling factor for input and calculate usampling factor
         upsample_factor = self.test_data.dataset.side_len ** 3
+        # Get empty space skipping parameters of the test dataset
+        empty_space_threshold = getattr(self.test_data.dataset, 'empty_space_threshold', None)
+        empty_space_dilation = getattr(self.test_data.dataset, 'empty_space_dilation', 1)
         # Calc no grads
         with torch.no_grad():
             # Iterate over test dataset
@@ -191,16 +221,31 @@ class OccupancyNetworkWrapper(object):
                 self.occupancy_network.eval()
                 # Get batch data
                 volume, coordinates, labels, actual = batch
-                # Data to device
-                volume = volume.to(self.device)
-                coordinates = coordinates.to(self.device)
-                labels = labels.to(self.device)
-                actual = actual.to(self.device)
-                # Make prediction
-                if isinstance(self.occupancy_network, nn.DataParallel):
-                    prediction = self.occupancy_network.module(volume, coordinates)
+                # Data to device and conversion to model dtype
+                volume = self.execution_profile.prepare_volume(volume)
+                coordinates = coordinates.to(self.device, non_blocking=True).float()
+                labels = labels.to(self.device, non_blocking=True).float()
+                actual = actual.to(self.device, non_blocking=True).float()
+                # Coordinates in empty space are not decoded and predicted as empty, so they count as false negatives
+                if empty_space_threshold is not None:
+                    keep = Misc.get_occupancy_mask_lookup(
+                        Misc.get_occupancy_mask(volume, empty_space_threshold, empty_space_dilation), coordinates,
+                        self.test_data.dataset.side_len)
+                    self.logging('skipped_coordinates', float((~keep).sum().item()))
+                    # Occupied coordinates inside of skipped cells are lost, this bounds the recall of the network
+                    positives = labels.view(-1) > 0.5
+                    skipped_positives = float((positives & ~keep).sum().item())
+                    self.logging('skipped_positives', skipped_positives)
+                    self.logging('skipped_positives_rate', skipped_positives / max(float(positives.sum().item()), 1.0))
                 else:
-                    prediction = self.occupancy_network(volume, coordinates)
+                    keep = torch.ones(coordinates.shape[0], dtype=torch.bool, device=coordinates.device)
+                # Make prediction
+                prediction = torch.zeros(coordinates.shape[0], 1, device=coordinates.device)
+                with self.execution_profile.autocast():
+                    if isinstance(self.occupancy_network, nn.DataParallel):
+                        prediction[keep] = self.occupancy_network.module(volume, coordinates[keep]).float()
+                    else:
+                        prediction[keep] = self.occupancy_network(volume, coordinates[keep]).float()
                 # Set offset
                 prediction_offset = (prediction > threshold).float()
                 # Reshape prediction offset tensor by removing dimension
@@ -263,6 +308,10 @@ class OccupancyNetworkWrapper(object):
         test_size_volume = self.get_average_metric('size_volume')
         test_size_prediction = self.get_average_metric('size_prediction')
         test_size_actual = self.get_average_metric('size_actual')
+        if empty_space_threshold is not None:
+            print('Mean skipped coordinates = {}'.format(self.get_average_metric('skipped_coordinates')))
+            print('Mean skipped occupied coordinates = {} ({} of all occupied coordinates)'.format(
+                self.get_average_metric('skipped_positives'), self.get_average_metric('skipped_positives_rate')))
         # Print metrics
         print('Intersection over union = {}'.format(test_iou))
         print('Intersection over union bounding box = {}'.format(test_iou_bounding_box))
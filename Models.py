@@ -7,6 +7,47 @@ import Misc
 import ModelParts
 
 
+def decode_in_chunks(decode_function, latent: torch.Tensor, coordinates: torch.Tensor,
+                     chunk_size: int = None, conditions: list = None) -> torch.Tensor:
+    """
+    Function streams the coordinates of every volume in bounded chunks through a decoding function
+    :param decode_function: (Callable) Function mapping latent vectors (n, features) and coordinates (n * m, 3) (and
+    conditions if given) to occupancy probabilities (n * m, 1)
+    :param latent: (torch.Tensor) Latent vectors of shape (batch size, features)
+    :param coordinates: (torch.Tensor) Coordinates of shape (batch size * coordinates, 3)
+    :param chunk_size: (int) Maximal number of coordinates decoded at once, None decodes all coordinates at once
+    :param conditions: (list) Conditions of the batch computed once per latent (see ModelParts.get_fused_conditions),
+    passed to the decoding function sliced to the volume of every chunk
+    :return: (torch.Tensor) Occupancy probabilities of shape (batch size * coordinates, 1)
+    """
+    if chunk_size is None or coordinates.shape[0] <= chunk_size:
+        if conditions is not None:
+            return decode_function(latent, coordinates, conditions)
+        return decode_function(latent, coordinates)
+    number_of_coordinates = coordinates.shape[0] // latent.shape[0]
+    output = []
+    for batch_index in range(latent.shape[0]):
+        for start in range(batch_index * number_of_coordinates, (batch_index + 1) * number_of_coordinates,
+                           chunk_size):
+            stop = min(start + chunk_size, (batch_index + 1) * number_of_coordinates)
+            if conditions is not None:
+                output.append(decode_function(latent[batch_index:batch_index + 1], coordinates[start:stop],
+                                              ModelParts.slice_conditions(conditions, batch_index, batch_index + 1)))
+            else:
+                output.append(decode_function(latent[batch_index:batch_index + 1], coordinates[start:stop]))
+    return torch.cat(output, dim=0)
+
+
+def is_latent_factorized(occupancy_network: nn.Module) -> bool:
+    """
+    Function checks if the first decoding block of an occupancy network is computed in factored form
+    :param occupancy_network: (nn.Module) Occupancy network
+    :return: (bool) True if the latent vector is not repeated for every coordinate in the first decoding block
+    """
+    # Models saved before factorization was available default to the factorized path
+    return isinstance(occupancy_network, OccupancyNetwork) and getattr(occupancy_network, 'factorize_latent', True)
+
+
 class OccupancyNetwork(nn.Module):
     """
     Implementation of an occupancy network for binary classification of a 3D volume
@@ -34,7 +75,8 @@ class OccupancyNetwork(nn.Module):
                  normalization_decoding: Union[str, List[str]] = 'cbatchnorm',
                  dropout_rate_decoding: Union[float, List[float]] = [0.0, 0.0, 0.0, 0.0, 0.0],
                  bias_decoding: Union[bool, List[bool]] = True,
-                 output_activation: str = 'sigmoid') -> None:
+                 output_activation: str = 'sigmoid', factorize_latent: bool = True, encoder_backend: str = 'dense',
+                 sparse_threshold: float = 0.02) -> None:
         """
         Constructor method
         :param number_of_encoding_blocks: (int) Number of blocks in encoding path
@@ -56,9 +98,15 @@ class OccupancyNetwork(nn.Module):
         :param bias_decoding: (bool, List[bool]) Use bias in each convolution in each decoding block
         :param bias_residual_decoding: (bool, List[bool]) Use bias in residual mapping in each decoding block
         :param output_activation: (str) Type of activation function used for output
+        :param factorize_latent: (bool) If true the first decoding block is computed without repeating the latent
+        vector for every coordinate (mathematically equivalent)
+        :param encoder_backend: (str) Encoder backend, 'dense' convolutions or 'sparse' submanifold convolutions on
+        the voxels above the sparse threshold (same latent layout)
+        :param sparse_threshold: (float) Intensity threshold of active voxels of the sparse encoder
         """
         # Call super constructor
         super(OccupancyNetwork, self).__init__()
+        self.factorize_latent = factorize_latent
         # Convert encoding parameters to lists
         channels_in_encoding_blocks = Misc.parse_to_list(channels_in_encoding_blocks, number_of_encoding_blocks,
                                                          'channels in encoding blocks')
@@ -93,7 +141,9 @@ class OccupancyNetwork(nn.Module):
                                            'bias decoding')
 
         # Init encoding blocks
-        self.encoding = nn.Sequential(*[ModelParts.VolumeEncoderBlock(
+        encoder_block = ModelParts.SparseVolumeEncoderBlock if encoder_backend == 'sparse' \
+            else ModelParts.VolumeEncoderBlock
+        self.encoding = Misc.get_encoder(encoder_backend, [encoder_block(
             input_channels=channels_in_encoding_blocks[index][0],
             output_channels=channels_in_encoding_blocks[index][1],
             kernel_size=kernel_size_encoding[index],
@@ -105,7 +155,7 @@ class OccupancyNetwork(nn.Module):
             normalization=normalization_encoding[index],
             dropout_rate=dropout_rate_encoding[index],
             bias=bias_encoding[index])
-            for index in range(number_of_encoding_blocks)])
+            for index in range(number_of_encoding_blocks)], sparse_threshold)
 
         # Init decoding blocks
         self.decoding = nn.ModuleList()
@@ -130,20 +180,58 @@ class OccupancyNetwork(nn.Module):
         :param coordinates: (torch.tensor) Input tensor including coordinates
         :return: (torch.tensor) Output tensor
         """
+        return self.decode(self.encode(volume), coordinates)
+
+    def encode(self, volume: torch.tensor) -> torch.tensor:
+        """
+        Method encodes volumes into latent vectors, which can be decoded for any number of coordinates
+        :param volume: (torch.tensor) Input tensor including 3D volume of shape (batch size, 1, x, y, z)
+        :return: (torch.tensor) Flattened latent vectors of shape (batch size, features)
+        """
         # Perform encoding path
         output_encoding = self.encoding(volume)
         # Flatten latent vector for decoding path
-        output_encoding_flatten = output_encoding.view(output_encoding.shape[0], -1)
-        # Repeat latent vector
-        input_decoding = torch.cat((torch.repeat_interleave(output_encoding_flatten,
-                                                            int(coordinates.shape[0] / volume.shape[0]), dim=0),
-                                    coordinates), dim=1)
+        return output_encoding.view(output_encoding.shape[0], -1)
+
+    def decode(self, latent: torch.tensor, coordinates: torch.tensor, chunk_size: int = None) -> torch.tensor:
+        """
+        Method predicts the occupancy of coordinates. Coordinates are decoded in chunks per volume to bound the memory,
+        chunking should only be used in evaluation mode since batch normalization statistics depend on the chunk.
+        :param latent: (torch.tensor) Latent vectors of shape (batch size, features)
+        :param coordinates: (torch.tensor) Coordinates of shape (batch size * coordinates, 3)
+        :param chunk_size: (int) Maximal number of coordinates decoded at once, None decodes all coordinates at once
+        :return: (torch.tensor) Occupancy probabilities of shape (batch size * coordinates, 1)
+        """
+        # Predict gamma and beta of all conditional batch normalizations once for all chunks
+        conditions = ModelParts.get_fused_conditions(self.decoding, latent)
+        return decode_in_chunks(self.decode_coordinates, latent, coordinates, chunk_size, conditions)
+
+    def decode_coordinates(self, output_encoding_flatten: torch.tensor, coordinates: torch.tensor,
+                           conditions: list = None) -> torch.tensor:
+        """
+        Decoding path of the occupancy network
+        :param output_encoding_flatten: (torch.tensor) Latent vectors of shape (batch size, features)
+        :param coordinates: (torch.tensor) Coordinates of shape (batch size * coordinates, 3)
+        :param conditions: (list) Gamma and beta of all conditional batch normalizations, predicted if None
+        :return: (torch.tensor) Occupancy probabilities of shape (batch size * coordinates, 1)
+        """
+        if conditions is None:
+            # Predict gamma and beta of all conditional batch normalizations at once
+            conditions = ModelParts.get_fused_conditions(self.decoding, output_encoding_flatten)
         # Perform decoding path
         for index, block in enumerate(self.decoding):
-            if index == 0:
-                output_decoding = block(input_decoding, output_encoding_flatten.clone())
+            if index == 0 and is_latent_factorized(self):
+                output_decoding = block.forward_factored(output_encoding_flatten, coordinates,
+                                                         output_encoding_flatten, conditions[index])
+            elif index == 0:
+                # Repeat latent vector
+                input_decoding = torch.cat((torch.repeat_interleave(output_encoding_flatten,
+                                                                    int(coordinates.shape[0] /
+                                                                        output_encoding_flatten.shape[0]), dim=0),
+                                            coordinates), dim=1)
+                output_decoding = block(input_decoding, output_encoding_flatten, conditions[index])
             else:
-                output_decoding = block(output_decoding, output_encoding_flatten.clone())
+                output_decoding = block(output_decoding, output_encoding_flatten, conditions[index])
         # Perform last linear layer + sigmoid activation
         output = self.output_block(output_decoding)
         return output
@@ -177,7 +265,8 @@ class OccupancyNetworkNoCat(nn.Module):
                  normalization_decoding: Union[str, List[str]] = 'cbatchnorm',
                  dropout_rate_decoding: Union[float, List[float]] = [0.0, 0.0, 0.0, 0.0, 0.0],
                  bias_decoding: Union[bool, List[bool]] = True,
-                 output_activation: str = 'sigmoid') -> None:
+                 output_activation: str = 'sigmoid', encoder_backend: str = 'dense',
+                 sparse_threshold: float = 0.02) -> None:
         """
         Constructor method
         :param number_of_encoding_blocks: (int) Number of blocks in encoding path
@@ -199,6 +288,9 @@ class OccupancyNetworkNoCat(nn.Module):
         :param bias_decoding: (bool, List[bool]) Use bias in each convolution in each decoding block
         :param bias_residual_decoding: (bool, List[bool]) Use bias in residual mapping in each decoding block
         :param output_activation: (str) Type of activation function used for output
+        :param encoder_backend: (str) Encoder backend, 'dense' convolutions or 'sparse' submanifold convolutions on
+        the voxels above the sparse threshold (same latent layout)
+        :param sparse_threshold: (float) Intensity threshold of active voxels of the sparse encoder
         """
         # Call super constructor
         super(OccupancyNetworkNoCat, self).__init__()
@@ -236,7 +328,9 @@ class OccupancyNetworkNoCat(nn.Module):
                                            'bias decoding')
 
         # Init encoding blocks
-        self.encoding = nn.Sequential(*[ModelParts.VolumeEncoderBlock(
+        encoder_block = ModelParts.SparseVolumeEncoderBlock if encoder_backend == 'sparse' \
+            else ModelParts.VolumeEncoderBlock
+        self.encoding = Misc.get_encoder(encoder_backend, [encoder_block(
             input_channels=channels_in_encoding_blocks[index][0],
             output_channels=channels_in_encoding_blocks[index][1],
             kernel_size=kernel_size_encoding[index],
@@ -248,7 +342,7 @@ class OccupancyNetworkNoCat(nn.Module):
             normalization=normalization_encoding[index],
             dropout_rate=dropout_rate_encoding[index],
             bias=bias_encoding[index])
-            for index in range(number_of_encoding_blocks)])
+            for index in range(number_of_encoding_blocks)], sparse_threshold)
 
         # Init decoding blocks
         self.decoding = nn.ModuleList()
@@ -273,16 +367,50 @@ class OccupancyNetworkNoCat(nn.Module):
         :param coordinates: (torch.tensor) Input tensor including coordinates
         :return: (torch.tensor) Output tensor
         """
+        return self.decode(self.encode(volume), coordinates)
+
+    def encode(self, volume: torch.tensor) -> torch.tensor:
+        """
+        Method encodes volumes into latent vectors, which can be decoded for any number of coordinates
+        :param volume: (torch.tensor) Input tensor including 3D volume of shape (batch size, 1, x, y, z)
+        :return: (torch.tensor) Flattened latent vectors of shape (batch size, features)
+        """
         # Perform encoding path
         output_encoding = self.encoding(volume)
         # Flatten latent vector for decoding path
-        output_encoding_flatten = output_encoding.view(output_encoding.shape[0], -1)
+        return output_encoding.view(output_encoding.shape[0], -1)
+
+    def decode(self, latent: torch.tensor, coordinates: torch.tensor, chunk_size: int = None) -> torch.tensor:
+        """
+        Method predicts the occupancy of coordinates. Coordinates are decoded in chunks per volume to bound the memory,
+        chunking should only be used in evaluation mode since batch normalization statistics depend on the chunk.
+        :param latent: (torch.tensor) Latent vectors of shape (batch size, features)
+        :param coordinates: (torch.tensor) Coordinates of shape (batch size * coordinates, 3)
+        :param chunk_size: (int) Maximal number of coordinates decoded at once, None decodes all coordinates at once
+        :return: (torch.tensor) Occupancy probabilities of shape (batch size * coordinates, 1)
+        """
+        # Predict gamma and beta of all conditional batch normalizations once for all chunks
+        conditions = ModelParts.get_fused_conditions(self.decoding, latent)
+        return decode_in_chunks(self.decode_coordinates, latent, coordinates, chunk_size, conditions)
+
+    def decode_coordinates(self, output_encoding_flatten: torch.tensor, coordinates: torch.tensor,
+                           conditions: list = None) -> torch.tensor:
+        """
+        Decoding path of the occupancy network
+        :param output_encoding_flatten: (torch.tensor) Latent vectors of shape (batch size, features)
+        :param coordinates: (torch.tensor) Coordinates of shape (batch size * coordinates, 3)
+        :param conditions: (list) Gamma and beta of all conditional batch normalizations, predicted if None
+        :return: (torch.tensor) Occupancy probabilities of shape (batch size * coordinates, 1)
+        """
+        if conditions is None:
+            # Predict gamma and beta of all conditional batch normalizations at once
+            conditions = ModelParts.get_fused_conditions(self.decoding, output_encoding_flatten)
         # Perform decoding path
         for index, block in enumerate(self.decoding):
             if index == 0:
-                output_decoding = block(coordinates, output_encoding_flatten)
+                output_decoding = block(coordinates, output_encoding_flatten, conditions[index])
             else:
-                output_decoding = block(output_decoding, output_encoding_flatten)
+                output_decoding = block(output_decoding, output_encoding_flatten, conditions[index])
         # Perform last linear layer + sigmoid activation
         output = self.output_block(output_decoding)
         return output
@@ -313,7 +441,8 @@ class OccupancyNetworkNoCatCNN(nn.Module):
                  downsampling_factor_decoding: Union[int, List[int]] = 2,
                  normalization_decoding: Union[str, List[str]] = 'none',
                  dropout_rate_decoding: Union[float, List[float]] = 0.0,
-                 bias_decoding: Union[bool, List[bool]] = False) -> None:
+                 bias_decoding: Union[bool, List[bool]] = False, encoder_backend: str = 'dense',
+                 sparse_threshold: float = 0.02) -> None:
         # Call super constructor
         super(OccupancyNetworkNoCatCNN, self).__init__()
         # Convert encoding parameters to lists
@@ -360,7 +489,9 @@ class OccupancyNetworkNoCatCNN(nn.Module):
                                            'bias encoding')
 
         # Init encoding blocks
-        self.encoding = nn.Sequential(*[ModelParts.VolumeEncoderBlock(
+        encoder_block = ModelParts.SparseVolumeEncoderBlock if encoder_backend == 'sparse' \
+            else ModelParts.VolumeEncoderBlock
+        self.encoding = Misc.get_encoder(encoder_backend, [encoder_block(
             input_channels=channels_in_encoding_blocks[index][0],
             output_channels=channels_in_encoding_blocks[index][1],
             kernel_size=kernel_size_encoding[index],
@@ -372,7 +503,7 @@ class OccupancyNetworkNoCatCNN(nn.Module):
             normalization=normalization_encoding[index],
             dropout_rate=dropout_rate_encoding[index],
             bias=bias_encoding[index])
-            for index in range(number_of_encoding_blocks)])
+            for index in range(number_of_encoding_blocks)], sparse_threshold)
 
         # Init input coordinate mapping
         self.coordinate_mapping = nn.Sequential(
@@ -398,17 +529,48 @@ class OccupancyNetworkNoCatCNN(nn.Module):
         self.classification = nn.Sequential(nn.Flatten(), nn.Linear(60, 1), nn.Sigmoid())
 
     def forward(self, volume: torch.tensor, coordinates: torch.tensor) -> torch.Tensor:
-        # Perform encoding path
-        output_encoding = self.encoding(volume)
+        """
+        Forward pass of the occupancy network
+        :param volume: (torch.tensor) Input tensor including 3D volume
+        :param coordinates: (torch.tensor) Input tensor including coordinates
+        :return: (torch.tensor) Output tensor
+        """
+        return self.decode(self.encode(volume), coordinates)
+
+    def encode(self, volume: torch.tensor) -> torch.tensor:
+        """
+        Method encodes volumes into latent volumes, which can be decoded for any number of coordinates
+        :param volume: (torch.tensor) Input tensor including 3D volume of shape (batch size, 1, x, y, z)
+        :return: (torch.tensor) Latent volumes of shape (batch size, channels, x_latent, y_latent, z_latent)
+        """
+        return self.encoding(volume)
+
+    def decode(self, latent: torch.tensor, coordinates: torch.tensor, chunk_size: int = None) -> torch.tensor:
+        """
+        Method predicts the occupancy of coordinates in chunks per volume
+        :param latent: (torch.tensor) Latent volumes of shape (batch size, channels, x_latent, y_latent, z_latent)
+        :param coordinates: (torch.tensor) Coordinates of shape (batch size * coordinates, 3)
+        :param chunk_size: (int) Maximal number of coordinates decoded at once, None decodes all coordinates at once
+        :return: (torch.tensor) Occupancy probabilities of shape (batch size * coordinates, 1)
+        """
+        return decode_in_chunks(self.decode_coordinates, latent, coordinates, chunk_size)
+
+    def decode_coordinates(self, output_encoding: torch.tensor, coordinates: torch.tensor) -> torch.tensor:
+        """
+        Decoding path of the occupancy network. The first decoder block is applied in factored form, so the latent
+        volume is convolved once per volume instead of once per coordinate.
+        :param output_encoding: (torch.tensor) Latent volumes of shape (batch size, channels, x_latent, y_latent,
+        z_latent)
+        :param coordinates: (torch.tensor) Coordinates of shape (batch size * coordinates, 3)
+        :return: (torch.tensor) Occupancy probabilities of shape (batch size * coordinates, 1)
+        """
         # Map coordinates
         mapped_coordinates = self.coordinate_mapping(coordinates.view(coordinates.shape[0], 1, 1, 3)).unsqueeze(
             dim=1).permute(0, 1, 3, 2, 4)
-        # Concat output of encoder and coordinates
-        input_decoding = torch.cat((
-            torch.repeat_interleave(output_encoding, int(coordinates.shape[0] / volume.shape[0]),
-                                    dim=0), mapped_coordinates), dim=1)
         # Perform decoding path
-        output_decoding = self.decoding(input_decoding)
+        output_decoding = self.decoding[0].forward_factored(output_encoding, mapped_coordinates)
+        for block in self.decoding[1:]:
+            output_decoding = block(output_decoding)
         # Perform classification
         classification_output = self.classification(output_decoding)
         return classification_output
@@ -0,0 +1,181 @@
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
+import os
+import glob
+
+# Layout of one index entry, every entry describes one array of one sample inside a shard file
+SEGMENT_DTYPE = np.dtype([('name', 'S32'), ('key', 'S32'), ('dtype', 'S8'), ('ndim', np.int8),
+                          ('shape', np.int64, (4,)), ('offset', np.int64), ('nbytes', np.int64)])
+
+
+def get_shard_paths(target_path: str, shard_index: int) -> Tuple[str, str]:
+    """
+    Function returns the path of the data file and of the index file of a shard
+    :param target_path: (str) Folder including the shards
+    :param shard_index: (int) Index of the shard
+    :return: (Tuple[str, str]) Path of data file and path of index file
+    """
+    prefix = os.path.join(target_path, 'shard_{:05d}'.format(shard_index))
+    return prefix + '.bin', prefix + '.idx.npy'
+
+
+def get_complete_shards(target_path: str) -> List[int]:
+    """
+    Function returns the indexes of all shards which are completely written (index file present)
+    :param target_path: (str) Folder including the shards
+    :return: (List[int]) Sorted shard indexes
+    """
+    shard_indexes = []
+    for index_file in glob.glob(os.path.join(target_path, 'shard_*.idx.npy')):
+        shard_indexes.append(int(os.path.basename(index_file)[len('shard_'):-len('.idx.npy')]))
+    return sorted(shard_indexes)
+
+
+class PackedShardWriter(object):
+    """
+    Class writes the arrays of many samples into a few large shard files including an offset index
+    """
+
+    def __init__(self, target_path: str, shard_size_mb: int = 4096, alignment: int = 64) -> None:
+        """
+        Constructor method
+        :param target_path: (str) Folder to store the shards
+        :param shard_size_mb: (int) Size after which a new shard is started
+        :param alignment: (int) Byte alignment of every array inside a shard
+        """
+        self.target_path = target_path
+        self.shard_size = shard_size_mb * 1024 ** 2
+        self.alignment = alignment
+        if not os.path.exists(self.target_path):
+            os.makedirs(self.target_path)
+        # Never overwrite existing shards, continue after the last one
+        complete_shards = get_complete_shards(self.target_path)
+        self.shard_index = complete_shards[-1] + 1 if len(complete_shards) > 0 else 0
+        self.file = None
+        self.segments = []
+        self.position = 0
+
+    def _open_shard(self) -> None:
+        """
+        Method opens a new shard file
+        """
+        data_path, _ = get_shard_paths(self.target_path, self.shard_index)
+        self.file = open(data_path, 'wb')
+        self.segments = []
+        self.position = 0
+
+    def _close_shard(self) -> None:
+        """
+        Method closes the current shard and writes its index, a shard counts as complete after the index is present
+        """
+        if self.file is None:
+            return
+        self.file.close()
+        self.file = None
+        _, index_path = get_shard_paths(self.target_path, self.shard_index)
+        # Write index atomically to ensure readers never see a partial index
+        np.save(index_path + '.tmp.npy', np.array(self.segments, dtype=SEGMENT_DTYPE))
+        os.replace(index_path + '.tmp.npy', index_path)
+        self.shard_index += 1
+
+    def add(self, name: Union[str, int], arrays: Dict[str, np.ndarray]) -> None:
+        """
+        Method appends all arrays of one sample to the current shard
+        :param name: (Union[str, int]) Name of the sample (e.g. file index)
+        :param arrays: (Dict[str, np.ndarray]) Arrays of the sample, e.g. {'volume': ..., 'label': ...}
+        """
+        if self.file is None:
+            self._open_shard()
+        for key, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            assert array.ndim <= 4, 'Only arrays with up to four dimensions can be packed'
+            # Pad to alignment
+            padding = (-self.position) % self.alignment
+            if padding > 0:
+                self.file.write(b'\0' * padding)
+                self.position += padding
+            shape = list(array.shape) + [0] * (4 - array.ndim)
+            self.segments.append((str(name).encode(), key.encode(), array.dtype.str.encode(), array.ndim, shape,
+                                  self.position, array.nbytes))
+            self.file.write(array.tobytes())
+            self.position += array.nbytes
+        # Start new shard if size is reached
+        if self.position >= self.shard_size:
+            self._close_shard()
+
+    def close(self) -> None:
+        """
+        Method closes the writer
+        """
+        self._close_shard()
+
+
+class PackedVolumeStore(object):
+    """
+    Class to read samples from packed shards, every array is a zero-copy slice of a read-only memory map
+    """
+
+    def __init__(self, target_path: str) -> None:
+        """
+        Constructor method
+        :param target_path: (str) Folder including the shards
+        """
+        self.target_path = target_path
+        # Map sample name -> key -> (shard index, segment)
+        self.index = dict()
+        for shard_index in get_complete_shards(self.target_path):
+            _, index_path = get_shard_paths(self.target_path, shard_index)
+            for segment in np.load(index_path):
+                # Later shards overwrite earlier entries of the same sample
+                self.index.setdefault(segment['name'].decode(), dict())[segment['key'].decode()] = (
+                    shard_index, segment)
+        # Memory maps are opened lazily in every process
+        self.memory_maps = dict()
+
+    def __getstate__(self) -> dict:
+        """
+        Memory maps are not transferred to data loader workers, every worker maps the shards on its own.
+        All workers still share one page cache since the same files are mapped.
+        """
+        state = self.__dict__.copy()
+        state['memory_maps'] = dict()
+        return state
+
+    def __contains__(self, name: Union[str, int]) -> bool:
+        return str(name) in self.index
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def names(self) -> List[str]:
+        """
+        Method returns the names of all samples in the store
+        :return: (List[str]) Names of samples
+        """
+        return list(self.index.keys())
+
+    def has(self, name: Union[str, int], key: str) -> bool:
+        """
+        Method checks if an array of a sample is present
+        :param name: (Union[str, int]) Name of the sample
+        :param key: (str) Key of the array
+        :return: (bool) True if present
+        """
+        return str(name) in self.index and key in self.index[str(name)]
+
+    def get(self, name: Union[str, int], key: str) -> np.ndarray:
+        """
+        Method returns an array of a sample
+        :param name: (Union[str, int]) Name of the sample
+        :param key: (str) Key of the array (e.g. 'volume' or 'label')
+        :return: (np.ndarray) Read-only array
+        """
+        shard_index, segment = self.index[str(name)][key]
+        if shard_index not in self.memory_maps:
+            data_path, _ = get_shard_paths(self.target_path, shard_index)
+            self.memory_maps[shard_index] = np.memmap(data_path, dtype=np.uint8, mode='r')
+        offset, nbytes = int(segment['offset']), int(segment['nbytes'])
+        shape = tuple(int(dim) for dim in segment['shape'][:segment['ndim']])
+        return self.memory_maps[shard_index][offset:offset + nbytes].view(np.dtype(segment['dtype'].decode())) \
+            .reshape(shape)
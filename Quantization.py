@@ -0,0 +1,155 @@
+from typing import Dict, Iterable, List
+
+import copy
+import time
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+import Misc
+import ModelParts
+import Models
+
+
+class StaticQuantizedLinear(nn.Module):
+    """
+    Wrapper quantizing the input and dequantizing the output of a linear layer, so a single layer can be quantized
+    statically while the surrounding operations (e.g. conditional batch normalization) stay in float
+    """
+
+    def __init__(self, linear: nn.Linear) -> None:
+        """
+        Constructor method
+        :param linear: (nn.Linear) Linear layer to be quantized
+        """
+        super(StaticQuantizedLinear, self).__init__()
+        self.quant = torch.quantization.QuantStub()
+        self.linear = linear
+        self.dequant = torch.quantization.DeQuantStub()
+
+    def forward(self, input: torch.Tensor) -> torch.Tensor:
+        return self.dequant(self.linear(self.quant(input)))
+
+
+def get_quantizable_linears(occupancy_network: nn.Module) -> List[str]:
+    """
+    Function returns the names of the decoder linear layers which are quantized. The projections predicting gamma and
+    beta of conditional batch normalizations are computed once per volume and read as fused weights, so they stay in
+    float. The same holds for the first linear layer and residual mapping of a latent-factored first block.
+    :param occupancy_network: (nn.Module) Occupancy network
+    :return: (List[str]) Module names
+    """
+    names = []
+    for index, block in enumerate(occupancy_network.decoding):
+        if not isinstance(block, ModelParts.CoordinatesFullyConnectedBlock):
+            continue
+        layers = ['linear_2']
+        if not (index == 0 and Models.is_latent_factorized(occupancy_network)):
+            layers.append('linear_1')
+            if isinstance(block.residual_mapping, nn.Linear):
+                layers.append('residual_mapping')
+        names.extend('decoding.{}.{}'.format(index, layer) for layer in layers)
+    if hasattr(occupancy_network, 'output_block') and isinstance(occupancy_network.output_block[0], nn.Linear):
+        names.append('output_block.0')
+    return names
+
+
+def quantize_dynamic(occupancy_network: nn.Module) -> nn.Module:
+    """
+    Function quantizes the weights of the decoder linear layers to int8, activations are quantized dynamically
+    :param occupancy_network: (nn.Module) Occupancy network
+    :return: (nn.Module) Quantized copy of the network (CPU only)
+    """
+    occupancy_network = copy.deepcopy(occupancy_network).cpu().eval()
+    return torch.quantization.quantize_dynamic(
+        occupancy_network, {name: torch.quantization.default_dynamic_qconfig
+                            for name in get_quantizable_linears(occupancy_network)}, dtype=torch.qint8)
+
+
+@torch.no_grad()
+def quantize_static(occupancy_network: nn.Module, calibration_data: Iterable, number_of_batches: int = 8,
+                    backend: str = 'fbgemm') -> nn.Module:
+    """
+    Function quantizes weights and activations of the decoder linear layers to int8, the activation ranges are
+    calibrated on batches of the calibration data (e.g. a slice of the validation split)
+    :param occupancy_network: (nn.Module) Occupancy network
+    :param calibration_data: (Iterable) Data loader returning volume and coordinates as first elements
+    :param number_of_batches: (int) Number of batches used for calibration
+    :param backend: (str) Quantized engine ('fbgemm' for x86, 'qnnpack' for ARM)
+    :return: (nn.Module) Quantized copy of the network (CPU only)
+    """
+    torch.backends.quantized.engine = backend
+    occupancy_network = copy.deepcopy(occupancy_network).cpu().eval()
+    occupancy_network.qconfig = None
+    for name in get_quantizable_linears(occupancy_network):
+        parent_name, _, child_name = name.rpartition('.')
+        parent = occupancy_network.get_submodule(parent_name)
+        wrapper = StaticQuantizedLinear(getattr(parent, child_name))
+        wrapper.qconfig = torch.quantization.get_default_qconfig(backend)
+        setattr(parent, child_name, wrapper)
+    torch.quantization.prepare(occupancy_network, inplace=True)
+    # Calibrate activation ranges
+    for index, batch in enumerate(calibration_data):
+        if index >= number_of_batches:
+            break
+        occupancy_network(batch[0].float(), batch[1].float())
+    return torch.quantization.convert(occupancy_network, inplace=True)
+
+
+@torch.no_grad()
+def evaluate(occupancy_network: nn.Module, data: Iterable, threshold: float = 0.5,
+             max_batches: int = None) -> Dict[str, float]:
+    """
+    Function evaluates a network on the CPU
+    :param occupancy_network: (nn.Module) Occupancy network
+    :param data: (Iterable) Data loader of a test split (volume, coordinates, labels, actual)
+    :param threshold: (float) Threshold of the occupancy probability
+    :param max_batches: (int) Maximal number of batches
+    :return: (Dict[str, float]) Mean iou, precision, recall and runtime of the network per batch
+    """
+    metrics = {'iou': [], 'precision': [], 'recall': [], 'runtime': []}
+    for index, (volume, coordinates, labels, actual) in enumerate(data):
+        if max_batches is not None and index >= max_batches:
+            break
+        volume, coordinates, actual = volume.float(), coordinates.float(), actual.float()
+        start_time = time.time()
+        prediction = occupancy_network(volume, coordinates)
+        metrics['runtime'].append(time.time() - start_time)
+        metrics['iou'].append(Misc.intersection_over_union(prediction, coordinates, actual[0], threshold).item())
+        metrics['precision'].append(Misc.precision(prediction, coordinates, actual[0], threshold).item())
+        metrics['recall'].append(Misc.recall(prediction, coordinates, actual[0], threshold).item())
+    return {key: float(np.mean(values)) for key, values in metrics.items()}
+
+
+def quantization_report(occupancy_network: nn.Module, calibration_data: Iterable, evaluation_data: Iterable,
+                        number_of_calibration_batches: int = 8, threshold: float = 0.5,
+                        max_batches: int = None) -> Dict[str, Dict[str, float]]:
+    """
+    Function quantizes a network dynamically and statically and reports the metric deltas and the CPU speedup
+    against the float network
+    :param occupancy_network: (nn.Module) Occupancy network
+    :param calibration_data: (Iterable) Data loader of a slice of the validation split
+    :param evaluation_data: (Iterable) Data loader of the evaluation split (test format)
+    :param number_of_calibration_batches: (int) Number of batches used for calibration
+    :param threshold: (float) Threshold of the occupancy probability
+    :param max_batches: (int) Maximal number of evaluated batches
+    :return: (Dict[str, Dict[str, float]]) Metrics of the float network and metrics, deltas and speedup of every
+    quantized network
+    """
+    if isinstance(occupancy_network, nn.DataParallel):
+        occupancy_network = occupancy_network.module
+    occupancy_network = copy.deepcopy(occupancy_network).cpu().eval()
+    report = {'float': evaluate(occupancy_network, evaluation_data, threshold, max_batches)}
+    quantized_networks = {'dynamic': quantize_dynamic(occupancy_network),
+                          'static': quantize_static(occupancy_network, calibration_data,
+                                                    number_of_calibration_batches)}
+    for name, quantized_network in quantized_networks.items():
+        metrics = evaluate(quantized_network, evaluation_data, threshold, max_batches)
+        for metric in ['iou', 'precision', 'recall']:
+            metrics[metric + '_delta'] = metrics[metric] - report['float'][metric]
+        metrics['speedup'] = report['float']['runtime'] / metrics['runtime']
+        report[name] = metrics
+    for name, metrics in report.items():
+        print(name, metrics)
+    return report
@@ -0,0 +1,243 @@
+from typing import Dict, Optional
+
+import numpy as np
+import os
+import atexit
+import hashlib
+import tempfile
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+
+# Layout of one cache entry in the shared metadata table
+SLOT_DTYPE = np.dtype([('key', 'S40'), ('segment', 'S64'), ('dtype', 'S8'), ('ndim', np.int8),
+                       ('shape', np.int64, (4,)), ('nbytes', np.int64), ('last_access', np.int64),
+                       ('valid', np.bool_)])
+# Header fields of the shared metadata table
+HITS, MISSES, EVICTIONS, CLOCK, USED_BYTES, SLOTS = range(6)
+HEADER_SIZE = 8
+
+
+def open_shared_memory(name: str, create: bool = False, size: int = 0) -> shared_memory.SharedMemory:
+    """
+    Function opens a POSIX shared memory segment which is not unlinked when the opening process exits
+    :param name: (str) Name of the segment
+    :param create: (bool) True to create the segment
+    :param size: (int) Size of the segment in bytes (only used if created)
+    :return: (shared_memory.SharedMemory) Shared memory segment
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, create=create, size=size, track=False)
+    except TypeError:
+        # Python < 3.13 registers every segment at the resource tracker, which unlinks it at exit
+        segment = shared_memory.SharedMemory(name=name, create=create, size=size)
+        try:
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(segment._name, 'shared_memory')
+        except Exception:
+            pass
+        return segment
+
+
+class SharedVolumeCache(object):
+    """
+    Cache of decoded arrays in POSIX shared memory. The cache is shared by all data loader workers and by all
+    processes on the same machine using the same cache name. Entries are evicted in LRU order if the memory budget
+    is exceeded. Segments outlive the processes using them, the process constructing the cache removes them by
+    calling unlink (also registered to run at exit).
+    """
+
+    def __init__(self, name: str = 'weapon_volume_cache', budget_mb: int = 8192, max_entries: int = 8192,
+                 unlink_at_exit: bool = True) -> None:
+        """
+        Constructor method
+        :param name: (str) Name of the cache, processes using the same name share the cache
+        :param budget_mb: (int) Maximal memory used by cached arrays
+        :param max_entries: (int) Maximal number of cached arrays, has to match for all processes sharing the cache
+        :param unlink_at_exit: (bool) If true the cache is removed from shared memory when this process exits
+        """
+        self.name = name
+        self.budget = budget_mb * 1024 ** 2
+        self.max_entries = max_entries
+        self.lock_path = os.path.join(tempfile.gettempdir(), name + '.lock')
+        # Handles are opened lazily in every process
+        self.meta_segment = None
+        # Data loader workers receive a pickled copy and do not register the exit handler
+        if unlink_at_exit:
+            atexit.register(self.unlink)
+
+    def __getstate__(self) -> dict:
+        """
+        Shared memory handles are not transferred to data loader workers, every worker attaches on its own
+        """
+        state = self.__dict__.copy()
+        state['meta_segment'] = None
+        return state
+
+    @contextmanager
+    def lock(self):
+        """
+        Inter-process lock guarding the metadata table
+        """
+        import fcntl
+        with open(self.lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _get_meta(self):
+        """
+        Method returns the header and the slot table of the shared metadata (has to be called while locked)
+        :return: (Tuple[np.ndarray, np.ndarray]) Header and slots
+        """
+        if self.meta_segment is None:
+            self._open_meta(create=True)
+        header = np.ndarray((HEADER_SIZE,), dtype=np.int64, buffer=self.meta_segment.buf)
+        slots = np.ndarray((self.max_entries,), dtype=SLOT_DTYPE, buffer=self.meta_segment.buf,
+                           offset=HEADER_SIZE * 8)
+        return header, slots
+
+    def _open_meta(self, create: bool) -> bool:
+        """
+        Method creates or attaches the shared metadata, the slot count of an attached table has to match (has to be
+        called while locked)
+        :param create: (bool) True to create the metadata if it does not exist
+        :return: (bool) True if the metadata is open
+        """
+        size = HEADER_SIZE * 8 + self.max_entries * SLOT_DTYPE.itemsize
+        try:
+            segment = open_shared_memory(self.name + '_meta', create=create, size=size)
+            created = create
+        except FileExistsError:
+            segment = open_shared_memory(self.name + '_meta')
+            created = False
+        except FileNotFoundError:
+            return False
+        header = np.ndarray((HEADER_SIZE,), dtype=np.int64, buffer=segment.buf)
+        if created:
+            header[SLOTS] = self.max_entries
+        slots = int(header[SLOTS])
+        del header
+        if slots != self.max_entries:
+            segment.close()
+            raise ValueError('Cache {} has {} slots but {} were requested'.format(self.name, slots,
+                                                                                  self.max_entries))
+        self.meta_segment = segment
+        return True
+
+    @staticmethod
+    def _hash_key(key: str) -> bytes:
+        return hashlib.sha1(key.encode()).hexdigest().encode()
+
+    @staticmethod
+    def _find(slots: np.ndarray, key: bytes) -> Optional[int]:
+        indexes = np.nonzero(slots['valid'] & (slots['key'] == key))[0]
+        return int(indexes[0]) if indexes.shape[0] > 0 else None
+
+    def _evict(self, header: np.ndarray, slots: np.ndarray, slot_index: int) -> None:
+        """
+        Method removes one entry (has to be called while locked)
+        """
+        try:
+            segment = open_shared_memory(slots[slot_index]['segment'].decode())
+            segment.close()
+            segment.unlink()
+        except FileNotFoundError:
+            pass
+        header[USED_BYTES] -= slots[slot_index]['nbytes']
+        header[EVICTIONS] += 1
+        slots[slot_index]['valid'] = False
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        """
+        Method returns a copy of a cached array
+        :param key: (str) Key of the array
+        :return: (Optional[np.ndarray]) Array or None if not cached
+        """
+        hashed_key = self._hash_key(key)
+        with self.lock():
+            header, slots = self._get_meta()
+            slot_index = self._find(slots, hashed_key)
+            if slot_index is None:
+                header[MISSES] += 1
+                return None
+            header[HITS] += 1
+            header[CLOCK] += 1
+            slots[slot_index]['last_access'] = header[CLOCK]
+            slot = slots[slot_index]
+            shape = tuple(int(dim) for dim in slot['shape'][:slot['ndim']])
+            # Copy while locked, the entry might be evicted afterwards
+            try:
+                segment = open_shared_memory(slot['segment'].decode())
+            except FileNotFoundError:
+                # Cache was unlinked by its owner while this process was still attached
+                slots[slot_index]['valid'] = False
+                return None
+            array = np.ndarray(shape, dtype=np.dtype(slot['dtype'].decode()), buffer=segment.buf).copy()
+            segment.close()
+        return array
+
+    def put(self, key: str, array: np.ndarray) -> None:
+        """
+        Method adds an array to the cache, least recently used entries are evicted to meet the memory budget
+        :param key: (str) Key of the array
+        :param array: (np.ndarray) Array to be cached (up to four dimensions)
+        """
+        if array.nbytes > self.budget or array.ndim > 4:
+            return
+        array = np.ascontiguousarray(array)
+        hashed_key = self._hash_key(key)
+        with self.lock():
+            header, slots = self._get_meta()
+            if self._find(slots, hashed_key) is not None:
+                return
+            # Evict least recently used entries until the array fits
+            while header[USED_BYTES] + array.nbytes > self.budget or np.all(slots['valid']):
+                valid_indexes = np.nonzero(slots['valid'])[0]
+                self._evict(header, slots, int(valid_indexes[np.argmin(slots['last_access'][valid_indexes])]))
+            header[CLOCK] += 1
+            segment_name = '{}_{}'.format(self.name, header[CLOCK])
+            segment = open_shared_memory(segment_name, create=True, size=max(array.nbytes, 1))
+            np.ndarray(array.shape, dtype=array.dtype, buffer=segment.buf)[...] = array
+            segment.close()
+            slot_index = int(np.nonzero(~slots['valid'])[0][0])
+            slots[slot_index] = (hashed_key, segment_name.encode(), array.dtype.str.encode(), array.ndim,
+                                 list(array.shape) + [0] * (4 - array.ndim), array.nbytes, header[CLOCK], True)
+            header[USED_BYTES] += array.nbytes
+
+    def get_statistics(self) -> Dict[str, int]:
+        """
+        Method returns the hit and miss counters and the memory usage of the cache
+        :return: (Dict[str, int]) Statistics
+        """
+        with self.lock():
+            header, slots = self._get_meta()
+            return {'hits': int(header[HITS]), 'misses': int(header[MISSES]), 'evictions': int(header[EVICTIONS]),
+                    'entries': int(np.sum(slots['valid'])), 'used_mb': float(header[USED_BYTES]) / 1024 ** 2}
+
+    def close(self) -> None:
+        """
+        Method closes the handle of this process to the metadata, the cache stays in shared memory
+        """
+        if self.meta_segment is not None:
+            self.meta_segment.close()
+            self.meta_segment = None
+
+    def unlink(self) -> None:
+        """
+        Method removes all entries and the metadata of the cache from shared memory, calling it again has no effect
+        """
+        with self.lock():
+            if self.meta_segment is None and not self._open_meta(create=False):
+                return
+            header, slots = self._get_meta()
+            for slot_index in np.nonzero(slots['valid'])[0]:
+                self._evict(header, slots, int(slot_index))
+            del header, slots
+            self.meta_segment.close()
+            try:
+                self.meta_segment.unlink()
+            except FileNotFoundError:
+                pass
+            self.meta_segment = None
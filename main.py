@@ -39,6 +39,39 @@ parser.add_argument('--small_encoder', type=int, default=0, choices=[0, 1],
 parser.add_argument('--load_model', type=str, default=None,
                     help='Path to model to be loaded (default=None)')
 
+parser.add_argument('--compact', type=int, default=0, choices=[0, 1],
+                    help='Transfer samples in compact format (float16 volumes, int16 coords, uint8 labels) (default=0)')
+
+parser.add_argument('--sampling', type=str, default='one', choices=['default', 'one', 'one_fast', 'content'],
+                    help='Coordinate sampling of the training set, content uses the low resolution volume as '
+                         'proposal for negatives (default=one)')
+
+parser.add_argument('--npoints', type=int, default=2 ** 14,
+                    help='Number of coordinates sampled per training volume (default=16384)')
+
+parser.add_argument('--hard_mining_share', type=float, default=0.0,
+                    help='Share of training coordinates drawn from the hard mining buffer, 0 disables hard mining '
+                         '(default=0.0)')
+
+parser.add_argument('--manifest_path', type=str, default=None,
+                    help='Path to the dataset manifest defining the train/validation/test split (default=None)')
+
+parser.add_argument('--cache_size_mb', type=int, default=0,
+                    help='Memory budget of the shared memory volume cache, 0 disables the cache (default=0)')
+
+parser.add_argument('--pyramid_path', type=str, default=None,
+                    help='Root folder of a generated resolution pyramid, replaces the fixed data folders (default=None)')
+
+parser.add_argument('--empty_space_threshold', type=float, default=None,
+                    help='Skip test coordinates in cells of the low resolution volume below this intensity (after '
+                         'dilation by one cell), None disables skipping (default=None)')
+
+parser.add_argument('--device', type=str, default='cuda', choices=['cuda', 'cpu', 'cpu_bf16'],
+                    help='Execution profile, cpu_bf16 uses bf16 autocast (default=cuda)')
+
+parser.add_argument('--encoder_backend', type=str, default='dense', choices=['dense', 'sparse'],
+                    help='Encoder backend, sparse runs submanifold convolutions on non-air voxels (default=dense)')
+
 args = parser.parse_args()
 
 import os
@@ -54,8 +87,15 @@ import Datasets
 from ModelWrapper import OccupancyNetworkWrapper
 import Misc
 import Lossfunctions
+import VolumeCache
+import HardMining
+import Manifest
+import ExecutionProfile
 
 if __name__ == '__main__':
+    # Init execution profile
+    execution_profile = ExecutionProfile.get_execution_profile(args.device)
+    execution_profile.apply()
     if args.load_model is None:
         if bool(args.small_encoder):
             channels_in_encoding_blocks = [(1, 32), (32, 32), (32, 64), (64, 64), (64, 8)]
@@ -65,13 +105,16 @@ if __name__ == '__main__':
         if bool(args.use_cat):
             model = Models.OccupancyNetwork(
                 normalization_decoding='cbatchnorm' if bool(args.use_cbn) else 'batchnorm',
-                channels_in_encoding_blocks=channels_in_encoding_blocks).cuda()
+                channels_in_encoding_blocks=channels_in_encoding_blocks,
+                encoder_backend=args.encoder_backend)
         else:
             model = Models.OccupancyNetworkNoCat(
                 normalization_decoding='cbatchnorm' if bool(args.use_cbn) else 'batchnorm',
-                channels_in_encoding_blocks=channels_in_encoding_blocks).cuda()
+                channels_in_encoding_blocks=channels_in_encoding_blocks,
+                encoder_backend=args.encoder_backend)
     else:
-        model = torch.load(args.load_model).cuda()
+        model = torch.load(args.load_model, map_location=execution_profile.device)
+    model = execution_profile.prepare_model(model)
     # Utilize data parallel
     if (args.use_data_parallel):
         model = torch.nn.DataParallel(model)
@@ -81,11 +124,34 @@ if __name__ == '__main__':
     print(Misc.get_number_of_network_parameters(model))
     # Init loss function
     if args.loss == 'cross_entropy':
-        loss_function = torch.nn.BCELoss(reduction='mean')
+        loss_function = Lossfunctions.BinaryCrossEntropyLoss(reduce='mean')
     elif args.loss == 'focal':
         loss_function = Lossfunctions.FocalLoss(reduce='mean')
     else:
         loss_function = Lossfunctions.DiceLoss()
+    # Init shared memory cache of volumes and labels used by all data loader workers
+    cache = VolumeCache.SharedVolumeCache(budget_mb=args.cache_size_mb) if args.cache_size_mb > 0 else None
+    # Init dataset splits, either from the manifest or from the fixed file permutation
+    if args.manifest_path is not None:
+        manifest = Manifest.DatasetManifest(args.manifest_path)
+        training_split = dict(manifest_path=args.manifest_path, split='train')
+        test_split = dict(manifest_path=args.manifest_path, split='test')
+        validation_split = dict(manifest_path=args.manifest_path, split='validation')
+        number_of_training_scans = manifest.get_names('train').shape[0]
+    else:
+        training_split = dict(length=2600)
+        test_split = dict(length=306, offset=2600)
+        validation_split = dict(length=36, offset=2906)
+        number_of_training_scans = 2600
+    # Init buffer of hard training coordinates shared by all data loader workers
+    hard_mining_buffer = HardMining.HardCoordinateBuffer(number_of_scans=number_of_training_scans) \
+        if args.hard_mining_share > 0.0 else None
+    # Init data folders, either levels of a resolution pyramid or the fixed folders
+    if args.pyramid_path is not None:
+        data_paths = dict(pyramid_path=args.pyramid_path, label_side_len=1)
+    else:
+        data_paths = dict(target_path_volume='/fastdata/Smiths_LKA_Weapons_Down/len_8/',
+                          target_path_label='/visinf/home/vilab15/Projects/3D_baggage_segmentation/Data_len_1/')
     # Construct folder name to save logs
     folder_name = 'cat_' + str(args.use_cat) + '_cbn_' + str(args.use_cbn) + '_encoder_' + str(args.small_encoder)
     # Init model wrapper
@@ -93,42 +159,52 @@ if __name__ == '__main__':
                                             occupancy_network_optimizer=torch.optim.Adam(
                                                 model.parameters(), lr=args.lr),
                                             training_data=DataLoader(Datasets.WeaponDataset(
-                                                target_path_volume='/fastdata/Smiths_LKA_Weapons_Down/len_8/',
-                                                target_path_label='/visinf/home/vilab15/Projects/3D_baggage_segmentation/Data_len_1/',
-                                                npoints=2 ** 14,
+                                                **data_paths,
+                                                npoints=args.npoints,
                                                 side_len=8,
-                                                length=2600),
+                                                **training_split,
+                                                sampling=args.sampling,
+                                                hard_mining_buffer=hard_mining_buffer,
+                                                hard_share=args.hard_mining_share,
+                                                cache=cache,
+                                                compact=bool(args.compact)),
                                                 batch_size=args.batch_size, shuffle=True,
-                                                collate_fn=Misc.many_to_one_collate_fn_sample,
-                                                num_workers=args.batch_size, pin_memory=True),
+                                                collate_fn=Misc.many_to_one_collate_fn_sample_compact if bool(args.compact)
+                                                else Misc.many_to_one_collate_fn_sample,
+                                                num_workers=args.batch_size,
+                                                pin_memory=execution_profile.device == 'cuda'),
                                             test_data=DataLoader(Datasets.WeaponDataset(
-                                                target_path_volume='/fastdata/Smiths_LKA_Weapons_Down/len_8/',
-                                                target_path_label='/visinf/home/vilab15/Projects/3D_baggage_segmentation/Data_len_1/',
+                                                **data_paths,
                                                 npoints=2 ** 18,
                                                 side_len=8,
-                                                length=306,  # 200,
-                                                offset=2600,  # 2600,
+                                                **test_split,
                                                 test=True,
-                                                share_box=0.0),
+                                                share_box=0.0,
+                                                empty_space_threshold=args.empty_space_threshold,
+                                                cache=cache,
+                                                compact=bool(args.compact)),
                                                 batch_size=1, shuffle=True,
-                                                collate_fn=Misc.many_to_one_collate_fn_sample_down,
-                                                num_workers=1, pin_memory=True,
+                                                collate_fn=Misc.many_to_one_collate_fn_sample_down_compact if bool(args.compact)
+                                                else Misc.many_to_one_collate_fn_sample_down,
+                                                num_workers=1, pin_memory=execution_profile.device == 'cuda',
                                             ),
                                             validation_data=DataLoader(Datasets.WeaponDataset(
-                                                target_path_volume='/fastdata/Smiths_LKA_Weapons_Down/len_8/',
-                                                target_path_label='/visinf/home/vilab15/Projects/3D_baggage_segmentation/Data_len_1/',
+                                                **data_paths,
                                                 npoints=2 ** 16,
                                                 side_len=8,
-                                                length=36,  # 200,
-                                                offset=2906,  # 2600,
+                                                **validation_split,
                                                 test=True,
-                                                share_box=0.0),
+                                                share_box=0.0,
+                                                cache=cache,
+                                                compact=bool(args.compact)),
                                                 batch_size=1, shuffle=True,
-                                                collate_fn=Misc.many_to_one_collate_fn_sample_down,
-                                                num_workers=1, pin_memory=True,
+                                                collate_fn=Misc.many_to_one_collate_fn_sample_down_compact if bool(args.compact)
+                                                else Misc.many_to_one_collate_fn_sample_down,
+                                                num_workers=1, pin_memory=execution_profile.device == 'cuda',
                                             ),
                                             loss_function=loss_function,
-                                            device='cuda',
+                                            device=execution_profile.device,
+                                            execution_profile=execution_profile,
                                             data_folder=folder_name,
                                             save_data_path='Save_data_')
 
@@ -136,3 +212,6 @@ if __name__ == '__main__':
         model_wrapper.train(epochs=args.epochs)
     if bool(args.test):
         model_wrapper.test(side_len=1)
+    if cache is not None:
+        print('Volume cache', cache.get_statistics())
+        cache.unlink()